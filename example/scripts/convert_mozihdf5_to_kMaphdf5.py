@@ -1,6 +1,8 @@
 # Third Party Imports
 import h5py
-import numpy as np
+
+# Own Imports
+from kmap.library.hdf5writer import HDF5Writer
 
 # this script demonstrates how the hdf5-files created by Mozi can be converted to 
 # the format used in kMap.py 
@@ -10,7 +12,6 @@ def mozi_to_kmap(mozi_h5_file,kmap_h5_file,
                  axis1type='+BE'):    # choose between '+BE' or '-BE' (binding energy) or 'E_kin' (kinetic energy)
 
     old     = h5py.File(mozi_h5_file,'r')  # open old hdf5 file
-    new     = h5py.File(kmap_h5_file,'w')  # create new file
 
     # extract information from old hdf5
     oldkeys = ['filenumber','fermiLevel','kStepSize','list_index','list_kAxis','list_BE_real','list_BE',
@@ -41,37 +42,24 @@ def mozi_to_kmap(mozi_h5_file,kmap_h5_file,
                  'sym_anglemax'  : old['sym_anglemax'][()],
                  'symmode'       : old['symmode'][()]}
            
-    # write header info in new hdf5
-    new.create_dataset('name',        data=filenumber)
-    if alias != None: new.create_dataset('alias',data=alias)
-    new.create_dataset('axis_1_label',data=axis1type)
-    new.create_dataset('axis_2_label',data='kx')
-    new.create_dataset('axis_3_label',data='ky')
-    new.create_dataset('axis_1_units',data='eV')
-    new.create_dataset('axis_2_units',data='1/Å')
-    new.create_dataset('axis_3_units',data='1/Å')
-    new.create_dataset('axis_1_range',data=axis_1_range)
-    new.create_dataset('axis_2_range',data=[list_kAxis[0,0],list_kAxis[0,-1]])
-    new.create_dataset('axis_3_range',data=[list_kAxis[0,0],list_kAxis[0,-1]])
-    for key in meta_data:
-        new.create_dataset(key,data=meta_data[key])
-
-    # extract data from old hdf5 and write 3D-array to new hdf5
+    if alias != None: meta_data['alias'] = alias
+
+    # create new file with header info, the data is chunked slice by slice
+    # and compressed as set in the [hdf5] settings
     nx    = len(list_BE)
-    ny    = list_kAxis.shape[1]
-    nz    = ny
-    data  = np.zeros((nx,ny,nz))
-   
+    axes  = [[axis1type, 'eV', axis_1_range],
+             ['kx', '1/Å', [list_kAxis[0,0],list_kAxis[0,-1]]],
+             ['ky', '1/Å', [list_kAxis[0,0],list_kAxis[0,-1]]]]
+    new   = HDF5Writer(kmap_h5_file, nx, filenumber, axes, meta_data)
+
+    # copy kmaps from old hdf5 one by one to the 3D-array in new hdf5
     for count, BE in enumerate(old['data_kmaps']):
         if axis1type == '+BE':
             i = count
         else:
             i = nx - count - 1
 
-        data[i,:,:] = old['data_kmaps'][BE][()]
-
-    new.create_dataset('data',data=data,
-                        dtype='f8',compression='gzip', compression_opts=9)
+        new.write_slice(i, old['data_kmaps'][BE][()])
 
     old.close()
     new.close()
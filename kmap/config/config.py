@@ -67,7 +67,9 @@ class Config:
             raise NotImplementedError('%s not implemented' % file)
 
     def set_key(self, group, key, value, file='general'):
-        pass
+        # Changes the setting for this session only (not written to the
+        # user settings)
+        self.get_config(file)[group][key] = value
 
     def _check_for_user_files(self):
 
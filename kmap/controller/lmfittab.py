@@ -7,7 +7,6 @@ LMFitResult tab as well as a common base class LMFitBaseTab.
 import logging
 
 # Third Party Imports
-import h5py
 import numpy as np
 
 # PyQt5 Imports
@@ -19,6 +18,7 @@ from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QFileDialog
 from kmap import __directory__
 from kmap.library.axis import Axis
 from kmap.library.qwidgetsub import Tab
+from kmap.library.hdf5writer import HDF5Writer
 from kmap.model.lmfit_model import LMFitModel
 from kmap.controller.dataslider import DataSlider
 from kmap.controller.colormap import Colormap
@@ -411,6 +411,10 @@ class LMFitResultTab(LMFitBaseTab, LMFitTab_UI):
         self.open_plot_tab.emit(results, orbitals, axis, residuals)
 
     def export_to_hdf5(self):
+        if not self.results:
+            logging.getLogger('kmap').warning('No results to export.')
+            return
+
         path = config.get_key('paths', 'hdf5_export_start')
         if path == 'None':
             file_name, _ = QFileDialog.getSaveFileName(
@@ -422,35 +426,21 @@ class LMFitResultTab(LMFitBaseTab, LMFitTab_UI):
 
         if not file_name:
             return
-        else:
-            h5file = h5py.File(file_name, 'w')
-
-        kmaps = self.get_residual_kmaps()
-
-        slice_axis = self.slider.data.axes[0]
-        x_axis = self.slider.data.axes[1]
-        y_axis = self.slider.data.axes[2]
-
-        h5file.create_dataset('name', data='Residual')
-        h5file.create_dataset('axis_1_label', data=slice_axis.label)
-        h5file.create_dataset('axis_2_label', data=x_axis.label)
-        h5file.create_dataset('axis_3_label', data=y_axis.label)
-        h5file.create_dataset('axis_1_units', data=slice_axis.units)
-        h5file.create_dataset('axis_2_units', data=x_axis.units)
-        h5file.create_dataset('axis_3_units', data=y_axis.units)
-        h5file.create_dataset('axis_1_range', data=slice_axis.range)
-        h5file.create_dataset('axis_2_range', data=x_axis.range)
-        h5file.create_dataset('axis_3_range', data=y_axis.range)
-        h5file.create_dataset('data', data=kmaps, dtype='f8',
-                              compression='gzip', compression_opts=9)
-        h5file.close()
 
-    def get_residual_kmaps(self):
-        kmaps = []
+        axes = [[axis.label, axis.units, axis.range]
+                for axis in self.slider.data.axes]
+
+        # Each residual is written as soon as it is computed
+        with HDF5Writer(file_name, len(self.results), 'Residual',
+                        axes) as writer:
+            writer.write(self.iter_residual_kmaps())
+
+    def iter_residual_kmaps(self):
         for i, result in enumerate(self.results):
-            residual = self.model.get_residual(i, result[1].params)
-            kmaps.append(residual.data)
-        kmaps = np.array(kmaps)
+            yield self.model.get_residual(i, result[1].params).data
+
+    def get_residual_kmaps(self):
+        kmaps = np.array(list(self.iter_residual_kmaps()))
 
         return kmaps
 
@@ -155,12 +155,16 @@ class MiniRealSpacePlot(GLViewWidget):
 
         color = (0.8, 0.8, 0.8, 1)  # light gray
 
-        for bond in self.orbital.get_bonds():
-            new_bond = GLLinePlotItem(pos=bond, color=color,
-                                      width=5, antialias=True)
-            self.bonds.append(new_bond)
+        bonds = self.orbital.get_bonds()
+        if len(bonds) == 0:
+            return
+
+        # All bonds are drawn as one item (one line per pair of points)
+        new_bond = GLLinePlotItem(pos=bonds.reshape(-1, 3), color=color,
+                                  width=5, antialias=True, mode='lines')
+        self.bonds.append(new_bond)
 
-            self.addItem(new_bond)
+        self.addItem(new_bond)
 
     def _refresh_photon(self):
         # Couldn't find the bug without second part of if so I removed
@@ -392,7 +396,7 @@ class Mini3DKSpacePlot(GLViewWidget):
         if self.orbital is None:
             return
 
-        data = self.orbital.psik['data']
+        data = self.orbital.get_psik_data()
         self.mesh = self._get_iso_mesh(data)
         self.addItem(self.mesh)
 
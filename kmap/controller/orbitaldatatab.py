@@ -2,7 +2,6 @@
 import logging
 
 # Third Party Imports
-import h5py
 import numpy as np
 
 # PyQt5 Imports
@@ -23,6 +22,7 @@ from kmap.controller.interpolation import Interpolation
 from kmap.controller.pyqtgraphplot import PyQtGraphPlot
 from kmap.controller.polarization import Polarization
 from kmap.library.sliceddata import Axis
+from kmap.library.hdf5writer import HDF5Writer
 from kmap.config.config import config
 
 # Load .ui File
@@ -34,6 +34,7 @@ class OrbitalDataTab(Tab, OrbitalDataTab_UI):
     orbital_removed = pyqtSignal(int)
     orbital_added = pyqtSignal(int)
     get_energy = pyqtSignal()
+    prefetch_finished = pyqtSignal()
 
     def __init__(self):
         # Setup GUI
@@ -70,6 +71,12 @@ class OrbitalDataTab(Tab, OrbitalDataTab_UI):
 
         self.table.add_orbital(orbital, orientation)
 
+        # The orbital is plotted once its 3D-FT is computed in the
+        # background, the signal is delivered in the GUI thread
+        future = self.model.get_prefetch(orbital.ID)
+        if future is not None:
+            future.add_done_callback(self._prefetch_done)
+
         self.refresh_plot()
 
         self.orbital_added.emit(orbital.ID)
@@ -117,6 +124,11 @@ class OrbitalDataTab(Tab, OrbitalDataTab_UI):
         return self.table.get_use_by_ID(ID)
 
     def get_displayed_plot_data(self):
+        # The plot leaves out orbitals whose 3D-FT is still computed in
+        # the background, the data returned always contains all of them
+        if self.model.wait_for_prefetches():
+            self.refresh_plot()
+
         return self.model.displayed_plot_data
 
     def crosshair_changed(self):
@@ -161,8 +173,6 @@ class OrbitalDataTab(Tab, OrbitalDataTab_UI):
 
         if not file_name:
             return
-        else:
-            h5file = h5py.File(file_name, 'w')
 
         export_energies = eval(config.get_key('orbital', 'export_energies'))
         if isinstance(export_energies, dict):
@@ -171,32 +181,30 @@ class OrbitalDataTab(Tab, OrbitalDataTab_UI):
                                           export_energies['num'],
                                           endpoint=True)
 
-        kmaps = []
         old_energy = self.cube_options.energy_spinbox.value()
-        for energy in export_energies:
-            self.cube_options.energy_spinbox.setValue(energy)
-            kmaps.append(self.get_displayed_plot_data().data)
+        self.cube_options.energy_spinbox.setValue(export_energies[0])
+        data = self.get_displayed_plot_data()
+        if data is None:
+            print('No orbital is used, nothing to export.')
+            self.cube_options.energy_spinbox.setValue(old_energy)
+            return
+
+        xrange, yrange = data.range
+        axes = [['E_kin', 'eV', [export_energies[0], export_energies[-1]]],
+                ['kx', '1/Å', xrange], ['ky', '1/Å', yrange]]
+
+        # Each kmap is written as soon as it is computed
+        with HDF5Writer(file_name, len(export_energies), 'Orbitals',
+                        axes) as writer:
+            for index, energy in enumerate(export_energies):
+                self.cube_options.energy_spinbox.setValue(energy)
+                writer.write_slice(index,
+                                   self.get_displayed_plot_data().data)
+
         self.cube_options.energy_spinbox.setValue(old_energy)
-        kmaps = np.array(kmaps)
-        xrange, yrange = self.get_displayed_plot_data().range
-
-        h5file.create_dataset('name', data='Orbitals')
-        h5file.create_dataset('axis_1_label', data='E_kin')
-        h5file.create_dataset('axis_2_label', data='kx')
-        h5file.create_dataset('axis_3_label', data='ky')
-        h5file.create_dataset('axis_1_units', data='eV')
-        h5file.create_dataset('axis_2_units', data='1/Å')
-        h5file.create_dataset('axis_3_units', data='1/Å')
-        h5file.create_dataset('axis_1_range', data=[export_energies[0],
-                                                    export_energies[-1]])
-        h5file.create_dataset('axis_2_range', data=xrange)
-        h5file.create_dataset('axis_3_range', data=yrange)
-        h5file.create_dataset('data', data=kmaps, dtype='f8',
-                              compression='gzip', compression_opts=9)
-        h5file.close()
 
     def display_in_matplotlib(self):
-        data = self.model.displayed_plot_data
+        data = self.get_displayed_plot_data()
         LUT = self.plot_item.get_LUT()
 
         window = MatplotlibImageWindow(data, LUT=LUT)
@@ -207,6 +215,8 @@ class OrbitalDataTab(Tab, OrbitalDataTab_UI):
         self.cube_options.set_kinetic_energy(energy)
 
     def closeEvent(self, event):
+        self.prefetch_finished.disconnect()
+        self.model.cancel_prefetches()
         del self.model
 
         Tab.closeEvent(self, event)
@@ -296,7 +306,17 @@ class OrbitalDataTab(Tab, OrbitalDataTab_UI):
 
         self.title = 'Orbitals'
 
+    def _prefetch_done(self, future):
+        # Called in the background thread
+        try:
+            self.prefetch_finished.emit()
+
+        except RuntimeError:
+            # Tab was deleted in the meantime
+            pass
+
     def _connect(self):
+        self.prefetch_finished.connect(self.refresh_plot)
         self.crosshair.crosshair_changed.connect(self.crosshair_changed)
         self.table.orbital_changed.connect(self.orbitals_changed)
         self.table.orbital_removed.connect(self.remove_orbital_by_ID)
@@ -3,6 +3,7 @@ import logging
 
 # PyQt5 Imports
 from PyQt5 import uic
+from PyQt5.QtWidgets import QFileDialog
 
 # Own Imports
 from kmap import __directory__
@@ -14,6 +15,8 @@ from kmap.controller.dataslider import DataSlider
 from kmap.controller.crosshairannulus import CrosshairAnnulus
 from kmap.controller.pyqtgraphplot import PyQtGraphPlot
 from kmap.controller.colormap import Colormap
+from kmap.library.hdf5writer import write_hdf5
+from kmap.config.config import config
 
 # Load .ui File
 UI_file = __directory__ / 'ui/sliceddatatab.ui'
@@ -111,6 +114,22 @@ class SlicedDataTab(Tab, SlicedDataTab_UI):
 
         return self.model.data
 
+    def export_to_hdf5(self):
+        path = config.get_key('paths', 'hdf5_export_start')
+        if path == 'None':
+            file_name, _ = QFileDialog.getSaveFileName(
+                None, 'Save .hdf5 File (*.hdf5)')
+        else:
+            start_path = str(__directory__ / path)
+            file_name, _ = QFileDialog.getSaveFileName(
+                None, 'Save .hdf5 File (*.hdf5)', str(start_path))
+
+        if not file_name:
+            return
+
+        # Written in the data type it is stored in
+        write_hdf5(file_name, self.model.data)
+
     def get_axis(self):
 
         return self.slider.get_axis()
@@ -158,6 +177,7 @@ class SlicedDataTab(Tab, SlicedDataTab_UI):
 
     def closeEvent(self, event):
 
+        self.model.close()
         del self.model
 
         Tab.closeEvent(self, event)
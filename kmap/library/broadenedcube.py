@@ -0,0 +1,96 @@
+"""Defines the BroadenedCube class.
+
+This file defines a class named BroadenedCube designed to represent the
+3D array data[BE, ky, kx] of kmaps of several orbitals broadened in
+energy by a Gaussian without storing it. Only the kmaps of the orbitals
+are stored, any part of the array is computed when it is indexed as
+weighted sum of them.
+"""
+
+# Third Party Imports
+import numpy as np
+
+
+class BroadenedCube():
+    """Array-like data[BE, ky, kx] of energy broadened kmaps.
+
+    Supports basic indexing (integers and slices) like a np.array, e.g.
+    'cube[3]', 'cube[:, 10, :]' or 'cube[()]' for the full array. Points
+    outside the photoemission horizon are NaN.
+    """
+
+    def __init__(self, kmaps, energies, orbital_energies, broadening,
+                 radius, horizon):
+        """
+        Args:
+            kmaps (np.array): kmaps[orbital, ky, kx] of the orbitals
+                without NaNs.
+            energies (np.array): 1D array of binding energies of the
+                first axis.
+            orbital_energies (np.array): Binding energy of each orbital.
+            broadening (float): Width of the Gaussian energy broadening
+                in eV.
+            radius (np.array): Length of the parallel momentum at each
+                (ky, kx) point.
+            horizon (np.array): Photoemission horizon (maximal parallel
+                momentum) for each binding energy.
+        """
+
+        self.kmaps = kmaps
+        self.energies = np.asarray(energies, dtype=np.float64)
+        self.orbital_energies = np.asarray(orbital_energies,
+                                           dtype=np.float64)
+        self.radius = radius
+        self.horizon = np.asarray(horizon, dtype=np.float64)
+
+        self.shape = (len(self.energies),) + kmaps.shape[1:]
+        self.ndim = 3
+        self.dtype = np.dtype(np.float64)
+
+        self.set_broadening(broadening)
+
+    def set_broadening(self, broadening):
+        """Changes the width of the Gaussian energy broadening.
+
+        Args:
+            broadening (float): Width of the Gaussian in eV.
+        """
+
+        self.broadening = broadening
+        norm = (1 / np.sqrt(2 * np.pi * broadening**2))
+        self.weights = norm * np.exp(
+            -((self.energies[:, np.newaxis] - self.orbital_energies)**2 /
+              (2 * broadening**2)))
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if any(item is Ellipsis for item in key):
+            if len(key) > 1:
+                raise IndexError('Ellipsis only supported on its own')
+
+            key = ()
+
+        energies, *k = key + (slice(None),) * (3 - len(key))
+        for item in key:
+            if not isinstance(item, (slice, int, np.integer)):
+                raise IndexError('only integers and slices are supported')
+
+        # Weighted sum over the orbitals (one matrix product)
+        kmaps = self.kmaps[(slice(None),) + tuple(k)]
+        data = np.tensordot(self.weights[energies], kmaps, axes=(-1, 0))
+
+        # set NaNs outside photoemission horizon
+        horizon = np.asarray(self.horizon[energies])
+        radius = self.radius[tuple(k)]
+        out = radius > horizon.reshape(horizon.shape + (1,) * radius.ndim)
+        data[out] = np.nan
+
+        return data
+
+    def __array__(self, dtype=None):
+        data = self[()]
+
+        return data if dtype is None else data.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
@@ -0,0 +1,455 @@
+"""Defines the DiskCache and LRUCache classes.
+
+This file defines a class named DiskCache designed to persistently store
+NumPy arrays on disk in a memory-mappable format and a class named
+LRUCache holding NumPy arrays in memory. Entries are addressed by a key
+(usually a content hash or a tuple of parameters) and the least recently
+used entries are removed once a cache grows beyond its size limit. It
+also provides functions to share memory-mapped arrays between processes
+by reference instead of copying them.
+"""
+
+# Python Imports
+import os
+import mmap
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+# Third Party Imports
+import numpy as np
+
+# Directory of files held in memory (tmpfs) on Linux
+SHARED_MEMORY = '/dev/shm'
+
+
+class DiskCache():
+    """On-disk cache of NumPy arrays.
+
+    Every entry is a directory named after its key holding one '.npy'
+    file per array and a 'meta.json' file with additional (JSON
+    serializable) information. Arrays are loaded as read-only memory
+    maps so loading an entry is almost instant regardless of its size.
+    """
+
+    def __init__(self, directory, max_size=2048):
+        """
+        Args:
+            directory (str or Path): Directory the cache lives in. Will
+                be created if it does not exist yet.
+            max_size (float): Maximum size of the cache in MB. Set to
+                None for an unlimited cache.
+        """
+
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def load(self, key):
+        """Loads an entry from the cache.
+
+        Args:
+            key (str): Key of the entry.
+
+        Returns:
+            (tuple): Dictionary of read-only memory-mapped arrays and
+                the meta data dictionary. None if there is no such entry.
+        """
+
+        entry = self.directory / key
+        meta_path = entry / 'meta.json'
+
+        try:
+            with open(meta_path, 'r') as file:
+                meta = json.load(file)
+
+            arrays = {name: np.load(entry / (name + '.npy'), mmap_mode='r')
+                      for name in meta.pop('arrays')}
+
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Mark entry as recently used
+        try:
+            os.utime(meta_path)
+
+        except OSError:
+            pass
+
+        return arrays, meta
+
+    def store(self, key, arrays, meta={}):
+        """Stores an entry in the cache and evicts the least recently
+        used entries if the size limit is exceeded.
+
+        Args:
+            key (str): Key of the entry.
+            arrays (dict): Dictionary of arrays to be stored.
+            meta (dict): Additional JSON serializable information.
+        """
+
+        entry = self.directory / key
+        if entry.exists():
+            return
+
+        # Write to a temporary directory first and rename afterwards so
+        # no half written entry can ever be loaded
+        temporary = self.directory / ('.%s-%s' % (key, uuid.uuid4().hex))
+        try:
+            temporary.mkdir(parents=True)
+            for name, array in arrays.items():
+                np.save(temporary / (name + '.npy'), np.asarray(array))
+
+            meta = dict(meta, arrays=list(arrays.keys()))
+            with open(temporary / 'meta.json', 'w') as file:
+                json.dump(meta, file)
+
+            os.rename(temporary, entry)
+
+        except OSError as error:
+            logging.getLogger('kmap').warning(
+                'Could not write cache entry %s (%s)' % (key, error))
+            shutil.rmtree(temporary, ignore_errors=True)
+
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache is
+        smaller than its size limit."""
+
+        if self.max_size is None:
+            return
+
+        entries = []
+        for entry in self.directory.iterdir():
+            meta_path = entry / 'meta.json'
+            if entry.name.startswith('.') or not meta_path.exists():
+                continue
+
+            size = sum(file.stat().st_size for file in entry.iterdir())
+            entries.append([meta_path.stat().st_mtime, size, entry])
+
+        total = sum(entry[1] for entry in entries)
+        for _, size, entry in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_size * 1024**2:
+                break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class LRUCache():
+    """In-memory cache of NumPy arrays with a size limit.
+
+    Values can be arrays or tuples, lists and dictionaries containing
+    arrays (and other small objects). Arrays are made read-only when
+    they are stored so a cached value can safely be handed out several
+    times. Access is thread-safe. Pickled caches are restored empty.
+    """
+
+    def __init__(self, max_size=64, max_entries=None):
+        """
+        Args:
+            max_size (float): Maximum size of all arrays in the cache in
+                MB. Set to None for no limit and to 0 to disable the
+                cache.
+            max_entries (int): Maximum number of entries. Set to None
+                for no limit.
+        """
+
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Only the limits are pickled, the copy starts empty
+        return {'max_size': self.max_size, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+
+        self.__init__(**state)
+
+    def get(self, key):
+        """Returns an entry and marks it as recently used.
+
+        Args:
+            key (hashable): Key of the entry.
+
+        Returns:
+            (object): Cached value. None if there is no such entry.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+            else:
+                self.misses += 1
+                return None
+
+    def put(self, key, value):
+        """Stores an entry and evicts the least recently used entries
+        if a limit is exceeded. Values larger than the size limit are
+        not stored.
+
+        Args:
+            key (hashable): Key of the entry.
+            value (object): Value to be stored.
+        """
+
+        arrays = _find_arrays(value)
+        size = sum(array.nbytes for array in arrays)
+        if self.max_size is not None and size > self.max_size * 1024**2:
+            return
+
+        for array in arrays:
+            array.setflags(write=False)
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, size)
+            self.size += size
+
+            while self._entries and (
+                    (self.max_size is not None and
+                     self.size > self.max_size * 1024**2) or
+                    (self.max_entries is not None and
+                     len(self._entries) > self.max_entries)):
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.size -= old_size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def info(self):
+        """Returns usage statistics of the cache.
+
+        Returns:
+            (dict): Number of 'hits' and 'misses', number of 'entries'
+                and 'size' of all entries in bytes.
+        """
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'size': self.size}
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def __contains__(self, key):
+
+        return key in self._entries
+
+
+def _find_arrays(value):
+    # Returns all NumPy arrays inside (nested) tuples, lists and dicts
+    if isinstance(value, np.ndarray):
+        return [value]
+
+    elif isinstance(value, (tuple, list)):
+        return [array for item in value for array in _find_arrays(item)]
+
+    elif isinstance(value, dict):
+        return [array for item in value.values()
+                for array in _find_arrays(item)]
+
+    else:
+        return []
+
+
+def hash_bytes(source, chunk_size=2**24):
+    """Returns a hash of the content of a file or a bytes object.
+
+    Args:
+        source (bytes, str or Path): Either the content itself or the
+            path to the file to be hashed.
+        chunk_size (int): Number of bytes read from the file at once.
+
+    Returns:
+        (str): Hexadecimal representation of the hash.
+    """
+
+    hash_ = _new_hash()
+    if isinstance(source, bytes):
+        hash_.update(source)
+
+    else:
+        with open(source, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                hash_.update(chunk)
+
+    return hash_.hexdigest()
+
+
+class HashingReader():
+    """Wraps a (text or binary) file object and hashes everything read
+    from it, thus a stream can be hashed while it is parsed. The hash
+    is the same 'hash_bytes' returns for its (encoded) content.
+    """
+
+    def __init__(self, file):
+        """
+        Args:
+            file (file): File object to be read.
+        """
+
+        self.file = file
+        self._hash = _new_hash()
+
+    def read(self, size=-1):
+        return self._update(self.file.read(size))
+
+    def readline(self, size=-1):
+        return self._update(self.file.readline(size))
+
+    def hexdigest(self, chunk_size=2**24):
+        """Reads the rest of the file and returns the hash of its
+        content.
+
+        Args:
+            chunk_size (int): Number of bytes read at once.
+
+        Returns:
+            (str): Hexadecimal representation of the hash.
+        """
+
+        while self.read(chunk_size):
+            pass
+
+        return self._hash.hexdigest()
+
+    def _update(self, data):
+        self._hash.update(data.encode() if isinstance(data, str) else data)
+
+        return data
+
+
+def share_array(array, directory=None):
+    """Writes an array to a memory-mappable file and returns it memory
+    mapped (read-only). Other processes can map the same file via
+    'memmap_reference' and 'open_memmap_reference' instead of copying
+    the array.
+
+    Args:
+        array (np.array): Array to be shared.
+        directory (str): Directory the file is written to. Defaults to
+            '/dev/shm' (memory, not disk) if available and the
+            temporary directory otherwise.
+
+    Returns:
+        (np.memmap): Read-only memory-mapped copy of the array.
+    """
+
+    if directory is None:
+        directory = SHARED_MEMORY if os.path.isdir(SHARED_MEMORY) else None
+
+    descriptor, path = tempfile.mkstemp(prefix='kmap-', suffix='.npy',
+                                        dir=directory)
+    with os.fdopen(descriptor, 'wb') as file:
+        np.save(file, np.asarray(array))
+
+    return np.load(path, mmap_mode='r')
+
+
+def in_shared_memory(array):
+    """Returns True if an array is memory mapped from a file in shared
+    memory ('/dev/shm'). Such arrays are held in RAM like any other
+    array, not on disk.
+
+    Args:
+        array (np.array): Array possibly memory mapped from a file.
+
+    Returns:
+        (bool): True if the file is in shared memory.
+    """
+
+    filename = getattr(array, 'filename', None)
+    if filename is None:
+        return False
+
+    directory = os.path.realpath(SHARED_MEMORY)
+
+    return os.path.commonpath([os.path.realpath(filename),
+                               directory]) == directory
+
+
+def memmap_reference(array):
+    """Returns a reference to the file an array is memory mapped from
+    or None if the array is not a complete read-only memory map of a
+    file (e.g. a view or an array in memory).
+
+    Args:
+        array (np.array): Array possibly memory mapped from a file.
+
+    Returns:
+        (dict): File name, offset, shape, dtype and order of the array.
+    """
+
+    if (not isinstance(array, np.memmap) or array.filename is None or
+            array.mode != 'r' or not isinstance(array.base, mmap.mmap)):
+        return None
+
+    # The map starts at the offset rounded down to the allocation
+    # granularity and has to contain exactly the array
+    start = array.offset % mmap.ALLOCATIONGRANULARITY
+    base = np.frombuffer(array.base, dtype=np.uint8)
+    if (len(base) != start + array.nbytes or
+            array.ctypes.data != base.ctypes.data + start or
+            not (array.flags.c_contiguous or array.flags.f_contiguous)):
+        return None
+
+    return {'filename': array.filename, 'offset': array.offset,
+            'shape': array.shape, 'dtype': array.dtype.str,
+            'order': 'C' if array.flags.c_contiguous else 'F'}
+
+
+def open_memmap_reference(reference):
+    """Maps the array a reference from 'memmap_reference' points to.
+
+    Args:
+        reference (dict): Reference returned by 'memmap_reference'.
+
+    Returns:
+        (np.memmap): Read-only memory-mapped array. None if the file
+            does not exist (anymore).
+    """
+
+    try:
+        return np.memmap(reference['filename'], mode='r',
+                         dtype=reference['dtype'],
+                         offset=reference['offset'],
+                         shape=tuple(reference['shape']),
+                         order=reference['order'])
+
+    except (OSError, ValueError):
+        return None
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=20)
@@ -0,0 +1,309 @@
+"""Provides a fast reader for cube files.
+
+This file defines methods to read cube files either from a path, a file
+object or a string holding the entire file. The header and atom lines
+are read line by line while the volumetric data block is parsed in bulk
+with NumPy, chunk by chunk, directly into a preallocated array. Parsed
+cube files can be kept in a DiskCache keyed by the hash of their bytes
+and are shared in memory by all loads of the same file.
+"""
+
+# Python Imports
+import weakref
+import threading
+from pathlib import Path
+
+# Third Party Imports
+import numpy as np
+
+# Own Imports
+from kmap.library.cache import hash_bytes, HashingReader
+
+# Conversion factor from Bohr to Angstroem
+BOHR_TO_ANGSTROEM = 0.529177105787531
+# Number of characters (bytes) of the volumetric block parsed at once
+CHUNK_SIZE = 2**24
+
+# Cube files loaded by 'load_cube' by hash, as long as their data is used
+_shared_cubes = {}
+_shared_lock = threading.Lock()
+
+
+def read_cube(source, chunk_size=CHUNK_SIZE):
+    """Reads a cube file.
+
+    Args:
+        source (str, Path or file): Either the path to a cube file, the
+            entire cube file as one string (or bytes) or a text or
+            binary file object positioned at the start of a cube file.
+        chunk_size (int): Number of characters of the volumetric data
+            block read and parsed in one go.
+
+    Returns:
+        (dict): Dictionary with the keys 'comments' (first two lines of
+            the file), 'psi' (real space grid and data) and 'molecule'
+            (atomic numbers and coordinates).
+    """
+
+    if isinstance(source, (str, bytes)) and _is_content(source):
+        header, start = _split_lines(source, 6, 0)
+        num_atom = abs(int(header[2].split()[0]))
+        atoms, start = _split_lines(source, num_atom, start)
+        cube = _parse_header(header, atoms)
+        chunks = (source[i:i + chunk_size]
+                  for i in range(start, len(source), chunk_size))
+        cube['psi']['data'] = _parse_volume(chunks, cube['psi'])
+
+    elif isinstance(source, (str, bytes, Path)):
+        with open(source, 'rb') as file:
+            cube = _read_cube_file(file, chunk_size)
+
+    else:
+        cube = _read_cube_file(source, chunk_size)
+
+    return cube
+
+
+def load_cube(source, cache=None):
+    """Reads a cube file. Cube files with the same content share their
+    (read-only) data array as long as it is in use anywhere. If a cache
+    is passed the parsed cube file is taken from the cache if possible
+    and stored there otherwise.
+
+    Args:
+        source (str, Path or file): See 'read_cube'.
+        cache (DiskCache): Cache for parsed cube files. None to parse
+            cube files not in use at the moment.
+
+    Returns:
+        (dict): See 'read_cube'. The dictionary additionally holds the
+            hash of the cube file under 'hash' and the path to the cube
+            file (if any) under 'source'. The data array is read-only
+            (a memory map if a cache was used).
+    """
+
+    # The hash is always computed from the bytes of the cube file
+    if isinstance(source, str) and _is_content(source):
+        source = source.encode()
+
+    elif not isinstance(source, (str, bytes, Path)):
+        return _load_cube_stream(source, cache)
+
+    hash_ = hash_bytes(source)
+    cube = _shared_cube(hash_)
+    if cube is None and cache is not None:
+        entry = cache.load('cube-' + hash_)
+        if entry is not None:
+            cube = _cube_from_entry(*entry)
+
+        else:
+            cube = read_cube(source)
+            cache.store('cube-' + hash_, *_cube_to_entry(cube))
+
+    elif cube is None:
+        cube = read_cube(source)
+
+    return _share_loaded_cube(hash_, cube, source)
+
+
+def _load_cube_stream(file, cache):
+    # The content of a stream (e.g. a download) is only known once it is
+    # read, thus it is hashed while it is parsed instead of being read
+    # into memory as a whole first
+    reader = HashingReader(file)
+    cube = read_cube(reader)
+    hash_ = reader.hexdigest()
+
+    shared = _shared_cube(hash_)
+    if shared is not None:
+        cube = shared
+
+    elif cache is not None:
+        entry = cache.load('cube-' + hash_)
+        if entry is not None:
+            cube = _cube_from_entry(*entry)
+
+        else:
+            cache.store('cube-' + hash_, *_cube_to_entry(cube))
+
+    return _share_loaded_cube(hash_, cube, None)
+
+
+def _share_loaded_cube(hash_, cube, source):
+    cube['psi']['data'].setflags(write=False)
+    _share_cube(hash_, cube)
+    cube['hash'] = hash_
+    cube['source'] = source if isinstance(source, (str, Path)) else None
+
+    return cube
+
+
+def _shared_cube(hash_):
+    # Returns a cube file with the given hash whose data is still in
+    # use (None if there is none)
+    with _shared_lock:
+        entry = _shared_cubes.get(hash_)
+
+    data = entry[0]() if entry is not None else None
+    if data is None:
+        return None
+
+    cube = entry[1]
+
+    return dict(cube, psi=dict(cube['psi'], data=data))
+
+
+def _share_cube(hash_, cube):
+    # Remembers a cube file (without a strong reference to its data) so
+    # it is shared by later loads of the same file
+    def remove(reference):
+        with _shared_lock:
+            if _shared_cubes.get(hash_, [None])[0] is reference:
+                del _shared_cubes[hash_]
+
+    reference = weakref.ref(cube['psi']['data'], remove)
+    header = dict(cube, psi=dict(cube['psi'], data=None))
+    with _shared_lock:
+        _shared_cubes[hash_] = (reference, header)
+
+
+def _cube_to_entry(cube):
+    psi, molecule = cube['psi'], cube['molecule']
+    arrays = {'data': psi['data'], 'x': psi['x'], 'y': psi['y'],
+              'z': psi['z'],
+              'atomic_coordinates': molecule['atomic_coordinates'],
+              'chemical_numbers': np.array(molecule['chemical_numbers'],
+                                           dtype=np.int64)}
+    meta = {'comments': cube['comments'],
+            'grid': {key: psi[key] for key in ['name', 'nx', 'ny', 'nz',
+                                               'dx', 'dy', 'dz']},
+            'num_atom': molecule['num_atom']}
+
+    return arrays, meta
+
+
+def _cube_from_entry(arrays, meta):
+    psi = dict(meta['grid'], x=np.array(arrays['x']),
+               y=np.array(arrays['y']), z=np.array(arrays['z']),
+               data=arrays['data'])
+    molecule = {'num_atom': meta['num_atom'],
+                'chemical_numbers': [int(number) for number in
+                                     arrays['chemical_numbers']],
+                'atomic_coordinates': np.array(
+                    arrays['atomic_coordinates'])}
+
+    return {'comments': tuple(meta['comments']), 'psi': psi,
+            'molecule': molecule}
+
+
+def _read_cube_file(file, chunk_size):
+    header = [file.readline() for _ in range(6)]
+    num_atom = abs(int(header[2].split()[0]))
+    atoms = [file.readline() for _ in range(num_atom)]
+
+    cube = _parse_header(header, atoms)
+    chunks = iter(lambda: file.read(chunk_size), header[0][:0])
+    cube['psi']['data'] = _parse_volume(chunks, cube['psi'])
+
+    return cube
+
+
+def _parse_header(header, atoms):
+    header = [_to_str(line) for line in header]
+    b2a = BOHR_TO_ANGSTROEM
+
+    comments = (header[0].strip(), header[1].strip())
+    name = comments[1]
+
+    # Set up real space grid info
+    words = header[2].split()
+    x0, y0, z0 = b2a * float(words[1]), b2a * float(
+        words[2]), b2a * float(words[3])
+    nx, ny, nz = [int(line.split()[0]) for line in header[3:6]]
+    dx, dy, dz = [b2a * float(line.split()[i + 1])
+                  for i, line in enumerate(header[3:6])]
+    lx, ly, lz = (nx - 1) * dx, (ny - 1) * dy, (nz - 1) * dz
+    x = np.linspace(x0, x0 + lx, nx)
+    y = np.linspace(y0, y0 + ly, ny)
+    z = np.linspace(z0, z0 + lz, nz)
+
+    # Read atomic coordinates
+    chemical_numbers = []
+    atomic_coordinates = []
+    for line in atoms:
+        words = _to_str(line).split()
+        chemical_numbers.append(int(words[0]))
+        a, b, c = float(words[2]), float(words[3]), float(words[4])
+        atomic_coordinates.append([b2a * a, b2a * b, b2a * c])
+
+    psi = {'name': name,
+           'nx': nx, 'ny': ny, 'nz': nz,
+           'dx': dx, 'dy': dy, 'dz': dz,
+           'x': x, 'y': y, 'z': z}
+    molecule = {'num_atom': len(atoms),
+                'chemical_numbers': chemical_numbers,
+                'atomic_coordinates': np.array(atomic_coordinates)}
+
+    return {'comments': comments, 'psi': psi, 'molecule': molecule}
+
+
+def _parse_volume(chunks, psi):
+    # Parse chunk after chunk directly into the final array. A number
+    # cut in half at the end of a chunk is carried over to the next one.
+    data = np.empty(psi['nx'] * psi['ny'] * psi['nz'], dtype=np.float64)
+    filled = 0
+    remainder = ''
+
+    for chunk in chunks:
+        chunk = remainder + _to_str(chunk)
+        cut = max(chunk.rfind(' '), chunk.rfind('\n'))
+        if cut == -1:
+            remainder = chunk
+            continue
+
+        filled = _fill(data, filled, chunk[:cut])
+        remainder = chunk[cut:]
+
+    filled = _fill(data, filled, remainder)
+    if filled != len(data):
+        raise ValueError('cube file contains %i instead of %i values' % (
+            filled, len(data)))
+
+    return data.reshape(psi['nx'], psi['ny'], psi['nz'])
+
+
+def _fill(data, filled, text):
+    # np.fromstring returns garbage for strings made of whitespace only
+    if not text or text.isspace():
+        return filled
+
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    if filled + len(values) > len(data):
+        raise ValueError('cube file contains more values than expected')
+
+    data[filled:filled + len(values)] = values
+
+    return filled + len(values)
+
+
+def _split_lines(source, num, start):
+    newline = '\n' if isinstance(source, str) else b'\n'
+    lines = []
+    for _ in range(num):
+        end = source.index(newline, start) + 1
+        lines.append(source[start:end])
+        start = end
+
+    return lines, start
+
+
+def _is_content(source):
+    # Paths never span multiple lines, cube files always do
+    newline = '\n' if isinstance(source, str) else b'\n'
+
+    return newline in source[:4096]
+
+
+def _to_str(text):
+    # Cube files are read as UTF-8 (comments may hold any character)
+    return text.decode('utf-8') if isinstance(text, bytes) else text
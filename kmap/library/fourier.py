@@ -0,0 +1,273 @@
+"""Provides the FFT backend for the 3D-Fourier-Transform of orbitals.
+
+This file defines methods to compute centered 3D-FFTs of zero padded
+real space data restricted to a window in momentum space. The backend
+uses the multithreaded 'scipy.fft' module, real-input transforms
+(halving time and memory), places the data directly into the shifted
+layout instead of padding and shifting separately and only ever copies
+the requested momentum window out of the transform. Additionally, the
+Fourier transform can be evaluated directly (without FFT, padding or
+interpolation) at arbitrary points in momentum space.
+"""
+
+# Python Imports
+import os
+
+# Third Party Imports
+import numpy as np
+import scipy.fft
+
+
+def fft_size(n, fast=False):
+    """Returns the size the FFT is computed with.
+
+    Args:
+        n (int): Minimal size needed.
+        fast (bool): If True, the next size >= n that can be computed
+            efficiently (product of small primes) is returned.
+
+    Returns:
+        (int): Size of the FFT.
+    """
+
+    return scipy.fft.next_fast_len(n, real=True) if fast else n
+
+
+def get_workers(workers):
+    """Returns the number of threads used for a given workers setting.
+
+    Args:
+        workers (int): Number of threads. Negative values wrap around
+            the number of CPUs available (-1 means all of them).
+
+    Returns:
+        (int): Number of threads.
+    """
+
+    if workers is None:
+        return 1
+
+    elif workers < 0:
+        return max(os.cpu_count() + 1 + workers, 1)
+
+    else:
+        return workers
+
+
+def windowed_fft(data, shape, windows, workers=-1, precision='float64'):
+    """Computes the centered 3D-FFT of 'data' zero padded to 'shape'
+    and returns only a window of it.
+
+    The result is identical to cropping
+    'fftshift(fftn(ifftshift(pad(data))))' to the window, where the data
+    is padded symmetrically around its center (index n//2).
+
+    Args:
+        data (np.array): 3D real space data or a stack of several of
+            them along leading axes (all transformed in one batched
+            call).
+        shape (tuple): Size of the FFT along each of the last three
+            axes. Has to be at least as large as the data.
+        windows (tuple): Three 1D index arrays (in centered order, i.e.
+            index nk//2 is k = 0) specifying the window to be returned.
+        workers (int): Number of threads used (-1 for all CPUs).
+        precision (str): Either 'float64' or 'float32'. In 'float32'
+            the transform is computed and returned in single precision
+            (complex64) which halves its memory.
+
+    Returns:
+        (tuple): Complex window of the FFT and peak memory in bytes
+            used for arrays during the transform.
+    """
+
+    workers = get_workers(workers)
+
+    # Place data directly at the position an 'ifftshift' of the padded
+    # array would move it to (one pass, no extra padded copy)
+    batch = data.shape[:-3]
+    positions = [(np.arange(n) - n // 2) % nk
+                 for n, nk in zip(data.shape[-3:], shape)]
+    real = not np.iscomplexobj(data)
+    if real:
+        dtype = np.float32 if precision == 'float32' else np.float64
+
+    else:
+        dtype = np.complex64 if precision == 'float32' else np.complex128
+
+    padded = np.zeros(batch + tuple(shape), dtype=dtype)
+    padded[(Ellipsis,) + np.ix_(*positions)] = data
+    axes = (-3, -2, -1)
+
+    # Window indices in the unshifted order of the FFT output
+    ix, iy, iz = [(np.asarray(window) - nk // 2) % nk
+                  for window, nk in zip(windows, shape)]
+
+    if real:
+        transform = scipy.fft.rfftn(padded, axes=axes, overwrite_x=True,
+                                    workers=workers)
+        memory = padded.nbytes
+        del padded
+
+        # Only non-negative frequencies of the last axis are stored,
+        # the others follow from X(-k) = X(k)*
+        nkx, nky, nkz = shape
+        positive = iz <= nkz // 2
+        window = np.empty(batch + (len(ix), len(iy), len(iz)),
+                          dtype=transform.dtype)
+        window[..., positive] = transform[
+            (Ellipsis,) + np.ix_(ix, iy, iz[positive])]
+        window[..., ~positive] = np.conj(transform[(Ellipsis,) + np.ix_(
+            (-ix) % nkx, (-iy) % nky, nkz - iz[~positive])])
+
+    else:
+        transform = scipy.fft.fftn(padded, axes=axes, overwrite_x=True,
+                                   workers=workers)
+        # The transform might have been computed in place
+        memory = 0 if np.shares_memory(transform, padded) else padded.nbytes
+        del padded
+
+        window = transform[(Ellipsis,) + np.ix_(ix, iy, iz)]
+
+    peak_memory = transform.nbytes + max(memory, window.nbytes)
+
+    return window, peak_memory
+
+
+def direct_transform(data, spacing, points, memory=256, precision='float64'):
+    """Evaluates the Fourier transform of 'data' directly at arbitrary
+    points in momentum space.
+
+    The result is 'sum_j data_j * exp(-i k r_j)' where the positions
+    r_j are relative to the grid point at index n//2 along each axis
+    (the same origin 'windowed_fft' uses), i.e. it equals the FFT at
+    its grid frequencies without any zero padding or interpolation.
+
+    Args:
+        data (np.array): 3D real space data.
+        spacing (tuple): Grid spacing (dx, dy, dz) of the data.
+        points (np.array): Array of shape (n, 3) of k-points.
+        memory (float): Approximate memory budget in MB for
+            intermediate arrays. The points are processed in chunks
+            fitting into it.
+        precision (str): Either 'float64' or 'float32'.
+
+    Returns:
+        (np.array): Complex transform at the points of shape (n,).
+    """
+
+    dtype = np.complex64 if precision == 'float32' else np.complex128
+    coordinates = _coordinates(data.shape, spacing)
+    nx, ny, nz = data.shape
+    values = _as_precision(data, precision).reshape(nx * ny, nz)
+
+    points = np.asarray(points, dtype=np.float64)
+    result = np.empty(len(points), dtype=dtype)
+    chunk = _chunk_size(nx * ny * np.dtype(dtype).itemsize, memory)
+    for start in range(0, len(points), chunk):
+        k = points[start:start + chunk]
+        phase_x, phase_y = [
+            np.exp(-1j * np.outer(coordinate, k[:, i])).astype(dtype)
+            for i, coordinate in enumerate(coordinates[:2])]
+
+        # Sum over z for all points at once (matrix product), then
+        # over y and x point by point
+        angles = np.outer(coordinates[2], k[:, 2])
+        partial = _phase_product(values, angles, dtype).reshape(nx, ny, -1)
+        partial = np.einsum('xyp,yp->xp', partial, phase_y)
+        result[start:start + chunk] = np.einsum('xp,xp->p', partial,
+                                                phase_x)
+
+    return result
+
+
+def direct_transform_grid(data, spacing, kx, ky, KZ, mask, memory=256,
+                          precision='float64'):
+    """Evaluates the Fourier transform of 'data' directly at the points
+    (kx[i], ky[j], KZ[j, i]), e.g. on a hemisphere.
+
+    Same as 'direct_transform' but the sums over x and y are computed
+    once for all kx and ky values, thus the cost grows only with the
+    number of kx and ky values instead of the number of points.
+
+    Args:
+        data (np.array): 3D real space data.
+        spacing (tuple): Grid spacing (dx, dy, dz) of the data.
+        kx (np.array): 1D array of kx values.
+        ky (np.array): 1D array of ky values.
+        KZ (np.array): kz value of each point of shape (len(ky),
+            len(kx)).
+        mask (np.array): Boolean array of the same shape as KZ. Only
+            points inside the mask are evaluated.
+        memory (float): Approximate memory budget in MB for
+            intermediate arrays.
+        precision (str): Either 'float64' or 'float32'.
+
+    Returns:
+        (np.array): Complex transform of shape (len(ky), len(kx)), zero
+            outside the mask.
+    """
+
+    dtype = np.complex64 if precision == 'float32' else np.complex128
+    x, y, z = _coordinates(data.shape, spacing)
+    nx, ny, nz = data.shape
+    phase_y = np.exp(-1j * np.outer(ky, y)).astype(dtype)
+
+    # Sum over x for all kx values
+    values = _as_precision(data, precision).reshape(nx, -1)
+    partial = _phase_product(values, np.outer(kx, x), dtype, left=True)
+    partial = partial.reshape(len(kx), ny, nz)
+
+    result = np.zeros(KZ.shape, dtype=dtype)
+    chunk = _chunk_size(len(ky) * nz * np.dtype(dtype).itemsize, memory)
+    for start in range(0, len(kx), chunk):
+        stop = min(start + chunk, len(kx))
+        # Sum over y for all ky values (batched matrix product) ...
+        sums = phase_y @ partial[start:stop]
+        # ... and over z point by point
+        inside = mask[:, start:stop].T
+        phase_z = np.exp(-1j * np.outer(KZ[:, start:stop].T[inside],
+                                        z)).astype(dtype)
+        result[:, start:stop].T[inside] = np.einsum(
+            'pz,pz->p', sums[inside], phase_z)
+
+    return result
+
+
+def _coordinates(shape, spacing):
+    # Positions of the grid points relative to the one at index n//2
+    return [(np.arange(n) - n // 2) * d for n, d in zip(shape, spacing)]
+
+
+def _as_precision(data, precision):
+    # Data in the floating point precision (real or complex) used
+    if np.iscomplexobj(data):
+        dtype = np.complex64 if precision == 'float32' else np.complex128
+
+    else:
+        dtype = np.float32 if precision == 'float32' else np.float64
+
+    return np.asarray(data, dtype=dtype)
+
+
+def _phase_product(values, angles, dtype, left=False):
+    # Matrix product 'values @ exp(-i angles)' (or 'exp(-i angles) @
+    # values' if left). For real values it is computed as two real
+    # products (half the operations of a complex one)
+    if np.iscomplexobj(values):
+        phase = np.exp(-1j * angles).astype(dtype)
+        return phase @ values if left else values @ phase
+
+    cos = np.cos(angles).astype(values.dtype)
+    sin = np.sin(angles).astype(values.dtype)
+    result = np.empty((angles.shape[0], values.shape[1]) if left else
+                      (values.shape[0], angles.shape[1]), dtype=dtype)
+    result.real = cos @ values if left else values @ cos
+    result.imag = -(sin @ values if left else values @ sin)
+
+    return result
+
+
+def _chunk_size(size, memory):
+    # Number of items of 'size' bytes (at least one) fitting into
+    # 'memory' MB
+    return max(int(memory * 1024**2 // size), 1)
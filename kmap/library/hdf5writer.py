@@ -0,0 +1,196 @@
+"""Defines the HDF5Writer class.
+
+This file defines a class named HDF5Writer designed to write 3D data to
+.hdf5 files in the format used for SlicedData. The data is chunked
+along the first (slice) axis and can be written slice by slice as it is
+produced, thus the full 3D array never has to be held in memory. Fast
+compression filters can be chosen in the settings.
+"""
+
+# Third Party Imports
+import h5py
+import numpy as np
+
+# Own Imports
+from kmap.config.config import config
+
+
+class HDF5Writer():
+    """Writes 3D data to a .hdf5 file readable as SlicedData.
+
+    Can be used as context manager closing the file on exit. The 'data'
+    dataset is created right away if the shape of the slices is passed
+    and on the first slice written otherwise.
+    """
+
+    def __init__(self, file_path, num_slices, name, axes, meta_data={},
+                 dtype='f8', compression=None, slice_shape=None):
+        """
+        Args:
+            file_path (str): Path to the file written.
+            num_slices (int): Number of slices along the first axis.
+            name (str): Name of the data.
+            axes (list): One list [label, units, range] for each of the
+                three axes (same format as for SlicedData).
+            meta_data (dict): Additional datasets written to the file.
+            dtype (str): Data type the data is stored in.
+            compression (str): Compression filter used, see
+                'compression_options'. None for the one set in the
+                settings.
+            slice_shape (tuple): Shape of the 2D slices. If None, it is
+                taken from the first slice written.
+
+        Raises:
+            ValueError: If num_slices is 0.
+        """
+
+        if num_slices < 1:
+            # SlicedData needs at least one slice
+            raise ValueError('nothing to write to %s' % file_path)
+
+        if compression is None:
+            compression = config.get_key('hdf5', 'compression')
+
+        self.file_path = file_path
+        self.num_slices = num_slices
+        self.dtype = dtype
+        self.options = compression_options(compression)
+
+        self.file = h5py.File(file_path, 'w')
+        self.data = None
+
+        self.file.create_dataset('name', data=name)
+        for i, (label, units, range_) in enumerate(axes, 1):
+            self.file.create_dataset('axis_%i_label' % i, data=label)
+            self.file.create_dataset('axis_%i_units' % i, data=units)
+            self.file.create_dataset('axis_%i_range' % i, data=range_)
+
+        for key, value in meta_data.items():
+            self.file.create_dataset(key, data=value)
+
+        if slice_shape is not None:
+            self._create_data(slice_shape)
+
+    def write_slice(self, index, data):
+        """Writes one slice along the first axis.
+
+        Args:
+            index (int): Index of the slice.
+            data (np.array): 2D data of the slice.
+        """
+
+        data = np.asarray(data)
+        if self.data is None:
+            self._create_data(data.shape)
+
+        self.data[index] = data
+
+    def write(self, data, start=0):
+        """Writes several slices along the first axis one by one.
+
+        Args:
+            data (np.array): 3D data (or any iterable of 2D slices).
+            start (int): Index of the first slice written.
+        """
+
+        for index, slice_ in enumerate(data, start):
+            self.write_slice(index, slice_)
+
+    def close(self):
+        """Closes the file.
+
+        Raises:
+            ValueError: If the 'data' dataset was never created (no
+                slice written and no slice shape passed), the file is
+                not readable as SlicedData.
+        """
+
+        self.file.close()
+        if self.data is None:
+            raise ValueError('no data written to %s' % self.file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+
+        else:
+            # Don't hide the original error
+            self.file.close()
+
+    def _create_data(self, shape):
+        # Each slice is one chunk, thus reading a slice decompresses
+        # only the slice itself
+        shape = (self.num_slices,) + tuple(shape)
+        self.data = self.file.create_dataset(
+            'data', shape=shape, dtype=self.dtype, chunks=(1,) + shape[1:],
+            **self.options)
+
+
+def compression_options(compression):
+    """Returns the keyword arguments for 'h5py.create_dataset' for a
+    compression filter.
+
+    Args:
+        compression (str): Either 'None', 'lzf' (fast, but only readable
+            with h5py) or 'gzip-X' with level X (0-9). Can be preceded
+            by 'shuffle+' to shuffle the bytes before compressing (often
+            compresses floating point numbers better).
+
+    Returns:
+        (dict): Keyword arguments for 'h5py.create_dataset'.
+    """
+
+    options = {}
+    if compression.startswith('shuffle+'):
+        options['shuffle'] = True
+        compression = compression[len('shuffle+'):]
+
+    if compression == 'None':
+        if options:
+            raise ValueError('shuffle needs a compression filter')
+
+    elif compression == 'lzf':
+        options['compression'] = 'lzf'
+
+    elif (compression.startswith('gzip-') and
+          compression[5:] in [str(i) for i in range(10)]):
+        options['compression'] = 'gzip'
+        options['compression_opts'] = int(compression[5:])
+
+    else:
+        raise ValueError('Unknown compression %s' % compression)
+
+    return options
+
+
+def write_hdf5(file_path, sliced_data, dtype=None, compression=None):
+    """Writes a SlicedData object to a .hdf5 file slice by slice (thus
+    also lazy SlicedData is never read into memory at once).
+
+    Args:
+        file_path (str): Path to the file written.
+        sliced_data (SlicedData): Data to be written in its current
+            axes order.
+        dtype (str): Data type the data is stored in. None for the one
+            of the SlicedData.
+        compression (str): Compression filter used, see
+            'compression_options'. None for the one set in the settings.
+    """
+
+    if dtype is None:
+        dtype = sliced_data.data.dtype
+
+    axes = [[axis.label, axis.units, axis.range] for axis in
+            sliced_data.axes]
+    meta_data = {key: str(value) for key, value in
+                 sliced_data.meta_data.items()}
+
+    slice_shape = (sliced_data.axes[1].num, sliced_data.axes[2].num)
+    with HDF5Writer(file_path, sliced_data.axes[0].num, sliced_data.name,
+                    axes, meta_data, dtype, compression,
+                    slice_shape) as writer:
+        for index in range(sliced_data.axes[0].num):
+            writer.write_slice(index, sliced_data.get_slice(index))
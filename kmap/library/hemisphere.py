@@ -0,0 +1,575 @@
+"""Provides the hemisphere-slicing engine for orbitals.
+
+This file defines the UniformGridInterpolator class designed to sample
+3D data on a uniform grid (like the 3D-FT of an orbital) at arbitrary
+points with a trilinear kernel as well as methods to set up and rotate
+the hemispherical cuts of kmaps. Points outside the photoemission
+horizon are never evaluated. Grids and polarization factors are shared
+by all orbitals through process-wide caches.
+"""
+
+# Third Party Imports
+import numpy as np
+
+# Own Imports
+from kmap.library.misc import energy_to_k
+from kmap.library.cache import LRUCache, hash_bytes
+
+# Process-wide caches of hemisphere grids and polarization factors shared
+# by all orbitals (sizes in MB)
+grid_cache = LRUCache(max_size=64)
+Ak_cache = LRUCache(max_size=64)
+
+
+class UniformGridInterpolator():
+    """Trilinear interpolation of 3D data on a uniform grid.
+
+    Gives the same results as SciPy's RegularGridInterpolator with
+    method='linear', bounds_error=False and fill_value=np.nan but takes
+    coordinate arrays directly, only evaluates the points requested and
+    computes in the precision of the data (the position of the points
+    within the grid is always determined in double precision).
+    """
+
+    def __init__(self, axes, data, fill_value=np.nan):
+        """
+        Args:
+            axes (tuple): Three 1D arrays defining the uniform grid.
+                Each axis has to be increasing with at least 2 points.
+            data (np.array): 3D array of values on the grid.
+            fill_value (float): Value for points outside the grid.
+        """
+
+        self.data = data
+        self.grid = tuple(np.asarray(axis, dtype=np.float64)
+                          for axis in axes)
+        self.fill_value = fill_value
+
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.origin = np.array([axis[0] for axis in self.grid])
+        self.step = np.array([(axis[-1] - axis[0]) / (len(axis) - 1)
+                              for axis in self.grid])
+
+    def __call__(self, points):
+        """Interpolates the data at a list of points.
+
+        Args:
+            points (np.array): Array of shape (..., 3).
+
+        Returns:
+            (np.array): Interpolated values of shape (...).
+        """
+
+        points = np.asarray(points, dtype=np.float64)
+
+        return self.sample(points[..., 0], points[..., 1], points[..., 2])
+
+    def sample(self, x, y, z):
+        """Interpolates the data at the points (x[i], y[i], z[i]).
+
+        Args:
+            x (np.array): x-coordinates of arbitrary shape.
+            y (np.array): y-coordinates of the same shape as x.
+            z (np.array): z-coordinates of the same shape as x.
+
+        Returns:
+            (np.array): Interpolated values of the same shape as x.
+        """
+
+        shape = np.shape(x)
+        dtype = self.dtype
+        result = np.full(shape, self.fill_value, dtype=dtype)
+
+        indices, weights = [], []
+        inside = np.ones(shape, dtype=bool)
+        for coordinate, origin, step, n in zip((x, y, z), self.origin,
+                                              self.step, self.shape):
+            # Fractional index of each point along this axis; NaN
+            # coordinates compare False and are thus outside as well
+            position = (np.asarray(coordinate) - origin) / step
+            inside &= (position >= 0) & (position <= n - 1)
+            indices.append(position)
+
+        for i, (position, n) in enumerate(zip(indices, self.shape)):
+            position = position[inside]
+            index = np.minimum(position.astype(np.intp), n - 2)
+            indices[i] = index
+            weights.append((position - index).astype(dtype))
+
+        (ix, iy, iz), (tx, ty, tz) = indices, weights
+        corner, valid = self._corners(ix, iy, iz)
+
+        c00 = corner(0, 0, 0) * (1 - tz) + corner(0, 0, 1) * tz
+        c01 = corner(0, 1, 0) * (1 - tz) + corner(0, 1, 1) * tz
+        c10 = corner(1, 0, 0) * (1 - tz) + corner(1, 0, 1) * tz
+        c11 = corner(1, 1, 0) * (1 - tz) + corner(1, 1, 1) * tz
+        c0 = c00 * (1 - ty) + c01 * ty
+        c1 = c10 * (1 - ty) + c11 * ty
+        values = c0 * (1 - tx) + c1 * tx
+        if valid is not None:
+            values[~valid] = self.fill_value
+
+        result[inside] = values
+
+        return result
+
+    def to_dense(self):
+        """Returns the data as 3D array on the full grid."""
+
+        return self.data
+
+    def _corners(self, ix, iy, iz):
+        # Returns a function giving the values at the corners (ix + dx,
+        # iy + dy, iz + dz) of the cells and a mask of the cells with
+        # data (None if all cells have data)
+        _, ny, nz = self.shape
+        flat = self.data.reshape(-1)
+        base = (ix * ny + iy) * nz + iz
+
+        def corner(dx, dy, dz):
+            return np.take(flat, base + (dx * ny + dy) * nz + dz)
+
+        return corner, None
+
+
+class ShellGridInterpolator(UniformGridInterpolator):
+    """Trilinear interpolation of 3D data on a uniform grid storing only
+    a spherical shell around the origin.
+
+    The grid points are divided into blocks of block_size^3 points and
+    only the blocks close to the shell between the radii k_min and k_max
+    are kept. Points inside the shell are interpolated exactly as by the
+    UniformGridInterpolator, points needing a block not kept get the
+    fill value. This reduces the memory of a 3D-FT used for a narrow
+    range of kinetic energies by a large factor.
+    """
+
+    def __init__(self, axes, data, k_min, k_max, block_size=4,
+                 fill_value=np.nan):
+        """
+        Args:
+            axes (tuple): Three 1D arrays defining the uniform grid.
+                Each axis has to be increasing with at least 2 points.
+            data (np.array): 3D array of values on the grid. Only the
+                blocks kept are copied.
+            k_min (float): Inner radius of the shell.
+            k_max (float): Outer radius of the shell.
+            block_size (int): Number of points per block and axis.
+            fill_value (float): Value for points outside the grid or
+                the shell.
+        """
+
+        UniformGridInterpolator.__init__(self, axes, data, fill_value)
+        self.data = None
+        self.k_min, self.k_max = k_min, k_max
+        self.block_size = b = block_size
+
+        # Distance of the closest and farthest point of each block to
+        # the origin
+        num_blocks = [-(-n // b) for n in self.shape]
+        near, far = 0, 0
+        for i, (axis, num) in enumerate(zip(self.grid, num_blocks)):
+            start = np.arange(num) * b
+            low = axis[start]
+            high = axis[np.minimum(start + b - 1, len(axis) - 1)]
+            closest = np.where(low > 0, low, np.where(high < 0, -high, 0))
+            farthest = np.maximum(np.abs(low), np.abs(high))
+            shape = [1, 1, 1]
+            shape[i] = -1
+            near = near + (closest**2).reshape(shape)
+            far = far + (farthest**2).reshape(shape)
+
+        # All corners of a cell are within one cell diagonal of any
+        # point inside the cell
+        diagonal = np.linalg.norm(self.step)
+        keep = ((np.sqrt(near) <= k_max + diagonal) &
+                (np.sqrt(far) >= k_min - diagonal))
+
+        self.lookup = np.full(num_blocks, -1, dtype=np.int32)
+        self.lookup[keep] = np.arange(np.count_nonzero(keep))
+        # (at least one block so there is always something to gather)
+        self.blocks = np.full((max(np.count_nonzero(keep), 1), b, b, b),
+                              fill_value, dtype=self.dtype)
+        for block, (bx, by, bz) in zip(self.blocks, np.argwhere(keep)):
+            part = data[bx * b:(bx + 1) * b, by * b:(by + 1) * b,
+                        bz * b:(bz + 1) * b]
+            block[:part.shape[0], :part.shape[1], :part.shape[2]] = part
+
+        self.nbytes = self.blocks.nbytes + self.lookup.nbytes
+
+    def to_dense(self):
+        """Returns the data as 3D array on the full grid (fill value
+        outside the blocks kept)."""
+
+        b = self.block_size
+        data = np.full(self.shape, self.fill_value, dtype=self.dtype)
+        for block, (bx, by, bz) in zip(self.blocks,
+                                       np.argwhere(self.lookup >= 0)):
+            part = data[bx * b:(bx + 1) * b, by * b:(by + 1) * b,
+                        bz * b:(bz + 1) * b]
+            part[...] = block[:part.shape[0], :part.shape[1],
+                              :part.shape[2]]
+
+        return data
+
+    def _corners(self, ix, iy, iz):
+
+        b = self.block_size
+        _, nby, nbz = self.lookup.shape
+        lookup = self.lookup.reshape(-1)
+        flat = self.blocks.reshape(-1)
+
+        # Contributions of each axis to the index of the block (in the
+        # lookup table) and to the index within the block for the
+        # lower (0) and upper (1) corner
+        block_x = [(ix + d) // b * (nby * nbz) for d in (0, 1)]
+        local_x = [(ix + d) % b * (b * b) for d in (0, 1)]
+        block_yz, local_yz = {}, {}
+        for dy in (0, 1):
+            for dz in (0, 1):
+                block_yz[dy, dz] = (iy + dy) // b * nbz + (iz + dz) // b
+                local_yz[dy, dz] = (iy + dy) % b * b + (iz + dz) % b
+
+        valid = np.ones(len(ix), dtype=bool)
+        indices = {}
+        for dx in (0, 1):
+            for (dy, dz), block_index in block_yz.items():
+                block = np.take(lookup, block_x[dx] + block_index)
+                valid &= block >= 0
+                indices[dx, dy, dz] = (block.astype(np.intp) * b**3 +
+                                       local_x[dx] + local_yz[dy, dz])
+
+        def corner(dx, dy, dz):
+            return np.take(flat, indices[dx, dy, dz], mode='clip')
+
+        return corner, valid
+
+
+def dk_fingerprint(dk):
+    """Returns a hashable key identifying a k-grid specification.
+
+    Args:
+        dk (float or tuple): Either the desired k-resolution in
+            Angstroem^-1 or a tuple of the kx and ky axes.
+
+    Returns:
+        (float or tuple): The resolution itself or a tuple of the
+            lengths of the axes and a hash of their values.
+    """
+
+    if type(dk) == tuple:
+        kx, ky = [np.ascontiguousarray(axis, dtype=np.float64)
+                  for axis in dk]
+        return (len(kx), len(ky), hash_bytes(kx.tobytes() + ky.tobytes()))
+
+    else:
+        return float(dk)
+
+
+def hemisphere_grid(E_kin, dk):
+    """Returns the k-grid of a hemispherical cut at kinetic energy E_kin.
+
+    Args:
+        E_kin (float): Kinetic energy in eV.
+        dk (float or tuple): Either the desired k-resolution in
+            Angstroem^-1 or a tuple of the kx and ky axes.
+
+    Returns:
+        (dict): Dictionary with the axes 'kx' and 'ky', the 'krange',
+            the meshgrids 'KX', 'KY', 'KZ' (NaN outside the horizon) and
+            the boolean 'mask' of points inside the horizon.
+    """
+
+    kmax = energy_to_k(E_kin)
+    if type(dk) == tuple:
+        kxi = dk[0]
+        kyi = dk[1]
+    else:
+        num_k = int(2 * kmax / dk)
+        kxi = np.linspace(-kmax, +kmax, num_k)
+        kyi = np.linspace(-kmax, +kmax, num_k)
+
+    krange = ((kxi[0], kxi[-1]), (kyi[0], kyi[-1]))
+    KX, KY = np.meshgrid(kxi, kyi, indexing='xy')
+    KZ2 = kmax**2 - KX**2 - KY**2
+    mask = KZ2 >= 0
+    KZ = np.full(KX.shape, np.nan)
+    KZ[mask] = np.sqrt(KZ2[mask])
+
+    return {'kx': kxi, 'ky': kyi, 'krange': krange,
+            'KX': KX, 'KY': KY, 'KZ': KZ, 'mask': mask}
+
+
+def cached_hemisphere_grid(E_kin, dk):
+    """Same as 'hemisphere_grid' but returns a (read-only) grid shared
+    by all callers asking for the same E_kin and dk.
+
+    Args:
+        E_kin (float): Kinetic energy in eV.
+        dk (float or tuple): Either the desired k-resolution in
+            Angstroem^-1 or a tuple of the kx and ky axes.
+
+    Returns:
+        (dict): Same as 'hemisphere_grid'.
+    """
+
+    key = (float(E_kin), dk_fingerprint(dk))
+    grid = grid_cache.get(key)
+    if grid is None:
+        grid = hemisphere_grid(E_kin, dk)
+        grid_cache.put(key, grid)
+
+    return grid
+
+
+def sample_hemisphere(interpolator, grid, rotation=None):
+    """Samples data on a (rotated) hemisphere. Only points inside the
+    photoemission horizon are evaluated, the others are set to NaN.
+
+    Args:
+        interpolator (UniformGridInterpolator): Data to be sampled.
+        grid (dict): Hemisphere as returned by 'hemisphere_grid'.
+        rotation (np.array): 3x3 matrix the hemisphere is rotated by
+            before sampling. None for no rotation.
+
+    Returns:
+        (np.array): 2D array of the same shape as the grid.
+    """
+
+    mask = grid['mask']
+    kx, ky, kz = grid['KX'][mask], grid['KY'][mask], grid['KZ'][mask]
+    if rotation is not None:
+        r = rotation
+        kx, ky, kz = (r[0, 0] * kx + r[0, 1] * ky + r[0, 2] * kz,
+                      r[1, 0] * kx + r[1, 1] * ky + r[1, 2] * kz,
+                      r[2, 0] * kx + r[2, 1] * ky + r[2, 2] * kz)
+
+    data = np.full(mask.shape, np.nan, dtype=interpolator.dtype)
+    data[mask] = interpolator.sample(kx, ky, kz)
+
+    return data
+
+
+def sample_hemispheres(interpolator, kx, ky, E_kin, rotations=None,
+                       chunk_size=2**16):
+    """Samples data on a stack of (rotated) hemispheres sharing one
+    (kx, ky)-grid in a few vectorized passes. Only points inside the
+    photoemission horizon of each hemisphere are evaluated, the others
+    are set to NaN.
+
+    Args:
+        interpolator (UniformGridInterpolator): Data to be sampled.
+        kx (np.array): 1D array of the kx-axis.
+        ky (np.array): 1D array of the ky-axis.
+        E_kin (np.array): 1D array of kinetic energies in eV, one per
+            hemisphere.
+        rotations (np.array): Array of shape (n, 3, 3) with the matrix
+            each hemisphere is rotated by before sampling. None for no
+            rotation.
+        chunk_size (int): Maximal number of points evaluated at once.
+
+    Returns:
+        (tuple): Sampled data and KZ (NaN outside the horizon), both of
+            shape (len(E_kin), len(ky), len(kx)).
+    """
+
+    KX, KY = np.meshgrid(kx, ky, indexing='xy')
+    kmax = energy_to_k(np.asarray(E_kin, dtype=np.float64))
+    KZ2 = kmax[:, np.newaxis, np.newaxis]**2 - KX**2 - KY**2
+    mask = KZ2 >= 0
+    KZ = np.full(KZ2.shape, np.nan)
+    KZ[mask] = np.sqrt(KZ2[mask])
+    del KZ2
+
+    data = np.full(mask.shape, np.nan, dtype=interpolator.dtype)
+    if rotations is not None:
+        rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 9)
+        # A common rotation is applied with scalars instead of per point
+        common = np.all(rotations == rotations[0])
+
+    # Evaluate groups of whole hemispheres with about chunk_size points
+    counts = mask.sum(axis=(1, 2))
+    start = 0
+    while start < len(counts):
+        stop = start + 1
+        total = counts[start]
+        while stop < len(counts) and total + counts[stop] <= chunk_size:
+            total += counts[stop]
+            stop += 1
+
+        m = mask[start:stop]
+        x = np.broadcast_to(KX, m.shape)[m]
+        y = np.broadcast_to(KY, m.shape)[m]
+        z = KZ[start:stop][m]
+        if rotations is not None:
+            if common:
+                r = rotations[0]
+
+            else:
+                r = [np.repeat(component, counts[start:stop])
+                     for component in rotations[start:stop].T]
+
+            x, y, z = (r[0] * x + r[1] * y + r[2] * z,
+                       r[3] * x + r[4] * y + r[5] * z,
+                       r[6] * x + r[7] * y + r[8] * z)
+
+        data[start:stop][m] = interpolator.sample(x, y, z)
+        start = stop
+
+    return data, KZ
+
+
+def polarization_factor(KX, KY, KZ, E_kin, Ak_type, polarization, alpha,
+                        beta, gamma, s_share):
+    """Returns the polarization factor |A.k|^2 on a hemisphere.
+
+    All numeric arguments are broadcast against each other, e.g. pass
+    KZ of shape (n, ny, nx) and E_kin, alpha, ... of shape (n, 1, 1) to
+    compute the factor for n hemispheres at once.
+
+    Args:
+        KX (np.array): kx-values of the hemisphere.
+        KY (np.array): ky-values of the hemisphere.
+        KZ (np.array): kz-values of the hemisphere (NaN outside the
+            photoemission horizon).
+        E_kin (float): Kinetic energy in eV.
+        Ak_type (string): Treatment of |A.k|^2: either 'no',
+            'toroid', 'NanoESCA', 'only-toroid' or 'only-NanoESCA'.
+        polarization (string): Either 'p', 's', 'unpolarized',
+            'C+', 'C-' or 'CDAD'.
+        alpha (float): Angle of incidence plane in degree.
+        beta (float): Azimuth of incidence plane in degree.
+        gamma (float/str): Damping factor for final state in
+            Angstroem^-1. str = 'auto' sets gamma automatically
+        s_share (float): share of s-polarized light for the case
+            of unpolarized light (should be between 0 and 1)
+
+    Returns:
+        (np.array): |A.k|^2 of the broadcast shape of the arguments.
+    """
+
+    kx, ky, kz = KX, KY, KZ
+    if Ak_type == 'no':  # Set |A.k|^2 to 1
+        return np.ones(np.broadcast(kx, ky, kz, E_kin, alpha, beta,
+                                    s_share).shape)
+
+    # Convert angles to rad and compute sin and cos for later use
+    a = np.radians(alpha)
+    b = np.radians(beta)
+    sin_a = np.sin(a)
+    cos_a = np.cos(a)
+    sin_b = np.sin(b)
+    cos_b = np.cos(b)
+
+    # Compute gamma according to inelastic free mean path
+    if isinstance(gamma, str) and gamma == 'auto':
+        # lambda is calculated from the "universal curve" empirical
+        # relation
+        c1 = 143
+        c2 = 0.054
+        lam = c1 * E_kin**(-2.0) + c2 * np.sqrt(E_kin)
+        lam *= 10
+        gamma_calc = 1 / lam
+    else:
+        gamma_calc = gamma
+
+    # Magnitude of k-vector
+    k2 = kx**2 + ky**2 + kz**2
+    kmax = energy_to_k(E_kin)
+    outside = kx**2 + ky**2 > kmax**2
+
+    # At the toroid, the emitted electron is always in the plane of
+    # incidence and the sample is rotated
+    if Ak_type == 'toroid' or Ak_type == 'only-toroid':
+        # Parallel component of k-vector
+        kpar = np.sqrt(k2 - kz**2)
+        # |A.k|^2 factor
+        Ak = (kpar * cos_a + kz * sin_a)**2
+
+    # At the NanoESCA, either p-polarization ,s-polarization, or
+    # circularly polarized light can be simulated
+    elif Ak_type == 'NanoESCA' or Ak_type == 'only-NanoESCA':
+        # In-plane = p-polarization
+        if polarization == 'p':
+            Ak = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
+            Ak = Ak**2 + gamma_calc**2 * sin_a**2
+
+        # Out-of-plane = s-polarization
+        elif polarization == 's':
+            Ak = -kx * sin_b + ky * cos_b
+            Ak = np.where(outside, np.nan, Ak**2)
+
+        # unpolarized-light is treated as average of s- and p-polarized
+        # light (Eq. (37) in S. Moser, J. Electr. Spectr. Rel. Phen.
+        # 214, 29-52 (2017) turned out to be wrong)
+        elif polarization == 'unpolarized':
+            Ak_p = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
+            Ak_p = Ak_p**2 + gamma_calc**2 * sin_a**2
+            Ak_s = -kx * sin_b + ky * cos_b
+            Ak_s = Ak_s**2
+
+            Ak = s_share * Ak_s + (1 - s_share) * Ak_p
+            Ak = np.where(outside, np.nan, Ak)
+
+        # Circularly polarized light (right-handed)
+        elif polarization == 'C+':
+            polp = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
+            pols = -kx * sin_b + ky * cos_b
+            Ak = 0.5 * (polp**2 + gamma_calc**2 * sin_a**2) + 0.5 * \
+                pols**2 + (sin_b * kx - cos_b * ky) * gamma_calc * sin_a
+
+        # Circularly polarized light (left-handed)
+        elif polarization == 'C-':
+            polp = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
+            pols = -kx * sin_b + ky * cos_b
+            Ak = 0.5 * (polp**2 + gamma_calc**2 * sin_a**2) + 0.5 * \
+                pols**2 - (sin_b * kx - cos_b * ky) * gamma_calc * sin_a
+
+        # CDAD-signal (right-handed - left-handed) using empirically
+        # damped plane wave
+        elif polarization == 'CDAD':
+            # Compare Equation (31) in S. Moser, J. Electr. Spectr.
+            # Rel. Phen. 214, 29-52 (2017).
+            Ak = +2 * (sin_b * kx - cos_b * ky) * gamma_calc * sin_a
+            Ak = np.where(outside, np.nan, Ak)
+
+    # Make sure the result has the full broadcast shape
+    return Ak * np.ones(np.broadcast(kx, ky, kz, E_kin, alpha, beta,
+                                     s_share).shape)
+
+
+def cached_polarization_factor(grid, E_kin, dk, Ak_type, polarization,
+                               alpha, beta, gamma, s_share):
+    """Same as 'polarization_factor' on a hemisphere grid but returns a
+    (read-only) array shared by all callers asking for the same
+    parameters.
+
+    Args:
+        grid (dict): Hemisphere as returned by 'hemisphere_grid' for
+            E_kin and dk.
+        E_kin (float): Kinetic energy in eV.
+        dk (float or tuple): Either the desired k-resolution in
+            Angstroem^-1 or a tuple of the kx and ky axes.
+        Ak_type (string): See 'polarization_factor'.
+        polarization (string): See 'polarization_factor'.
+        alpha (float): See 'polarization_factor'.
+        beta (float): See 'polarization_factor'.
+        gamma (float/str): See 'polarization_factor'.
+        s_share (float): See 'polarization_factor'.
+
+    Returns:
+        (np.array): |A.k|^2 of the same shape as the grid.
+    """
+
+    key = (float(E_kin), dk_fingerprint(dk), Ak_type, polarization,
+           float(alpha), float(beta),
+           gamma if isinstance(gamma, str) else float(gamma), float(s_share))
+    Ak = Ak_cache.get(key)
+    if Ak is None:
+        Ak = polarization_factor(grid['KX'], grid['KY'], grid['KZ'], E_kin,
+                                 Ak_type, polarization, alpha, beta, gamma,
+                                 s_share)
+        Ak_cache.put(key, Ak)
+
+    return Ak
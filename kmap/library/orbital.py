@@ -4,14 +4,62 @@ This file defines a class named Orbital designed to read, hold,
 calculate and slice data from cube files.
 """
 
+import os
+import copy
+import weakref
+import contextlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import numpy as np
-import scipy.interpolate as interp
-from scipy.ndimage import rotate
+from scipy.spatial import cKDTree
 from kmap.library.plotdata import PlotData
 from kmap.library.misc import energy_to_k, compute_Euler_matrix
+from kmap.library.cubefile import read_cube
+from kmap.library.cache import (
+    LRUCache, share_array, in_shared_memory, memmap_reference,
+    open_memmap_reference)
+from kmap.library.orbitalregistry import orbital_registry
+from kmap.library.symmetrization import get_symmetrizer
+from kmap.library.fourier import (
+    fft_size, get_workers, windowed_fft, direct_transform,
+    direct_transform_grid)
+from kmap.library.hemisphere import (
+    UniformGridInterpolator, ShellGridInterpolator, hemisphere_grid,
+    sample_hemisphere,
+    sample_hemispheres, polarization_factor, dk_fingerprint,
+    cached_hemisphere_grid, cached_polarization_factor)
 
 np.seterr(invalid='ignore')
 
+# Covalent radii in Angstroem by atomic number
+COVALENT_RADII = {1:0.32, 2:0.32,  # H, He
+                  3:1.34, 4:0.90, 5:0.82, 6:0.77, 7:0.71, 8:0.73, 9:0.71,10:0.69, # Li - Ne
+                 11:1.54,12:1.30,13:1.18,14:1.11,15:1.06,16:1.02,17:0.99,18:0.97, # Na- Ar
+                 19:1.96,20:1.74,21:1.44,22:1.36,23:1.25,24:1.27,25:1.39,26:1.25, # K - Fe
+                 27:1.26,28:1.21,29:1.38,30:1.31,31:1.26,32:1.22,33:1.21,34:1.16, # Co- Se
+                 35:1.14,36:1.10,                                                 # Br, Kr
+                 37:2.11,38:1.92,39:1.62,40:1.48,41:1.37,42:1.45,43:1.31,44:1.26, # Rb -Ru
+                 45:1.35,46:1.31,47:1.53,48:1.48,49:1.44,50:1.41,51:1.38,52:1.35, # Rh -Te
+                 53:1.33,54:1.30,                                                 #  I, Xe
+                 55:2.25,56:1.98,57:1.69,72:1.50,73:1.38,74:1.46,75:1.59,76:1.28, # Cs -Os
+                 77:1.37,78:1.38,79:1.38,80:1.49,81:1.48,82:1.46,83:1.46,84:1.40, # Ir -Po
+                 85:1.45,86:1.45}                                                 # At, Rn
+
+# Computes 3D-FTs in the background one at a time
+_prefetch_executor = ThreadPoolExecutor(max_workers=1)
+
+
+class _KmapState():
+    # Parameters and grid of a kmap without its data. Not a dict, thus
+    # the (shared) grid arrays are not counted in the size of the cache
+    def __init__(self, kmap, Ak):
+        self.kmap = {key: value for key, value in kmap.items()
+                     if key != 'data'}
+        self.Ak = {key: value for key, value in Ak.items() if key != 'data'}
+
+
 class Orbital():
     """Class modelling cube files as orbitals from which kmaps can be
     sliced.
@@ -21,29 +69,357 @@ class Orbital():
 
     Args:
         file (string): Entire cube file to be loaded as one string.
+            Alternatively a path to a cube file, a file object or a
+            cube file already parsed by 'read_cube'.
         file_format (string): Currently only cube files are supported.
         dk3D (float): Desired resolution for 3D-Fourier-Transform.
             Single number.
         E_kin_max (float): maximum kinetic energy in eV is used to
             reduce the size of the 3D-numpy-array in momentum space
+        E_kin_min (float): If not None, only the spherical shell of the
+            3D-FT needed for kinetic energies between E_kin_min and
+            E_kin_max is stored. Kmaps for other kinetic energies
+            are NaN where they need data outside the shell.
         value (string): choose between 'real', 'imag', 'abs' or 'abs2'
             for Re(), Im(), |..| or |..|^2
+        fft_workers (int): Number of threads used for the 3D-FFT (-1
+            uses all CPUs).
+        fast_fft (bool): If True, the 3D-FFT is padded to the next size
+            the FFT is fast for. This yields a slightly finer k-grid
+            than dk3D and thus slightly different kmaps.
+        precision (string): Either 'float64' or 'float32'. In 'float32'
+            the 3D-FFT, the stored 3D-FT and the kmaps use single
+            precision, halving the memory of the 3D-FT. Kmaps deviate
+            from the 'float64' path by about 3e-7 relative to their
+            maximum (up to 1e-4 relative to the local value close to
+            nodes), far below the accuracy of the simulation itself.
+        kmap_cache_size (float): Maximum memory in MB used to keep
+            recently computed kmaps. Calling 'get_kmap' again with the
+            same parameters returns the cached kmap. 0 disables the
+            cache.
+        engine (string): Either 'fft' or 'direct'. 'fft' slices kmaps
+            from the 3D-FT of the zero padded orbital (interpolated
+            linearly). 'direct' evaluates the Fourier transform of the
+            orbital exactly on the points of each kmap instead, which
+            needs no 3D-FT and is faster if only a few kinetic energies
+            are used. All orientations are evaluated directly, thus
+            kmaps change continuously with the orientation. Its cost
+            grows with the number of kmap points times the orbital size
+            for orientations other than multiples of 90 degree (seconds
+            per kmap instead of milliseconds). 'get_kmaps' and 'psik'
+            always use the 3D-FT.
+        direct_memory (float): Approximate memory budget in MB for the
+            'direct' engine.
 
     Attributes:
-
+        psik (dict): 3D-FT of the orbital. It is computed on first
+            access (e.g. by 'get_kmap') or by calling 'prefetch'.
+        fft_info (dict): Size, number of threads and peak memory (in
+            bytes) of the last 3D-FFT computed.
+        kmap_cache (LRUCache): Recently computed kmaps. Use
+            'kmap_cache.info()' for hit and miss statistics.
+
+    Orbitals can be pickled (e.g. to be sent to worker processes). Only
+    the real space data, the 3D-FT and the settings are stored, the
+    interpolator of the 3D-FT is rebuilt on first access. A 3D-FT
+    memory mapped from a file (see 'share_psik' and the disk cache of
+    OrbitalData) is only referenced, not copied.
+
+    All orbitals are registered in 'orbital_registry' which frees the
+    3D-FTs of the least recently used orbitals if its memory budget is
+    exceeded. They are computed again on next access.
     """
 
-    def __init__(self, file, file_format='cube', dk3D=0.15, E_kin_max=150,value='abs2'):
+    def __init__(self, file, file_format='cube', dk3D=0.15, E_kin_max=150,value='abs2',
+                 fft_workers=-1, fast_fft=False, precision='float64',
+                 kmap_cache_size=64, E_kin_min=None, engine='fft',
+                 direct_memory=256):
         
+        self.E_kin_min = E_kin_min
+        self.engine = engine
+        self.direct_memory = direct_memory
+        self.fft_workers = fft_workers
+        self.fast_fft = fast_fft
+        self.precision = precision
+        self.kmap_cache = LRUCache(max_size=kmap_cache_size)
+
         # Read orbital data from file
         if file_format == 'cube': 
             self._read_cube(file)
         else:
             NotImplementedError('Other formats than cube not implemented')
 
-        self.compute_3DFT(dk3D, E_kin_max, value)
+        # The 3D-FT is only computed once it is needed
+        self._psik = None
+        self._psik_state = None
+        self._psik_parameters = (dk3D, E_kin_max, value)
+        self._psik_lock = threading.RLock()
         self.kmap = {}
         self.Ak   = {}
+        orbital_registry.register(self)
+
+    @property
+    def psik(self):
+
+        if self._psik is None:
+            with self._psik_lock:
+                # Another thread might have computed it in the meantime
+                if self._psik is None and self._psik_state is not None:
+                    self._restore_psik()
+
+                elif self._psik is None:
+                    self.compute_3DFT(*self._psik_parameters)
+
+        psik = self._psik
+        orbital_registry.touch(self)
+
+        return psik
+
+    @psik.setter
+    def psik(self, psik):
+
+        self._psik = psik
+
+    @property
+    def psi(self):
+
+        if self._psi['data'] is None:
+            with self._psik_lock:
+                if self._psi['data'] is None:
+                    self._reload_psi()
+
+        return self._psi
+
+    @psi.setter
+    def psi(self, psi):
+
+        self._psi = psi
+
+    def _reload_psi(self):
+        # Reads the real space data freed by 'release' again
+        psi = read_cube(self._psi_source)['psi']
+        if any(psi[key] != self._psi[key] for key in
+               ['nx', 'ny', 'nz', 'dx', 'dy', 'dz']):
+            raise ValueError('Cube file %s has changed' % self._psi_source)
+
+        self._psi = dict(self._psi, data=psi['data'])
+
+    def memory_usage(self):
+        """Returns the memory used by this orbital.
+
+        Returns:
+            (dict): Bytes held in RAM by the real space data 'psi', the
+                3D-FT 'psik', the cached 'kmaps' and in 'total'. Arrays
+                memory mapped from files are not counted unless the
+                files are in shared memory (e.g. after 'share_psik').
+                Arrays shared with other orbitals are counted for each
+                of them.
+        """
+
+        arrays = self.memory_arrays()
+        usage = {'psi': 0 if arrays['psi'] is None else arrays['psi'].nbytes,
+                 'psik': 0 if arrays['psik'] is None else
+                 arrays['psik'].nbytes,
+                 'kmaps': self.kmap_cache.info()['size']}
+        usage['total'] = sum(usage.values())
+
+        return usage
+
+    def memory_arrays(self):
+        """Returns the large arrays of this orbital held in RAM.
+
+        Returns:
+            (dict): Real space data 'psi' and 3D-FT 'psik'. None if not
+                in RAM (freed or memory mapped from a file on disk).
+        """
+
+        psik = None
+        if self._psik is not None:
+            psik = self._psik['data']
+            if psik is None:
+                psik = self._psik['data_interp'].blocks
+
+        elif self._psik_state is not None:
+            psik = self._psik_state['psik']['data']
+            if self._psik_state['interp'] is not None:
+                psik = self._psik_state['interp'].blocks
+
+        return {'psi': _in_ram(self._psi['data']), 'psik': _in_ram(psik)}
+
+    def release(self, psi=False):
+        """Frees the 3D-FT of this orbital. It is computed (or loaded)
+        again on next access.
+
+        Args:
+            psi (bool): If True, also the real space data is freed if
+                the orbital has been read from a file (it is read again
+                on next access).
+
+        Returns:
+            (bool): True if anything has been freed. False if the
+                3D-FT is in use by another thread at the moment.
+        """
+
+        if not self._psik_lock.acquire(blocking=False):
+            return False
+
+        try:
+            freed = self._psik is not None or self._psik_state is not None
+            self._psik, self._psik_state = None, None
+            # A 3D-FT moved to shared memory is only freed with its file
+            finalizer = self.__dict__.pop('_psik_finalizer', None)
+            if finalizer is not None:
+                finalizer()
+            if (psi and self._psi_source is not None and
+                    _in_ram(self._psi['data']) is not None):
+                self._psi = dict(self._psi, data=None)
+                freed = True
+
+            return freed
+
+        finally:
+            self._psik_lock.release()
+
+    def __getstate__(self):
+        # Kmaps, bonds and the lock are not pickled. The 3D-FT is stored
+        # without its interpolator and only referenced if memory mapped
+        state = self.__dict__.copy()
+        state.pop('_psik_lock')
+        state.pop('_psik_finalizer', None)
+        state['kmap'], state['Ak'], state['_bonds'] = {}, {}, {}
+
+        if self._psik is not None:
+            psik = dict(self._psik)
+            interp = psik.pop('data_interp')
+            shell = psik['data'] is None
+            array = interp.blocks if shell else psik['data']
+            reference = memmap_reference(array)
+            if reference is not None:
+                array = None
+
+            if shell:
+                interp = copy.copy(interp)
+                interp.blocks = array
+
+            else:
+                psik['data'], interp = array, None
+
+            state['_psik'] = None
+            state['_psik_state'] = {'psik': psik, 'interp': interp,
+                                    'reference': reference}
+
+        elif (self._psik_state is not None and
+              self._psik_state['reference'] is not None):
+            # Unpickled, but not restored yet. The mapped 3D-FT is only
+            # referenced again
+            psik, interp = dict(self._psik_state['psik']), None
+            if self._psik_state['interp'] is not None:
+                interp = copy.copy(self._psik_state['interp'])
+                interp.blocks = None
+
+            else:
+                psik['data'] = None
+
+            state['_psik_state'] = dict(self._psik_state, psik=psik,
+                                        interp=interp)
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self._psik_lock = threading.RLock()
+        orbital_registry.register(self)
+
+        # Map a referenced 3D-FT right away (while it surely exists). If
+        # it is gone, the 3D-FT is computed again on first access
+        if (self._psik_state is not None and
+                self._psik_state['reference'] is not None):
+            array = open_memmap_reference(self._psik_state['reference'])
+            if array is None:
+                self._psik_state = None
+
+            elif self._psik_state['interp'] is not None:
+                self._psik_state['interp'].blocks = array
+
+            else:
+                self._psik_state['psik']['data'] = array
+
+    def _restore_psik(self):
+        # Sets the 3D-FT of an unpickled orbital
+        state, self._psik_state = self._psik_state, None
+        psik, interp = state['psik'], state['interp']
+        if interp is None:
+            interp = UniformGridInterpolator(
+                (psik['kx'], psik['ky'], psik['kz']), psik['data'],
+                fill_value=np.nan)
+
+        self.psik = dict(psik, data_interp=interp)
+
+    def share_psik(self, directory=None):
+        """Moves the 3D-FT into a memory-mapped file. Pickled copies of
+        the orbital (e.g. sent to worker processes) then map the same
+        file instead of containing the 3D-FT. The file is removed once
+        this orbital is deleted, thus it has to outlive its pickled
+        copies being loaded.
+
+        Args:
+            directory (str): Directory of the file. Defaults to
+                '/dev/shm' (shared memory) if available.
+        """
+
+        with self._psik_lock:
+            psik = self.psik
+            shell = psik['data'] is None
+            array = psik['data_interp'].blocks if shell else psik['data']
+            if memmap_reference(array) is not None:
+                return  # already memory mapped
+
+            shared = share_array(array, directory)
+            self._psik_finalizer = weakref.finalize(self, _remove_file,
+                                                    shared.filename)
+            if shell:
+                interp = copy.copy(psik['data_interp'])
+                interp.blocks = shared
+
+            else:
+                interp = UniformGridInterpolator(
+                    (psik['kx'], psik['ky'], psik['kz']), shared,
+                    fill_value=np.nan)
+
+            self.psik = dict(psik, data=None if shell else shared,
+                             data_interp=interp)
+
+    def prefetch(self, background=False, executor=None):
+        """Computes the 3D-FT now instead of on first access.
+
+        Args:
+            background (bool): If True, the 3D-FT is computed in a
+                background thread. Accessing it in the meantime waits
+                for the thread to finish.
+            executor (concurrent.futures.Executor): Executor the 3D-FT
+                is computed in the background with. None for one shared
+                by all orbitals computing one 3D-FT at a time (each
+                FFT uses 'fft_workers' threads already).
+
+        Returns:
+            (concurrent.futures.Future): Future of the computation or
+                None if background is False.
+        """
+
+        if not background:
+            self.psik
+            return None
+
+        executor = _prefetch_executor if executor is None else executor
+
+        return executor.submit(lambda: self.psik)
+
+    def psik_ready(self):
+        """Returns True if the 3D-FT can be accessed without computing
+        it first."""
+
+        return self._psik is not None or self._psik_state is not None
 
     def get_kmap(self, E_kin=30, dk=0.03, phi=0, theta=0, psi=0,
                  Ak_type='no', polarization='p', alpha=60, beta=90,
@@ -73,6 +449,19 @@ class Orbital():
             (PlotData): PlotData containing the kmap slice.
         """
 
+        # Return kmap computed for the same parameters before
+        key = self._kmap_key(E_kin, dk, phi, theta, psi, Ak_type,
+                             polarization, alpha, beta, gamma,
+                             symmetrization, s_share)
+        cached = self.kmap_cache.get(key)
+        if cached is not None:
+            # Restore the state of the kmap as well (used by e.g. 'plot')
+            data, kmap_data, Ak_data, state = cached
+            self.kmap = dict(state.kmap, data=kmap_data)
+            self.Ak = dict(state.Ak, data=Ak_data)
+
+            return PlotData(data, self.kmap['krange'])
+
         # Compute new hemispherical cut if E_kin or dk has changed
         new_cut = self.check_new_cut(E_kin, dk)
         if new_cut: self.set_kinetic_energy(E_kin, dk)
@@ -91,11 +480,142 @@ class Orbital():
                                          alpha, beta,gamma,s_share)
 
         if Ak_type == 'only-toroid' or Ak_type == 'only-NanoESCA':
-            return PlotData(self.Ak['data'], self.kmap['krange'])
+            data = np.array(self.Ak['data'])
         
         else:
-            return PlotData(self.Ak['data']*self.kmap['data'], 
-                        self.kmap['krange'])
+            data = self.Ak['data']*self.kmap['data']
+
+        self.kmap_cache.put(key, (data, self.kmap['data'], self.Ak['data'],
+                                  _KmapState(self.kmap, self.Ak)))
+
+        return PlotData(data, self.kmap['krange'])
+
+    @staticmethod
+    def _kmap_key(E_kin, dk, *parameters):
+        # Hashable key of all parameters of a kmap
+        parameters = tuple(value if isinstance(value, str) else float(value)
+                           for value in parameters)
+
+        return (float(E_kin), dk_fingerprint(dk)) + parameters
+
+
+    def get_kmaps(self, E_kin=30, dk=0.03, phi=0, theta=0, psi=0,
+                  Ak_type='no', polarization='p', alpha=60, beta=90,
+                  gamma=0, symmetrization='no', s_share=0.694):
+        """Returns a stack of kmaps for many parameter sets at once.
+
+        The numeric arguments can be arrays and are broadcast against
+        each other, e.g. an array of kinetic energies with a single
+        orientation or an array of theta values for one energy. All
+        kmaps are sliced on one common (kx,ky)-grid in a few vectorized
+        passes and share the polarization factor computation. Each kmap
+        equals the one from 'get_kmap' for the same parameters and the
+        same (kx,ky)-grid.
+
+        Args:
+            E_kin (float or np.array): Kinetic energies in eV.
+            dk (float or tuple): Either the desired k-resolution in
+                Angstroem^-1 or a tuple of the kx and ky axes. For a
+                single number the grid spans the largest kinetic energy.
+            phi (float or np.array): Euler orientation angles phi in
+                degree.
+            theta (float or np.array): Euler orientation angles theta
+                in degree.
+            psi (float or np.array): Euler orientation angles psi in
+                degree.
+            Ak_type (string): Same as in 'get_kmap' for all kmaps.
+            polarization (string): Same as in 'get_kmap' for all kmaps.
+            alpha (float or np.array): Angles of incidence plane in
+                degree.
+            beta (float or np.array): Azimuths of incidence plane in
+                degree.
+            gamma (float, np.array or str): Damping factors for final
+                state in Angstroem^-1. str = 'auto' sets gamma
+                automatically
+            symmetrization (str): Same as in 'get_kmap' for all kmaps.
+            s_share (float or np.array): share of s-polarized light for
+                the case of unpolarized light.
+
+        Returns:
+            (tuple): 3D array data[i, ky, kx] of the kmaps and the
+                krange of the common grid.
+        """
+
+        numeric = [E_kin, phi, theta, psi, alpha, beta, s_share]
+        if not isinstance(gamma, str):
+            numeric.append(gamma)
+
+        numeric = np.broadcast_arrays(*[np.asarray(value, dtype=np.float64)
+                                        for value in numeric])
+        numeric = [value.reshape(-1) for value in numeric]
+        E_kin, phi, theta, psi, alpha, beta, s_share = numeric[:7]
+        if not isinstance(gamma, str):
+            gamma = numeric[7]
+
+        # Common (kx,ky)-grid for all kmaps
+        if type(dk) == tuple:
+            kx, ky = dk
+
+        else:
+            grid = hemisphere_grid(E_kin.max(), dk)
+            kx, ky = grid['kx'], grid['ky']
+
+        krange = ((kx[0], kx[-1]), (ky[0], ky[-1]))
+
+        # Rotate hemispheres (not the molecule) by the Euler angles
+        rotations = np.array([compute_Euler_matrix(*angles).T
+                              for angles in zip(phi, theta, psi)])
+        data, KZ = sample_hemispheres(self.psik['data_interp'], kx, ky,
+                                      E_kin, rotations)
+
+        if symmetrization != 'no':
+            for kmap in data:
+                Orbital.symmetrize(kmap, symmetrization)
+
+        # Polarization factor of all kmaps at once
+        KX, KY = np.meshgrid(kx, ky, indexing='xy')
+        if not isinstance(gamma, str):
+            gamma = gamma[:, np.newaxis, np.newaxis]
+
+        Ak = polarization_factor(KX, KY, KZ,
+                                 E_kin[:, np.newaxis, np.newaxis],
+                                 Ak_type, polarization,
+                                 alpha[:, np.newaxis, np.newaxis],
+                                 beta[:, np.newaxis, np.newaxis], gamma,
+                                 s_share[:, np.newaxis, np.newaxis])
+
+        if Ak_type == 'only-toroid' or Ak_type == 'only-NanoESCA':
+            return Ak, krange
+
+        elif Ak_type == 'no':
+            return data, krange
+
+        else:
+            data *= Ak
+            return data, krange
+
+    def iter_kmaps(self, E_kin, k_axes, batch_size=16, **kwargs):
+        """Yields the kmaps of 'get_kmaps' for a series of kinetic
+        energies in batches, thus the memory needed for intermediate
+        arrays stays bounded for long series.
+
+        Args:
+            E_kin (np.array): Kinetic energies in eV.
+            k_axes (tuple): The kx and ky axes of the common grid.
+            batch_size (int): Number of kmaps computed at once.
+            **kwargs: Further arguments for 'get_kmaps' (numeric ones
+                have to be the same for all kmaps).
+
+        Yields:
+            (tuple): Index of the first kmap in the batch and the 3D
+                array data[i, ky, kx] of the kmaps of the batch.
+        """
+
+        E_kin = np.atleast_1d(E_kin)
+        for start in range(0, len(E_kin), batch_size):
+            data, _ = self.get_kmaps(E_kin[start:start + batch_size],
+                                     tuple(k_axes), **kwargs)
+            yield start, data
 
 
     def change_polarization(self, Ak_type='no', polarization='p', alpha=60, beta=90,
@@ -110,6 +630,89 @@ class Orbital():
     def compute_3DFT(self, dk3D, E_kin_max, value):
         """Compute 3D-FT."""
 
+        if not self.load_3DFT(dk3D, E_kin_max, value):
+            kx, ky, kz, psik = self.transform_3D(dk3D, E_kin_max, value)
+            self.store_3DFT(kx, ky, kz, psik, dk3D, E_kin_max, value)
+
+    def load_3DFT(self, dk3D, E_kin_max, value):
+        """Sets a 3D-FT computed before (e.g. stored on disk) and
+        returns whether one was found. Always False for Orbital."""
+
+        return False
+
+    def store_3DFT(self, kx, ky, kz, data, dk3D, E_kin_max, value):
+        """Sets a newly computed 3D-FT (and optionally keeps it for
+        'load_3DFT')."""
+
+        self.set_psik(kx, ky, kz, data, E_kin_max, value)
+
+    @staticmethod
+    def compute_3DFTs(orbitals, memory=1024):
+        """Computes the 3D-FTs of several orbitals at once.
+
+        Orbitals on identical real space grids and with the same 3D-FT
+        parameters (e.g. all orbitals of one molecule from the same
+        calculation) are stacked and transformed in batched FFT calls.
+        They share the k-axes of their 3D-FTs. Orbitals whose 3D-FT has
+        been computed (or can be loaded) already are skipped.
+
+        Args:
+            orbitals (list): List of Orbital objects.
+            memory (float): Approximate memory in MB for the zero padded
+                stack of one batch. At least one orbital is transformed
+                per batch.
+        """
+
+        with contextlib.ExitStack() as stack:
+            # Block other threads from computing the same 3D-FTs
+            for orbital in sorted(set(orbitals), key=id):
+                stack.enter_context(orbital._psik_lock)
+
+            groups = {}
+            for orbital in orbitals:
+                if (orbital._psik is not None or
+                        orbital.load_3DFT(*orbital._psik_parameters)):
+                    continue
+
+                key = (orbital.psi['data'].shape, orbital.psi['dx'],
+                       orbital.psi['dy'], orbital.psi['dz'],
+                       orbital._psik_parameters, orbital.fast_fft,
+                       orbital.precision, orbital.fft_workers)
+                group = groups.setdefault(key, [])
+                if orbital not in group:
+                    group.append(orbital)
+
+            for group in groups.values():
+                Orbital._transform_3D_batch(group, memory)
+
+    @staticmethod
+    def _transform_3D_batch(orbitals, memory):
+        # Batched 3D-FT of orbitals with identical grids and parameters
+        first = orbitals[0]
+        dk3D, E_kin_max, value = first._psik_parameters
+        shape, axes, windows = first.fft_grid(dk3D, E_kin_max)
+        kx, ky, kz = [k[window] for k, window in zip(axes, windows)]
+
+        itemsize = 4 if first.precision == 'float32' else 8
+        size = max(int(memory * 1024**2 // (np.prod(shape) * itemsize)), 1)
+        for start in range(0, len(orbitals), size):
+            batch = orbitals[start:start + size]
+            psik, peak_memory = windowed_fft(
+                np.stack([orbital.psi['data'] for orbital in batch]),
+                shape, windows, first.fft_workers, first.precision)
+
+            for i, orbital in enumerate(batch):
+                data = orbital.normalize_3D(psik[i], shape, axes,
+                                            peak_memory, value)
+                orbital.store_3DFT(kx, ky, kz, data, dk3D, E_kin_max,
+                                   value)
+
+            del psik
+
+    def fft_grid(self, dk3D, E_kin_max):
+        """Returns the size of the 3D-FFT, its k-axes and the indices of
+        the k-window needed up to E_kin_max."""
+
         # Determine required size (nkx,nky,nkz) of 3D-FT array to reach
         # desired resolution dk3D
         pad_x = max(
@@ -123,104 +726,200 @@ class Orbital():
         if pad_y%2 == 1: pad_y += 1  # make sure it's an even number
         if pad_z%2 == 1: pad_z += 1  # make sure it's an even number
 
-        nkx = self.psi['nx'] + pad_x
-        nky = self.psi['ny'] + pad_y
-        nkz = self.psi['nz'] + pad_z
+        # Optionally increase the sizes to ones the FFT is fast for
+        nkx = fft_size(self.psi['nx'] + pad_x, self.fast_fft)
+        nky = fft_size(self.psi['ny'] + pad_y, self.fast_fft)
+        nkz = fft_size(self.psi['nz'] + pad_z, self.fast_fft)
 
         # Set up k-grids for 3D-FT
         kx = self.set_3Dkgrid(nkx, self.psi['dx'])
         ky = self.set_3Dkgrid(nky, self.psi['dy'])
         kz = self.set_3Dkgrid(nkz, self.psi['dz'])
 
-        # Compute 3D FFT
-        # !! TESTING !!! This is supposed to yield also proper Real- and Imaginary parts!!
-#        print(nkx, nky, nkz)
-#        print(pad_x, pad_y, pad_z)
-        psi_padded = np.pad(self.psi['data'], 
-                      pad_width=((pad_x//2,pad_x//2), (pad_y//2,pad_y//2), (pad_z//2,pad_z//2)),
-                      mode='constant',
-                      constant_values=(0,0))
-        psi_padded = np.fft.ifftshift(psi_padded)                                
-        psik = np.fft.fftshift(np.fft.fftn(psi_padded))
-
-       # THIS IS THE OLD AND WELL TESTED WAY TO Compute 3D FFT
-#        psik = np.fft.fftshift(np.fft.fftn(self.psi['data'],
-#                                           s=[nkx, nky, nkz]))
-
-        # properly normalize wave function in momentum space
-        dkx, dky, dkz = kx[1]-kx[0], ky[1]-ky[0], kz[1]-kz[0]
-        factor        = dkx*dky*dkz*np.sum(np.abs(psik)**2)
-        psik         /= np.sqrt(factor)
-
         # Reduce size of array to value given by E_kin_max to save memory
         k_max      = energy_to_k(E_kin_max)
         kx_indices = np.where((kx <= k_max) & (kx >= -k_max))[0]
         ky_indices = np.where((ky <= k_max) & (ky >= -k_max))[0]
         kz_indices = np.where((kz <= k_max) & (kz >= -k_max))[0]    
-        kx         = kx[kx_indices]
-        ky         = ky[ky_indices]
-        kz         = kz[kz_indices]
-        psik       = np.take(psik, kx_indices, axis=0)
-        psik       = np.take(psik, ky_indices, axis=1)
-        psik       = np.take(psik, kz_indices, axis=2)
+
+        return ((nkx, nky, nkz), (kx, ky, kz),
+                (kx_indices, ky_indices, kz_indices))
+
+    def transform_3D(self, dk3D, E_kin_max, value):
+        """Computes the 3D-FT and returns its axes and data."""
+
+        shape, axes, windows = self.fft_grid(dk3D, E_kin_max)
+
+        # Compute 3D FFT of the zero padded wave function (centered in
+        # real and momentum space) but only keep the k-window needed
+        psik, peak_memory = windowed_fft(
+            self.psi['data'], shape, windows, self.fft_workers,
+            self.precision)
+        psik = self.normalize_3D(psik, shape, axes, peak_memory, value)
+
+        kx, ky, kz = [k[window] for k, window in zip(axes, windows)]
+
+        return kx, ky, kz, psik
+
+    def normalize_3D(self, psik, shape, axes, peak_memory, value):
+        """Normalizes the window 'psik' of the 3D-FFT of the orbital
+        (in place) and returns its value ('real', 'abs2', ...)."""
+
+        # properly normalize wave function in momentum space using
+        # Parseval's theorem for the entire (uncropped) transform
+        nkx, nky, nkz = shape
+        kx, ky, kz    = axes
+        dkx, dky, dkz = kx[1]-kx[0], ky[1]-ky[0], kz[1]-kz[0]
+        norm          = np.vdot(self.psi['data'], self.psi['data']).real
+        factor        = dkx*dky*dkz*nkx*nky*nkz*norm
+        psik         /= np.sqrt(factor)
+
+        self.fft_info = {'shape': shape,
+                         'workers': get_workers(self.fft_workers),
+                         'peak_memory': peak_memory}
+        logging.getLogger('kmap').debug(
+            '3D-FFT of size %s on %i thread(s), peak memory %.1f MB' % (
+                self.fft_info['shape'], self.fft_info['workers'],
+                peak_memory / 1024**2))
+
+        return Orbital.apply_value(psik, value)
+
+    @staticmethod
+    def apply_value(psik, value):
+        """Returns Re(), Im(), |..| or |..|^2 of psik for value 'real',
+        'imag', 'abs' or 'abs2'."""
 
         # decide whether real, imaginry part, absolute value, or squared absolute value is used
         if value == 'real':
-            psik = np.asarray(np.real(psik), order='C')
+            return np.asarray(np.real(psik), order='C')
 
         elif value == 'imag':
-            psik = np.asarray(np.imag(psik), order='C')
+            return np.asarray(np.imag(psik), order='C')
 
         elif value == 'abs':
-            psik = np.abs(psik)
+            return np.abs(psik)
 
         else:
-            psik = np.abs(psik)**2
+            return np.abs(psik)**2
+
+    def compute_direct(self, grid, rotation=None):
+        """Evaluates the normalized Fourier transform of the orbital
+        directly on the points of a (rotated) hemisphere. Rotations
+        permuting and flipping the axes keep the points on a grid along
+        two axes of the orbital, thus the sums over the axes are
+        separable. All other rotations are summed over all voxels for
+        each point (in chunks limited by 'direct_memory').
 
+        Args:
+            grid (dict): Hemisphere as returned by 'hemisphere_grid'.
+            rotation (np.array): 3x3 matrix the hemisphere is rotated by.
+                None for no rotation.
+
+        Returns:
+            (np.array): 2D array of the same shape as the grid (NaN
+                outside the photoemission horizon).
+        """
+
+        data = self.psi['data']
+        spacing = np.array([self.psi['dx'], self.psi['dy'],
+                            self.psi['dz']])
+        mask = grid['mask']
+        r = np.eye(3) if rotation is None else np.asarray(rotation)
+        r = np.where(np.abs(r) < 1e-12, 0, r)
+        nonzero = r != 0
+
+        if (np.all(nonzero.sum(axis=0) == 1) and
+                np.all(nonzero.sum(axis=1) == 1) and
+                np.allclose(np.abs(r[nonzero]), 1)):
+            # The rotation only permutes and flips the axes, thus the
+            # kx and ky values of the hemisphere stay on a grid along
+            # two axes of the orbital
+            order = [np.flatnonzero(nonzero[:, j])[0] for j in range(3)]
+            signs = np.sign(r[order, range(3)])
+            psik = direct_transform_grid(
+                np.transpose(data, order), spacing[order] * signs,
+                grid['kx'], grid['ky'], grid['KZ'], mask,
+                self.direct_memory, self.precision)[mask]
+
+        else:
+            points = np.stack([grid['KX'][mask], grid['KY'][mask],
+                               grid['KZ'][mask]], axis=1)
+            psik = direct_transform(data, spacing, points @ r.T,
+                                    self.direct_memory, self.precision)
+
+        # normalize wave function in momentum space like the 3D-FT
+        # (continuous limit of Parseval's theorem)
+        norm = np.vdot(data, data).real
+        psik /= np.sqrt((2 * np.pi)**3 / np.prod(spacing) * norm)
+
+        value = self._psik_parameters[2]
+        result = np.full(mask.shape, np.nan,
+                         dtype=np.float32 if self.precision == 'float32'
+                         else np.float64)
+        result[mask] = Orbital.apply_value(psik, value)
+
+        return result
+
+    def set_psik(self, kx, ky, kz, data, E_kin_max, value,
+                 data_interp=None):
+        """Sets the 3D-FT and the interpolating function used for the
+        kmap computation, e.g. for a 3D-FT computed elsewhere. If
+        E_kin_min is set only the spherical shell needed for kinetic
+        energies between E_kin_min and E_kin_max is kept and 'data' is
+        None. An interpolating function of another orbital (for the
+        same data) can be passed to be shared."""
 
         # Define interpolating function to be used later for kmap
         # computation
-        psik_interp = interp.RegularGridInterpolator((kx, ky, kz), psik,
-                                                     bounds_error=False,
-                                                     fill_value=np.nan)
+        if data_interp is not None:
+            psik_interp = data_interp
+            data = data_interp.data
+
+        elif self.E_kin_min is None:
+            psik_interp = UniformGridInterpolator((kx, ky, kz), data,
+                                                  fill_value=np.nan)
+
+        else:
+            psik_interp = ShellGridInterpolator(
+                (kx, ky, kz), data, energy_to_k(self.E_kin_min),
+                energy_to_k(E_kin_max), fill_value=np.nan)
+            data = None
 
         # Set attributes
         self.psik = {'kx': kx, 'ky': ky, 'kz': kz,
+                     'E_kin_min': self.E_kin_min,
                      'E_kin_max':E_kin_max,
                      'value': value,
-                     'data': psik,
+                     'data': data,
                      'data_interp': psik_interp}
 
-        # Why? Local variables should only live until end of function
-        # anyways...
-        # Free memory for psik-array
-        del psik
+    def get_psik_data(self):
+        """Returns the 3D-FT as 3D array on the full k-grid, also if
+        only a spherical shell of it is stored (zero outside)."""
+
+        if self.psik['data'] is not None:
+            return self.psik['data']
+
+        return np.nan_to_num(self.psik['data_interp'].to_dense())
 
     # Make hemi-spherical cut through 3D Fourier transform
     def set_kinetic_energy(self, E_kin, dk):
 
-        kmax = energy_to_k(E_kin)
-        if type(dk) == tuple:
-            kxi = dk[0]
-            kyi = dk[1]
-            num_kx = len(kxi)
-            num_ky = len(kyi)
+        # The grid is shared with all other orbitals using the same cut
+        grid = cached_hemisphere_grid(E_kin, dk)
+        if self.engine == 'direct':
+            # Evaluated for the actual orientation in 'set_orientation'
+            # (not twice on each new cut)
+            data = None
+
         else:
-            num_kx = int(2 * kmax / dk)
-            num_ky = int(2 * kmax / dk)
-            kxi = np.linspace(-kmax, +kmax, num_kx)
-            kyi = np.linspace(-kmax, +kmax, num_ky)
-
-        krange = ((kxi[0], kxi[-1]), (kyi[0], kyi[-1]))
-        KX, KY = np.meshgrid(kxi, kyi, indexing='xy')
-        KZ = np.sqrt(kmax**2 - KX**2 - KY**2)
-        kxkykz = list(map(lambda a, b, c: (a, b, c),
-                          KX.flatten(), KY.flatten(), KZ.flatten()))
-        data = np.reshape(self.psik['data_interp'](kxkykz), (num_kx, num_ky))
+            data = sample_hemisphere(self.psik['data_interp'], grid)
 
         # Set kmap attributes
-        self.kmap = {'E_kin': E_kin, 'dk': dk, 'krange': krange,
-                     'KX': KX, 'KY': KY, 'KZ': KZ,
+        self.kmap = {'E_kin': E_kin, 'dk': dk, 'krange': grid['krange'],
+                     'kx': grid['kx'], 'ky': grid['ky'],
+                     'KX': grid['KX'], 'KY': grid['KY'], 'KZ': grid['KZ'],
+                     'mask': grid['mask'],
                      'phi': 0, 'theta': 0, 'psi': 0,
                      'data': data}
 
@@ -274,19 +973,16 @@ class Orbital():
     # Rotate hemisphere KX, KY, KZ by Euler angles phi, theta, psi
     def set_orientation(self, phi, theta, psi):
 
-        KX, KY, KZ = self.kmap['KX'], self.kmap['KY'], self.kmap['KZ']
-        nkx = KX.shape[0]
-        nky = KX.shape[1]
         r = compute_Euler_matrix(phi, theta, psi)
         r = r.T
 
-        # KXr, KYr, KZr are the k-coordinates of the rotated hemisphere
-        KXr = r[0, 0] * KX + r[0, 1] * KY + r[0, 2] * KZ
-        KYr = r[1, 0] * KX + r[1, 1] * KY + r[1, 2] * KZ
-        KZr = r[2, 0] * KX + r[2, 1] * KY + r[2, 2] * KZ
-        kxkykz = list(map(lambda a, b, c: (a, b, c),
-                          KXr.flatten(), KYr.flatten(), KZr.flatten()))
-        data = np.reshape(self.psik['data_interp'](kxkykz), (nkx, nky))
+        # Sample the 3D-FT on the rotated hemisphere
+        if self.engine == 'direct':
+            data = self.compute_direct(self.kmap, rotation=r)
+
+        else:
+            data = sample_hemisphere(self.psik['data_interp'], self.kmap,
+                                     rotation=r)
 
         # update attributes
         self.kmap['phi'] = phi
@@ -326,98 +1022,12 @@ class Orbital():
             return
 
 
-        # Convert angles to rad and compute sin and cos for later use
-        a = np.radians(alpha)
-        b = np.radians(beta)
-        sin_a = np.sin(a)
-        cos_a = np.cos(a)
-        sin_b = np.sin(b)
-        cos_b = np.cos(b)
-
-        # Compute gamma according to inelastic free mean path
-        if gamma == 'auto':
-            # lambda is calculated from the "universal curve" empirical
-            # relation
-            E_kin = self.kmap['E_kin']
-            c1 = 143
-            c2 = 0.054
-            lam = c1 * E_kin**(-2) + c2 * np.sqrt(E_kin)
-            lam *= 10
-            gamma_calc = 1 / lam
-        else:
-            gamma_calc = gamma
-
-        # Retrieve k-grid from kmap
-        kx, ky, kz = self.kmap['KX'], self.kmap['KY'], self.kmap['KZ']
-        # Magnitude of k-vector
-        k2 = kx**2 + ky**2 + kz**2
-        kmax = energy_to_k(self.kmap['E_kin'])
-
-        # At the toroid, the emitted electron is always in the plane of
-        # incidence and the sample is rotated
-        if Ak_type == 'toroid' or Ak_type == 'only-toroid':     
-            # Parallel component of k-vector
-            kpar = np.sqrt(k2 - kz**2)
-            # |A.k|^2 factor
-            Ak = (kpar * cos_a + kz * sin_a)**2
-
-        # At the NanoESCA, either p-polarization ,s-polarization, or
-        # circularly polarized light can be simulated
-        elif Ak_type == 'NanoESCA' or Ak_type == 'only-NanoESCA':
-            # In-plane = p-polarization
-            if polarization == 'p':
-                Ak = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
-                Ak = Ak**2 + gamma_calc**2 * sin_a**2
-
-            # Out-of-plane = s-polarization
-            elif polarization == 's':
-                Ak = -kx * sin_b + ky * cos_b
-                Ak = Ak**2
-                Ak[kx**2 + ky**2 > kmax**2] = np.nan
-
-
-            # unpolarized light, e.g. He-lamp 
-            # Compare Equation (37) in S. Moser, J. Electr. Spectr.
-            # Rel. Phen. 214, 29-52 (2017).  
-            # Eq. (37) turned out to be wrong!!!          
-#            elif polarization == 'unpolarized':
-#                Ak = (k2 + gamma_calc**2 + 2*kx*kz*cos_b + 2*ky*kz*sin_b)*np.sin(2*a)  
-#                Ak+= (kx**2*sin_b + ky**2*cos_b - kz**2 - gamma_calc**2)*np.cos(2*a)  
-#                Ak*= (2/3)       
-
-            # unpolarized-light is now correctly treated as average of
-            # s- and p-polarized light
-            elif polarization == 'unpolarized':
-                Ak_p = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
-                Ak_p = Ak_p**2 + gamma_calc**2 * sin_a**2
-                Ak_s = -kx * sin_b + ky * cos_b
-                Ak_s = Ak_s**2
-
-                Ak = s_share*Ak_s + (1 - s_share)*Ak_p
-                Ak[kx**2 + ky**2 > kmax**2] = np.nan
-
-
-            # Circularly polarized light (right-handed)
-            elif polarization == 'C+':
-                polp = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
-                pols = -kx * sin_b + ky * cos_b
-                Ak = 0.5 * (polp**2 + gamma_calc**2 * sin_a**2) + 0.5 * \
-                    pols**2 + (sin_b * kx - cos_b * ky) * gamma_calc * sin_a
-
-            # Circularly polarized light (left-handed)
-            elif polarization == 'C-':
-                polp = kx * cos_a * cos_b + ky * cos_a * sin_b + kz * sin_a
-                pols = -kx * sin_b + ky * cos_b
-                Ak = 0.5 * (polp**2 + gamma_calc**2 * sin_a**2) + 0.5 * \
-                    pols**2 - (sin_b * kx - cos_b * ky) * gamma_calc * sin_a
-
-            # CDAD-signal (right-handed - left-handed) using empirically
-            # damped plane wave
-            elif polarization == 'CDAD':
-                # Compare Equation (31) in S. Moser, J. Electr. Spectr.
-                # Rel. Phen. 214, 29-52 (2017).
-                Ak = +2 * (sin_b * kx - cos_b * ky) * gamma_calc * sin_a
-                Ak[kx**2 + ky**2 > kmax**2] = np.nan
+        # Shared with all other orbitals using the same cut and
+        # parameters
+        Ak = cached_polarization_factor(self.kmap, self.kmap['E_kin'],
+                                        self.kmap['dk'], Ak_type,
+                                        polarization, alpha, beta, gamma,
+                                        s_share)
 
         # Set attributes
         self.Ak = {'Ak_type': Ak_type,
@@ -457,53 +1067,28 @@ class Orbital():
                 '3-fold', '3-fold+mirror','4-fold', '4-fold+mirror'
 
         """
+        self.kmap['data'] = Orbital.symmetrize(self.kmap['data'],
+                                               symmetrization)
+        self.kmap['symmetrization'] = symmetrization
+
+    @staticmethod
+    def symmetrize(data, symmetrization):
+        """Symmetrizes a kmap in place.
+
+        Args:
+            data (np.array): 2D array of the kmap.
+            symmetrization (str): either 'no', '2-fold', '2-fold+mirror',
+                '3-fold', '3-fold+mirror','4-fold', '4-fold+mirror'
+
+        Returns:
+            (np.array): The symmetrized kmap.
+        """
+
         if symmetrization == 'no':
-            self.kmap['symmetrization'] = 'no'
-            return 
-
-        data = self.kmap['data']
-
-        if symmetrization == '2-fold': 
-            data += rotate(np.nan_to_num(data), 180, reshape=False)
-            data /= 2
-                    
-        elif symmetrization == '2-fold+mirror': 
-            data += rotate(np.nan_to_num(data), 180, reshape=False)
-            data += np.flip(data, 0)  # mirror map with respect to first axis
-            data /= 4
-
-        elif symmetrization == '3-fold': 
-            data1 = rotate(np.nan_to_num(data), 120, reshape=False)
-            data2 = rotate(np.nan_to_num(data), 240, reshape=False)
-            data += (data1 + data2)
-            data /= 3
-                     
-        elif symmetrization == '3-fold+mirror': 
-            data1 = rotate(np.nan_to_num(data), 120, reshape=False)
-            data2 = rotate(np.nan_to_num(data), 240, reshape=False)
-            data += (data1 + data2)
-            data += np.flip(data, 0)
-            data /= 6
-
-        elif symmetrization == '4-fold': 
-            data1 = rotate(np.nan_to_num(data), 90, reshape=False)
-            data2 = rotate(np.nan_to_num(data), 180, reshape=False)
-            data3 = rotate(np.nan_to_num(data), 270, reshape=False)
-            data += (data1 + data2 + data3)
-            data /= 4
-                      
-        elif symmetrization == '4-fold+mirror': 
-            data1 = rotate(np.nan_to_num(data), 90, reshape=False)
-            data2 = rotate(np.nan_to_num(data), 180, reshape=False)
-            data3 = rotate(np.nan_to_num(data), 270, reshape=False)
-            data += (data1 + data2 + data3)
-            data += np.flip(data, 0)  # mirror map with respect to first axis
-            data += np.flip(data, 1)  # mirror map with respect to second axis
-            data /= 8
+            return data
 
-        self.kmap['symmetrization'] = symmetrization
-        self.kmap['data'] = data
-        return
+        # Rotation and mirror weights are computed once per kmap shape
+        return get_symmetrizer(data.shape, symmetrization)(data)
 
     def check_new_symmetrization(self, symmetrization):
 
@@ -559,103 +1144,75 @@ class Orbital():
         return
 
     def _read_cube(self, file):
-        """ Read orbital data from cube file."""
-
-        ''' File and path to file are both string. Should _read_cube
-        get the file path or the file itself?
-        if type(file) == str:
-            orbfile = open(file, "r")
-            lines   = orbfile.readlines()
-            orbfile.close()
+        """ Read orbital data from cube file.
+
+        Args:
+            file (str, Path, file or dict): Entire cube file as one
+                string, path to a cube file, file object or a cube file
+                already parsed by 'read_cube'.
+        """
+
+        cube = file if isinstance(file, dict) else read_cube(file)
+
+        # The real space data can only be read again from a file
+        if isinstance(file, dict):
+            self._psi_source = file.get('source')
+
+        elif isinstance(file, (str, Path)) and os.path.isfile(file):
+            self._psi_source = file
+
         else:
-        '''
-        # Split the entire file into separate lines
-        lines = file.split('\n')
-
-        # Set up real space grid info
-        # Conversion factor from Bohr to Angstroem
-        b2a = 0.529177105787531
-
-        name = lines[1].strip()
-
-        x0, y0, z0 = b2a * float(lines[2].split()[1]), b2a * float(
-            lines[2].split()[2]), b2a * float(lines[2].split()[3])
-        nx, ny, nz = int(lines[3].split()[0]), int(
-            lines[4].split()[0]), int(lines[5].split()[0])
-        dx, dy, dz = b2a * float(lines[3].split()[1]), b2a * float(
-            lines[4].split()[2]), b2a * float(lines[5].split()[3])
-        lx, ly, lz = (nx - 1) * dx, (ny - 1) * dy, (nz - 1) * dz
-        x = np.linspace(x0, x0 + lx, nx)
-        y = np.linspace(y0, y0 + ly, ny)
-        z = np.linspace(z0, z0 + lz, nz)
-
-        # Read atomic coordinates
-        # Number of atoms from line 3
-        num_atom = int(lines[2].split()[0])
-        chemical_numbers = []
-        atomic_coordinates = []
-        for line in lines[6:6 + num_atom]:
-            words = line.split()
-            chemical_numbers.append(int(words[0]))
-            a, b, c = float(words[2]), float(words[3]), float(words[4])
-            atomic_coordinates.append([b2a * a, b2a * b, b2a * c])
-
-        atomic_coordinates = np.array(atomic_coordinates)
-
-        # Now read cube data
-        data = []
-        for line in lines[(6 + num_atom):]:
-            words = line.split()
-            for word in words:
-                data.append(float(word))
-        # Conversion to 3D-numpy array
-        data = np.reshape(np.array(data), (nx, ny, nz))
+            self._psi_source = None
 
         # set attributes
-        self.psi = {'name': name,
-                    'nx': nx, 'ny': ny, 'nz': nz,
-                    'dx': dx, 'dy': dy, 'dz': dz,
-                    'x': x, 'y': y, 'z': z,
-                    'data': data}
-        self.molecule = {'num_atom': num_atom,
-                         'chemical_numbers': chemical_numbers,
-                         'atomic_coordinates': atomic_coordinates}
+        self.psi = cube['psi']
+        self.molecule = cube['molecule']
+        self._bonds = {}
 
     def get_bonds(self,lower_factor=0.8,upper_factor=1.2):
-        """ returns a list of bond used for plotting the molecular structure.
+        """ returns the bonds used for plotting the molecular structure.
 
         Args:
             lower_factor (float): lower bound for drawing bonds w.r.t sum of covalent radii
             upper_factor (float): upper bound for drawing bonds w.r.t sum of covalent radii
+
+        Returns:
+            (np.array): Array of shape (n_bonds, 2, 3) with the positions
+                (in units of the grid spacing) of both atoms of each
+                bond. Each bond is contained once. The array is cached
+                and read-only.
         """
-        covalent_R = {1:0.32, 2:0.32,  # H, He
-                      3:1.34, 4:0.90, 5:0.82, 6:0.77, 7:0.71, 8:0.73, 9:0.71,10:0.69, # Li - Ne
-                     11:1.54,12:1.30,13:1.18,14:1.11,15:1.06,16:1.02,17:0.99,18:0.97, # Na- Ar
-                     19:1.96,20:1.74,21:1.44,22:1.36,23:1.25,24:1.27,25:1.39,26:1.25, # K - Fe
-                     27:1.26,28:1.21,29:1.38,30:1.31,31:1.26,32:1.22,33:1.21,34:1.16, # Co- Se
-                     35:1.14,36:1.10,                                                 # Br, Kr
-                     37:2.11,38:1.92,39:1.62,40:1.48,41:1.37,41:1.45,43:1.31,44:1.26, # Rb -Ru
-                     45:1.35,46:1.31,47:1.53,48:1.48,49:1.44,50:1.41,51:1.38,52:1.35, # Rh -Te
-                     53:1.33,54:1.30,                                                 #  I, Xe
-                     55:2.25,56:1.98,57:1.69,72:1.50,73:1.38,74:1.46,75:1.59,76:1.28, # Cs -Os
-                     77:1.37,78:1.38,79:1.38,80:1.49,81:1.48,82:1.46,83:1.46,84:1.40, # Ir -Po
-                     85:1.45,86:1.45}                                                 # At, Rn
-               
+
+        key = (lower_factor, upper_factor)
+        if key in self._bonds:
+            return self._bonds[key]
+
         dx,dy,dz    = self.psi['dx'], self.psi['dy'], self.psi['dz'] 
-        coordinates = self.molecule['atomic_coordinates']
-        Z_list      = self.molecule['chemical_numbers']                  
-        bonds       = []
-        for atom1, Z1 in zip(coordinates, Z_list):
-            x1,y1,z1 = atom1[0], atom1[1], atom1[2]
-            R1       = covalent_R[Z1]
-            for atom2, Z2 in zip(coordinates, Z_list):
-                x2,y2,z2 = atom2[0], atom2[1], atom2[2] 
-                R2       = covalent_R[Z2] 
-                R        = R1 + R2    # sum of covalent radii 
-                distance = np.sqrt((x1-x2)**2 + (y1-y2)**2 + (z1-z2)**2)
-                if lower_factor*R <= distance <= upper_factor*R:
-                    bond = [[x1/dx,y1/dy,z1/dz], [x2/dx,y2/dy,z2/dz]] 
-                    bonds.append(np.array(bond))
+        coordinates = np.asarray(self.molecule['atomic_coordinates'],
+                                 dtype=np.float64).reshape(-1, 3)
+        R           = np.array([COVALENT_RADII[Z] for Z in
+                                self.molecule['chemical_numbers']])
+
+        # Only atom pairs closer than the largest possible bond length
+        # are checked (neighbour search with a k-d tree)
+        pairs = np.empty((0, 2), dtype=np.intp)
+        if len(R) > 1:
+            tree  = cKDTree(coordinates)
+            pairs = tree.query_pairs(upper_factor * 2 * R.max(),
+                                     output_type='ndarray')
+
+        i, j     = pairs[:, 0], pairs[:, 1]
+        distance = np.linalg.norm(coordinates[i] - coordinates[j], axis=1)
+        R_sum    = R[i] + R[j]    # sum of covalent radii
+        bonded   = ((lower_factor * R_sum <= distance) &
+                    (distance <= upper_factor * R_sum))
+
+        # Sort bonds by atom indices for a reproducible order
+        pairs = pairs[bonded]
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        bonds = coordinates[pairs] / np.array([dx, dy, dz])
+        bonds.flags.writeable = False
+        self._bonds[key] = bonds
 
         return bonds
 
@@ -671,3 +1228,19 @@ class Orbital():
         return k
 
 
+def _in_ram(array):
+    # The array if it is held in RAM (not memory mapped from a file on
+    # disk, files in shared memory are held in RAM)
+    if isinstance(array, np.memmap) and not in_shared_memory(array):
+        return None
+
+    return array
+
+
+def _remove_file(path):
+    # Removes a file shared by 'Orbital.share_psik'
+    try:
+        os.remove(path)
+
+    except OSError:
+        pass
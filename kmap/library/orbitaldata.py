@@ -1,47 +1,159 @@
 import os
+import weakref
 import urllib.request
+from pathlib import Path
+import numpy as np
 from kmap.library.orbital import Orbital
+from kmap.library.orbitalregistry import orbital_registry
+from kmap.library.cubefile import load_cube
+from kmap.library.cache import DiskCache
 from kmap.config.config import config
 from kmap.library.abstractdata import AbstractData
 
 
+# 3D-FTs (their interpolators) of all orbitals by cube file hash and
+# parameters, as long as they are in use. Orbitals loaded from the same
+# cube file (e.g. in several tabs) share one read-only 3D-FT
+_shared_3DFTs = weakref.WeakValueDictionary()
+
+
 class OrbitalData(Orbital, AbstractData):
 
     def __init__(self, cube, ID, name='', meta_data={}):
 
         self.dk3D = float(config.get_key('orbital', 'dk3D'))
+        if isinstance(cube, dict) and 'hash' in cube:
+            self.hash = cube['hash']
+            self.cache = OrbitalData.get_cache(cube['source'])
+
+        else:
+            self.hash, self.cache = None, None
 
         AbstractData.__init__(self, ID, name, meta_data)
+        fft_workers = int(config.get_key('orbital', 'fft_workers'))
+        fast_fft = config.get_key('orbital', 'fast_fft') == 'True'
+        precision = config.get_key('orbital', 'precision')
+        kmap_cache_size = config.get_key('orbital', 'kmap_cache_size')
+        kmap_cache_size = (None if kmap_cache_size == 'None'
+                           else float(kmap_cache_size))
+        E_kin_min = config.get_key('orbital', 'E_kin_min')
+        E_kin_min = None if E_kin_min == 'None' else float(E_kin_min)
+        # Memory budget shared by all orbitals
+        memory_budget = config.get_key('orbital', 'memory_budget')
+        orbital_registry.max_size = (None if memory_budget == 'None'
+                                     else float(memory_budget))
+        orbital_registry.drop_psi = config.get_key(
+            'orbital', 'drop_psi') == 'True'
+        engine = config.get_key('orbital', 'engine')
+        direct_memory = float(config.get_key('orbital', 'direct_memory'))
         Orbital.__init__(self, cube, file_format='cube', dk3D=self.dk3D,
-                         value='abs2')
+                         value='abs2', fft_workers=fft_workers,
+                         fast_fft=fast_fft, precision=precision,
+                         kmap_cache_size=kmap_cache_size,
+                         E_kin_min=E_kin_min, engine=engine,
+                         direct_memory=direct_memory)
 
     @classmethod
     def init_from_file(cls, file_path, ID):
-        with open(file_path, 'r') as f:
-            file = f.read()
+        cube = load_cube(file_path, OrbitalData.get_cache(file_path))
 
-            name, keys = OrbitalData._get_metadata(file, file_path)
+        name, keys = OrbitalData._get_metadata(cube, file_path)
 
-        return cls(file, ID, name=name, meta_data=keys)
+        return cls(cube, ID, name=name, meta_data=keys)
 
     @classmethod
     def init_from_online(cls, url, ID, meta_data={}):
 
         with urllib.request.urlopen(url) as f:
-            file = f.read().decode('utf-8')
+            cube = load_cube(f, OrbitalData.get_cache())
+
+        name, keys = OrbitalData._get_metadata(cube, url)
+        name = meta_data['name'] if 'name' in meta_data else name
+        meta_data.update(keys)
+
+        return cls(cube, ID, name=name, meta_data=meta_data)
+
+    def load_3DFT(self, dk3D, E_kin_max, value):
+        """Share the 3D-FT with other orbitals of the same cube file and
+        parameters or load it from the cache if it has been computed
+        for the same cube file and parameters before."""
+
+        if self.hash is None:
+            return False
+
+        key = self._3DFT_key(dk3D, E_kin_max, value)
+        data_interp = _shared_3DFTs.get((key, self.E_kin_min))
+        if data_interp is not None:
+            self.set_psik(*data_interp.grid, None, E_kin_max, value,
+                          data_interp=data_interp)
+            return True
+
+        entry = None if self.cache is None else self.cache.load(key)
+        if entry is None:
+            return False
+
+        arrays, _ = entry
+        self.set_psik(np.array(arrays['kx']), np.array(arrays['ky']),
+                      np.array(arrays['kz']), arrays['data'],
+                      E_kin_max, value)
+        _shared_3DFTs[(key, self.E_kin_min)] = self.psik['data_interp']
+
+        return True
+
+    def store_3DFT(self, kx, ky, kz, data, dk3D, E_kin_max, value):
+        """Set a newly computed 3D-FT and store it in the cache."""
+
+        if self.hash is not None:
+            key = self._3DFT_key(dk3D, E_kin_max, value)
+            data.setflags(write=False)  # shared with other orbitals
+            if self.cache is not None:
+                self.cache.store(key, {'kx': kx, 'ky': ky, 'kz': kz,
+                                       'data': data})
+
+        self.set_psik(kx, ky, kz, data, E_kin_max, value)
+        if self.hash is not None:
+            _shared_3DFTs[(key, self.E_kin_min)] = self.psik['data_interp']
+
+    def _3DFT_key(self, dk3D, E_kin_max, value):
+        # Cache key of the 3D-FT of this cube file and parameters
+        return 'psik-%s-%r-%r-%s-%s%s' % (self.hash, float(dk3D),
+                                          float(E_kin_max), value,
+                                          self.precision,
+                                          '-fast' if self.fast_fft else '')
+
+    @classmethod
+    def get_cache(cls, file_path=None):
+        """Returns the DiskCache for parsed cube files as set up in the
+        [cache] section of the settings or None if caching is disabled.
 
-            name, keys = OrbitalData._get_metadata(file, url)
-            name = meta_data['name'] if 'name' in meta_data else name
-            meta_data.update(keys)
-            
-              
+        Args:
+            file_path (str): Path to the cube file. Only needed if the
+                cache is to be stored next to the source file.
+        """
 
-        return cls(file, ID, name=name, meta_data=meta_data)
+        if config.get_key('cache', 'enabled') != 'True':
+            return None
+
+        directory = config.get_key('cache', 'directory')
+        if directory == 'source' and file_path is not None:
+            directory = Path(file_path).parent / '.kmap_cache'
+
+        elif directory in ['None', 'source']:
+            directory = Path.home() / '.cache' / 'kmap'
+
+        max_size = config.get_key('cache', 'max_size')
+        max_size = None if max_size == 'None' else float(max_size)
+
+        return DiskCache(directory, max_size)
 
     @classmethod
-    def _get_metadata(cls, file, file_path):
+    def _get_metadata(cls, cube, file_path):
+
+        if isinstance(cube, dict):
+            first_line, second_line = cube['comments']
 
-        first_line, second_line = file.split('\n')[:2]
+        else:
+            first_line, second_line = cube.split('\n')[:2]
 
         name = os.path.splitext(os.path.split(file_path)[1])[0]
         keys = {config.get_key('cube', 'line_one'): first_line.strip(),
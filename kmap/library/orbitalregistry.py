@@ -0,0 +1,181 @@
+"""Defines the OrbitalRegistry class.
+
+This file defines a class named OrbitalRegistry designed to keep track
+of the memory used by all orbitals of a session. Once the orbitals use
+more memory than a configurable budget, the 3D-FTs (and optionally the
+real space data) of the least recently used orbitals are freed. Freed
+data is computed or loaded again transparently once it is needed.
+"""
+
+# Python Imports
+import time
+import weakref
+import threading
+from collections import OrderedDict
+
+
+class OrbitalRegistry():
+    """Registry of all orbitals with a memory budget.
+
+    Orbitals register themselves on creation and mark themselves as
+    used whenever their 3D-FT is accessed. Only memory held in RAM is
+    counted, arrays memory mapped from files are not.
+    """
+
+    def __init__(self, max_size=None, drop_psi=False):
+        """
+        Args:
+            max_size (float): Memory budget in MB for all orbitals. None
+                for no limit.
+            drop_psi (bool): If True, also the real space data of
+                orbitals read from a file is freed (and read again from
+                the file when needed).
+        """
+
+        self.max_size = max_size
+        self.drop_psi = drop_psi
+        self.evictions = 0
+
+        # Orbitals by id in the order they were used last
+        self._orbitals = OrderedDict()
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def register(self, orbital):
+        """Adds an orbital to the registry. It is removed automatically
+        once it is garbage collected.
+
+        Args:
+            orbital (Orbital): Orbital to be added.
+        """
+
+        key = id(orbital)
+        reference = weakref.ref(orbital, lambda _: self._remove(key))
+        with self._lock:
+            self._orbitals[key] = reference
+            self._last_used[key] = time.time()
+
+    def touch(self, orbital):
+        """Marks an orbital as used and frees the data of other orbitals
+        if the memory budget is exceeded.
+
+        Args:
+            orbital (Orbital): Orbital used.
+        """
+
+        key = id(orbital)
+        with self._lock:
+            if key not in self._orbitals:
+                return
+
+            self._orbitals.move_to_end(key)
+            self._last_used[key] = time.time()
+
+        if self.max_size is not None:
+            self.enforce(keep=orbital)
+
+    def enforce(self, keep=None):
+        """Frees the data of the least recently used orbitals until all
+        orbitals fit into the memory budget.
+
+        Args:
+            keep (Orbital): Orbital never freed (e.g. the one in use).
+
+        Returns:
+            (int): Number of orbitals whose data has been freed.
+        """
+
+        if self.max_size is None:
+            return 0
+
+        orbitals = self.orbitals()
+        freed = 0
+        for orbital in orbitals:
+            if _total(orbitals) <= self.max_size * 1024**2:
+                break
+
+            # Only orbitals with data in RAM are worth freeing
+            usage = orbital.memory_usage()
+            if orbital is keep or not (
+                    usage['psik'] or (self.drop_psi and usage['psi'])):
+                continue
+
+            if orbital.release(psi=self.drop_psi):
+                freed += 1
+
+        self.evictions += freed
+
+        return freed
+
+    def orbitals(self):
+        """Returns all registered orbitals still alive, least recently
+        used first."""
+
+        with self._lock:
+            references = list(self._orbitals.values())
+
+        orbitals = [reference() for reference in references]
+
+        return [orbital for orbital in orbitals if orbital is not None]
+
+    def status(self):
+        """Returns the memory used by each orbital.
+
+        Returns:
+            (list): One dictionary per orbital (least recently used
+                first) with the 'orbital', its 'name' (if any), the
+                time it was 'last_used' and the bytes used by its real
+                space data 'psi', its 3D-FT 'psik', its cached 'kmaps'
+                and in 'total'.
+        """
+
+        status = []
+        for orbital in self.orbitals():
+            with self._lock:
+                last_used = self._last_used.get(id(orbital))
+
+            entry = {'orbital': orbital,
+                     'name': getattr(orbital, 'name', None),
+                     'last_used': last_used}
+            entry.update(orbital.memory_usage())
+            status.append(entry)
+
+        return status
+
+    def info(self):
+        """Returns a summary of the memory use of all orbitals.
+
+        Returns:
+            (dict): Number of 'orbitals', bytes used in 'total' (arrays
+                shared by several orbitals counted once), the budget
+                'max_size' in MB and the number of 'evictions'.
+        """
+
+        orbitals = self.orbitals()
+
+        return {'orbitals': len(orbitals), 'total': _total(orbitals),
+                'max_size': self.max_size, 'evictions': self.evictions}
+
+    def _remove(self, key):
+        # Called once a registered orbital is garbage collected
+        with self._lock:
+            self._orbitals.pop(key, None)
+            self._last_used.pop(key, None)
+
+
+def _total(orbitals):
+    # Bytes used by all orbitals, shared arrays are counted once
+    arrays = {}
+    total = 0
+    for orbital in orbitals:
+        for array in orbital.memory_arrays().values():
+            if array is not None:
+                arrays[id(array)] = array.nbytes
+
+        total += orbital.memory_usage()['kmaps']
+
+    return total + sum(arrays.values())
+
+
+# Process-wide registry of all orbitals
+orbital_registry = OrbitalRegistry()
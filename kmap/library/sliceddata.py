@@ -1,6 +1,11 @@
 # Python Imports
+import os
 import logging
+import weakref
+import threading
+import multiprocessing
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Third Party Imports
 import h5py
@@ -13,32 +18,97 @@ from kmap.library.abstractdata import AbstractData
 from kmap.library.misc import axis_from_range, energy_to_k
 from kmap.library.database import Database
 from kmap.library.orbital import Orbital
+from kmap.library.cubefile import read_cube
 from kmap.library.axis import Axis
+from kmap.library.hdf5writer import HDF5Writer
+from kmap.library.broadenedcube import BroadenedCube
 
 
 class SlicedData(AbstractData):
 
-    def __init__(self, name, axis_1, axis_2, axis_3, data, meta_data={}):
+    def __init__(self, name, axis_1, axis_2, axis_3, data, meta_data={},
+                 lazy=False, dtype='float64'):
+        """
+        Args:
+            name (str): Name of the data. Has to be non empty.
+            axis_1 (list): [label, units, range] of the first axis.
+            axis_2 (list): [label, units, range] of the second axis.
+            axis_3 (list): [label, units, range] of the third axis.
+            data (np.array): 3D data. In lazy mode any 3D array-like
+                supporting basic indexing (e.g. an h5py dataset or a
+                np.memmap) is kept as it is and only the slices needed
+                are read from it.
+            meta_data (dict): Additional information about the data.
+            lazy (bool): If True, the data is neither copied nor
+                converted. Thus data larger than the RAM can be browsed.
+            dtype (str): Data type the data is stored in. Either
+                'float64', 'float32' (half the memory) or 'native' to
+                keep the data type of the data passed (e.g. uint16 for
+                counts). Slices are always converted to float64. The
+                data is not copied if it already has this data type.
+        """
+
         if isinstance(name, str) and name:
             super(SlicedData, self).__init__(ID.new_ID(), name, meta_data)
 
         else:
             raise ValueError('name has to be string and not empty')
 
-        data = np.array(data, dtype=np.float64)
+        if not lazy:
+            data = np.asarray(data)
+            data = data.astype(_storage_dtype(data.dtype, dtype), copy=False)
+
         if len(data.shape) == 3:
             self.data = data
 
         else:
             raise ValueError('data has to be 3D')
 
-        axis_1 = Axis.init_from_hdf_list(axis_1, len(data[:, 0, 0]))
-        axis_2 = Axis.init_from_hdf_list(axis_2, len(data[0, :, 0]))
-        axis_3 = Axis.init_from_hdf_list(axis_3, len(data[0, 0, :]))
+        self.lazy = lazy
+        # Data as passed and the order of its axes the axes are
+        # displayed in. Lazy data is never transposed itself (h5py
+        # datasets can't be)
+        self._base = data
+        self._axes_order = [0, 1, 2]
+        self._file = None
+
+        # Maximum memory in MB for copies of the data contiguous along
+        # another axis than the first one. Slices along such an axis are
+        # read from the copy (as fast as along the first axis) once it
+        # has been built in the background. None for no copies
+        self.axis_cache_size = None
+        self._axis_cache = {}
+        self._axis_cache_lock = threading.Lock()
+        self._closed = False
+        self._building = set()
+
+        axis_1 = Axis.init_from_hdf_list(axis_1, data.shape[0])
+        axis_2 = Axis.init_from_hdf_list(axis_2, data.shape[1])
+        axis_3 = Axis.init_from_hdf_list(axis_3, data.shape[2])
         self.axes = [axis_1, axis_2, axis_3]
 
     @classmethod
-    def init_from_hdf5(cls, file_path, keys={}, meta_data={}):
+    def init_from_hdf5(cls, file_path, keys={}, meta_data={}, lazy=False,
+                       dtype='float64'):
+        """Returns a SlicedData object read from a hdf5 file.
+
+        Args:
+            file_path (str): Path to the hdf5 file.
+            keys (dict): Names of the datasets in the file differing
+                from the default ones.
+            meta_data (dict): Additional meta data. All datasets not
+                used otherwise are added to it.
+            lazy (bool): If True, the file is kept open and only the
+                slices needed are read from the 'data' dataset. It is
+                closed by 'close' or once the SlicedData is garbage
+                collected.
+            dtype (str): Data type the data is stored in (see
+                constructor). Ignored in lazy mode.
+
+        Returns:
+            (SlicedData): SlicedData containing the data from the file.
+        """
+
         # Updates default file_keys with user defined keys
         file_keys = {'name': 'name', 'axis_1_label': 'axis_1_label',
                      'axis_1_units': 'axis_1_units',
@@ -52,7 +122,8 @@ class SlicedData(AbstractData):
                      'data': 'data'}
         file_keys.update(keys)
 
-        with h5py.File(file_path, 'r') as file:
+        file = h5py.File(file_path, 'r')
+        try:
             # First check if necessary datasets exist
             for _, value in file_keys.items():
                 if value not in file:
@@ -90,7 +161,7 @@ class SlicedData(AbstractData):
                     axis_3_range = file[key][()]
 
                 elif key == file_keys['data']:
-                    data = file[key][()]
+                    data = file[key] if lazy else file[key][()]
 
                 else:
                     try:
@@ -99,14 +170,28 @@ class SlicedData(AbstractData):
                     except:
                         meta_data.update({key: str(file[key][()])})
 
+        except:
+            file.close()
+            raise
+
+        if not lazy:
+            file.close()
+
         axis_1 = [axis_1_label, axis_1_units, axis_1_range]
         axis_2 = [axis_2_label, axis_2_units, axis_2_range]
         axis_3 = [axis_3_label, axis_3_units, axis_3_range]
 
-        return cls(name, axis_1, axis_2, axis_3, data, meta_data)
+        sliced_data = cls(name, axis_1, axis_2, axis_3, data, meta_data,
+                          lazy=lazy, dtype=dtype)
+        if lazy:
+            sliced_data._file = file
+            weakref.finalize(sliced_data, file.close)
+
+        return sliced_data
 
     @classmethod
-    def init_from_orbitals(cls, name, orbitals, parameters, s_share=0.694):
+    def init_from_orbitals(cls, name, orbitals, parameters, s_share=0.694,
+                           processes=1):
         """Returns a SlicedData object with the data[BE,kx,ky] 
            computed from the kmaps of several orbitals and
            broadened in energy.
@@ -134,6 +219,8 @@ class SlicedData(AbstractData):
                 symmetrization (str): either 'no', '2-fold', '2-fold+mirror',
                         '3-fold', '3-fold+mirror','4-fold', '4-fold+mirror'
             s_share (float): Share of s polarized light in unpolarized light.
+            processes (int): Number of processes the k-maps of the
+                orbitals are computed in. None for one per CPU.
         Returns:
             (SlicedData): SlicedData containing kmaps of all orbitals
         """
@@ -176,50 +263,59 @@ class SlicedData(AbstractData):
         axis_2 = ['kx', '1/Å', [-k_max, +k_max]]
         axis_3 = ['ky', '1/Å', [-k_max, +k_max]]
 
-        # initialize 3D-numpy array with zeros
-        data = np.zeros((nBE, nk, nk))
-        orbital_names = []
-
-        # add kmaps of orbitals to
-        log.info('Adding orbitals to SlicedData Object, please wait!')
-        for orbital in orbitals:
-            # binding energy of orbital
-            BE0 = orbital[1]['energy'] - fermi_energy
-            # kinetic energy of emitted electron
-            E_kin = photon_energy - Phi + BE0
+        # download all cube files at once
+        urls = [orbital[0] for orbital in orbitals]
+        for url in urls:
+            log.info('Loading from database: %s' % url)
 
-            # Gaussian weight function
-            norm = (1 / np.sqrt(2 * np.pi * energy_broadening**2))
-            weight = norm * \
-                     np.exp(-((BE - BE0)**2 / (2 * energy_broadening**2)))
+        with ThreadPoolExecutor(max(min(len(urls), 8), 1)) as executor:
+            sources = list(executor.map(_download, urls))
+
+        # kinetic energies of emitted electrons
+        BE0 = np.array(energies) - fermi_energy
+        E_kin = photon_energy - Phi + BE0
+        kmap_args = (dk, phi, theta, psi, Ak_type, polarization, alpha, beta,
+                     gamma, symmetrization, s_share)
+        orbital_names = [orbital[1]['name'] for orbital in orbitals]
+
+        processes = os.cpu_count() if processes is None else processes
+        processes = min(processes, len(orbitals))
+        if processes > 1:
+            # Each process computes the 3D-FTs of its orbitals with one
+            # thread. 'spawn' is safe to use from the (threaded) GUI
+            log.info('Computing k-maps of %i orbitals in %i processes' %
+                     (len(orbitals), processes))
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(processes, mp_context=context) as \
+                    executor:
+                kmaps = list(executor.map(
+                    _orbital_kmap, sources, E_kin, [k_grid] * len(sources),
+                    [kmap_args] * len(sources), [1] * len(sources)))
 
-            url = orbital[0]
-            log.info('Loading from database: %s' % url)
-            with urllib.request.urlopen(url) as f:
-                file = f.read().decode('utf-8')
-                orbital_data = Orbital(file)
-
-            orbital_names.append(orbital[1]['name'])
-            log.info('Computing k-map for %s' % orbital[1]['name'])
-
-            kmap = orbital_data.get_kmap(E_kin, dk, phi, theta, psi,
-                                         Ak_type, polarization, alpha, beta,
-                                         gamma, symmetrization,
-                                         s_share=s_share)
-            kmap.interpolate(k_grid, k_grid, update=True)
-            log.info('Adding to 3D-array: %s' % orbital[1]['name'])
-            for i in range(len(BE)):
-                data[i, :, :] += weight[i] * np.nan_to_num(kmap.data)
-
-        # set NaNs outside photoemission horizon
+        else:
+            # load all orbitals first, so the 3D-FTs of orbitals from
+            # the same calculation (identical grids) are computed in
+            # batches
+            orbital_objects = [Orbital(source) for source in sources]
+            log.info('Computing 3D Fourier transforms of %i orbitals' %
+                     len(orbital_objects))
+            Orbital.compute_3DFTs(orbital_objects)
+
+            kmaps = []
+            for orbital_data, energy, orbital_name in zip(
+                    orbital_objects, E_kin, orbital_names):
+                log.info('Computing k-map for %s' % orbital_name)
+                kmaps.append(_interpolated_kmap(orbital_data, energy, k_grid,
+                                                kmap_args))
+
+        # kmaps of orbitals weighted with a Gaussian in energy (one
+        # matrix product for all energies and orbitals) and NaNs outside
+        # the photoemission horizon
+        log.info('Adding orbitals to SlicedData Object, please wait!')
         KX, KY = np.meshgrid(k_grid, k_grid)
-        for i in range(len(BE)):
-            E_kin = photon_energy - Phi + BE[i]
-            k_max = energy_to_k(E_kin)
-            out = np.sqrt(KX**2 + KY**2) > k_max
-            tmp = data[i, :, :]
-            tmp[out] = np.NaN
-            data[i, :, :] = tmp
+        k_horizon = energy_to_k(photon_energy - Phi + BE)
+        cube = BroadenedCube(np.array(kmaps), BE, BE0, energy_broadening,
+                             np.sqrt(KX**2 + KY**2), k_horizon)
 
         # define meta-data for tool-tip display
         orbital_info = {}
@@ -236,7 +332,14 @@ class SlicedData(AbstractData):
                      'Symmetrization': symmetrization,
                      'Orbital Info': orbital_info}
 
-        return cls(name, axis_1, axis_2, axis_3, data, meta_data)
+        return cls._init_from_broadened_cube(name, axis_1, axis_2, axis_3,
+                                             cube, meta_data)
+
+    @classmethod
+    def _init_from_broadened_cube(cls, name, axis_1, axis_2, axis_3, cube,
+                                  meta_data):
+        # The full array is computed at once
+        return cls(name, axis_1, axis_2, axis_3, cube[()], meta_data)
 
     @classmethod
     def init_from_orbital_cube(cls, name, orbital, parameters):
@@ -275,10 +378,10 @@ class SlicedData(AbstractData):
         # decision if reading cube-file from URL or local file
         if orbital_file[:4] == 'http':
             with urllib.request.urlopen(orbital_file) as f:
-                file = f.read().decode('utf-8')
+                file = read_cube(f)
 
         else:
-            file = open(orbital_file).read()
+            file = read_cube(orbital_file)
 
         orbital_data = Orbital(
             file, dk3D=dk3D, E_kin_max=E_kin_max, value=value)
@@ -303,7 +406,7 @@ class SlicedData(AbstractData):
                                     [0], orbital_data.psik['ky'][-1]]]
             axis_3 = ['kz', '1/Å', [orbital_data.psik['kz']
                                     [0], orbital_data.psik['kz'][-1]]]
-            data = orbital_data.psik['data']
+            data = orbital_data.get_psik_data()
 
         # no meta data
         meta_data = {}
@@ -312,7 +415,8 @@ class SlicedData(AbstractData):
 
     @classmethod
     def init_from_orbital_photonenergy(cls, name, orbital, parameters,
-                                       s_share=0.694):
+                                       s_share=0.694, file_path=None,
+                                       batch_size=16, progress=None):
         """Returns a SlicedData object with the data[photonenergy,kx,ky] 
            computed from the kmaps of one orbital for a series of
            photon energies.
@@ -340,7 +444,15 @@ class SlicedData(AbstractData):
                         Angstroem^-1. str = 'auto' sets gamma automatically
                 symmetrization (str): either 'no', '2-fold', '2-fold+mirror',
                         '3-fold', '3-fold+mirror','4-fold', '4-fold+mirror'
-                s_share (float): Share of s polarized light in unpolarized light.
+            s_share (float): Share of s polarized light in unpolarized light.
+            file_path (str): If passed, the kmaps are written to this
+                .hdf5 file as they are computed and the SlicedData is
+                read lazily from it (call 'close' on it once it is not
+                needed anymore). Otherwise they are written into
+                one preallocated array.
+            batch_size (int): Number of kmaps computed at once.
+            progress (callable): Called with the number of kmaps done
+                and the total number after each batch.
         Returns:
             (SlicedData): SlicedData containing kmaps for various photon energies
         """
@@ -366,7 +478,6 @@ class SlicedData(AbstractData):
 
         # determine axis_1 = photon energy
         hnu = np.arange(hnu_min, hnu_max, hnu_step)
-        n_hnu = len(hnu)
 
         axis_1 = ['photonenergy', 'eV', [hnu_min, hnu_max]]
 
@@ -375,32 +486,25 @@ class SlicedData(AbstractData):
         k_max = energy_to_k(E_kin_max)
         nk = int((2 * k_max) / dk) + 1
         k_grid = np.linspace(-k_max, +k_max, nk)
-        nk = len(k_grid)
         axis_2 = ['kx', '1/Å', [-k_max, +k_max]]
         axis_3 = ['ky', '1/Å', [-k_max, +k_max]]
 
-        # initialize 3D-numpy array with zeros
-        data = np.zeros((n_hnu, nk, nk))
-        orbital_names = []
-
         log.info('Adding orbital to SlicedData Object, please wait!')
         # read orbital from cube-file database
         url = orbital[0]
         log.info('Loading from database: %s' % url)
         with urllib.request.urlopen(url) as f:
-            file = f.read().decode('utf-8')
-            orbital_data = Orbital(file)
-
-        # loop over photon energies
-        for i in range(len(hnu)):
-            # kinetic energy of emitted electron
-            E_kin = hnu[i] - Phi + BE
-            kmap = orbital_data.get_kmap(E_kin, dk, phi, theta, psi,
-                                         Ak_type, polarization, alpha, beta,
-                                         gamma, symmetrization,
-                                         s_share=s_share)
-            kmap.interpolate(k_grid, k_grid, update=True)
-            data[i, :, :] = kmap.data
+            orbital_data = Orbital(f)
+
+        # kinetic energies of emitted electrons, all kmaps are sliced
+        # directly on the common grid in batches and written into the
+        # cube as they are computed
+        E_kin = hnu - Phi + BE
+        kmaps = orbital_data.iter_kmaps(
+            E_kin, (k_grid, k_grid), batch_size, phi=phi, theta=theta,
+            psi=psi, Ak_type=Ak_type, polarization=polarization,
+            alpha=alpha, beta=beta, gamma=gamma,
+            symmetrization=symmetrization, s_share=s_share)
 
         # define meta-data for tool-tip display
         orbital_info = orbital[1]
@@ -413,30 +517,205 @@ class SlicedData(AbstractData):
                      'Symmetrization': symmetrization,
                      'Orbital Info': orbital_info}
 
+        if file_path is None:
+            data = np.empty((len(hnu), nk, nk))
+            writer = None
+
+        else:
+            writer = HDF5Writer(file_path, len(hnu), name,
+                                [axis_1, axis_2, axis_3],
+                                {key: str(value) for key, value in
+                                 meta_data.items()}, slice_shape=(nk, nk))
+
+        try:
+            for start, batch in kmaps:
+                if writer is None:
+                    data[start:start + len(batch)] = batch
+
+                else:
+                    writer.write(batch, start)
+
+                done = start + len(batch)
+                log.info('Computed %i of %i k-maps' % (done, len(hnu)))
+                if progress is not None:
+                    progress(done, len(hnu))
+
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if file_path is not None:
+            return cls.init_from_hdf5(file_path, meta_data={}, lazy=True)
+
         return cls(name, axis_1, axis_2, axis_3, data, meta_data)
 
     def transpose(self, axes_order):
-        self.data = self.data.transpose(axes_order)
+        self._axes_order = [self._axes_order[i] for i in axes_order]
+        if not self.lazy:
+            self.data = self.data.transpose(axes_order)
+
         self.axes = [self.axes[i] for i in axes_order]
 
     def slice_from_index(self, index, axis=0):
         if axis == 0:
-            data = self.data[index, :, :]
             range_ = [self.axes[2].range, self.axes[1].range]
 
         elif axis == 1:
-            data = self.data[:, index, :]
             range_ = [self.axes[2].range, self.axes[0].range]
 
         elif axis == 2:
-            data = self.data[:, :, index]
             range_ = [self.axes[1].range, self.axes[0].range]
 
         else:
             raise ValueError('axis has to be between 1 and 3')
 
+        data = self.get_slice(index, axis)
+
         return PlotData(data, range_)
 
+    def close(self):
+        """Closes the hdf5 file kept open in lazy mode. The data can't be
+        accessed anymore afterwards."""
+
+        # Copies of the data are not needed anymore either
+        with self._axis_cache_lock:
+            self.axis_cache_size = None
+            self._axis_cache.clear()
+            self._closed = True
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_slice(self, index, axis=0):
+        """Returns the data of a slice in the data type it is stored in.
+
+        Args:
+            index (int): Index of the slice along the axis.
+            axis (int): Axis (0, 1 or 2) the slice is taken along.
+
+        Returns:
+            (np.array): 2D data of the slice (same orientation as in
+                'slice_from_index').
+        """
+
+        # Lazy data is never transposed, only the hyperslab of the slice
+        # is read from it
+        data_axis = self._axes_order[axis]
+        copy = self._get_axis_copy(data_axis)
+        if copy is not None:
+            # The remaining axes of the copy are in the same order
+            data = copy[index]
+
+        else:
+            slice_ = [slice(None)] * 3
+            slice_[data_axis] = index
+            data = self._base[tuple(slice_)]
+
+        # Remaining axes of the data in the order they are displayed in
+        remaining = [i for i in self._axes_order if i != data_axis]
+
+        return data.T if remaining[0] > remaining[1] else data
+
+    def build_axis_copy(self, axis, block=False):
+        """Builds a copy of the data contiguous along an axis in the
+        background (if it fits into 'axis_cache_size'). Afterwards slices
+        along this axis are taken from the copy.
+
+        Args:
+            axis (int): Axis (0, 1 or 2) slices are taken along.
+            block (bool): If True, waits until the copy is built.
+
+        Returns:
+            (bool): True if a copy exists or is being built.
+        """
+
+        return self._request_axis_copy(self._axes_order[axis], block)
+
+    def _get_axis_copy(self, data_axis):
+        # Returns the copy for an axis of the data if it is built already
+        # and starts building it otherwise
+        with self._axis_cache_lock:
+            copy = self._axis_cache.get(data_axis)
+
+        if copy is None:
+            self._request_axis_copy(data_axis)
+
+        return copy
+
+    def _request_axis_copy(self, data_axis, block=False):
+        if self.axis_cache_size is None or not self._needs_copy(data_axis):
+            return False
+
+        size = np.prod(self._base.shape) * self._base.dtype.itemsize
+        with self._axis_cache_lock:
+            if data_axis in self._axis_cache or data_axis in self._building:
+                thread = None
+
+            elif size > self.axis_cache_size * 1024**2:
+                return False
+
+            else:
+                # Copies of other axes are dropped if there is no room
+                # for both
+                cached = sum(copy.nbytes for copy in self._axis_cache.values())
+                if cached + size > self.axis_cache_size * 1024**2:
+                    self._axis_cache.clear()
+
+                self._building.add(data_axis)
+                thread = threading.Thread(target=self._build_axis_copy,
+                                          args=(data_axis,), daemon=True)
+                thread.start()
+
+        if block and thread is not None:
+            thread.join()
+
+        return True
+
+    def _needs_copy(self, data_axis):
+        # Slices along the first axis of C-contiguous arrays, memmaps and
+        # datasets (in files written by kMap chunked along it) are
+        # contiguous already
+        if data_axis != 0:
+            return True
+
+        return (isinstance(self._base, np.ndarray) and
+                not self._base.flags.c_contiguous)
+
+    def _build_axis_copy(self, data_axis):
+        # Filled slab by slab along the first axis, thus the data is read
+        # (e.g. from a hdf5 file) only once and no second full copy is
+        # needed
+        try:
+            shape = self._base.shape
+            copy = np.empty((shape[data_axis],) +
+                            tuple(n for i, n in enumerate(shape)
+                                  if i != data_axis),
+                            dtype=self._base.dtype)
+            if data_axis == 0:
+                copy[...] = self._base
+
+            else:
+                for i in range(shape[0]):
+                    copy[:, i, :] = np.moveaxis(np.asarray(self._base[i]),
+                                                data_axis - 1, 0)
+
+            with self._axis_cache_lock:
+                # Not needed anymore if closed in the meantime
+                if not self._closed:
+                    self._axis_cache[data_axis] = copy
+
+        except Exception:
+            # Reading fails if the file was closed in the meantime
+            if not self._closed:
+                log = logging.getLogger('kmap')
+                log.exception('Building copy along axis %i failed' %
+                              data_axis)
+
+        finally:
+            with self._axis_cache_lock:
+                self._building.discard(data_axis)
+
     def __str__(self):
         rep = AbstractData.__str__(self)
 
@@ -445,3 +724,45 @@ class SlicedData(AbstractData):
 
         rep += '\n\n'
         return rep[:-2]
+
+
+def _storage_dtype(native, dtype):
+    # Data type data of type 'native' is stored in for a dtype policy
+    if dtype == 'float64':
+        return np.float64
+
+    elif dtype == 'float32':
+        return np.float32
+
+    elif dtype == 'native':
+        # Anything not a real number (e.g. objects) is stored as float64
+        real = (np.issubdtype(native, np.integer) or
+                np.issubdtype(native, np.floating))
+
+        return native if real else np.float64
+
+    else:
+        raise ValueError('dtype has to be float64, float32 or native')
+
+
+def _download(url):
+    # Returns the content of a file from an URL
+    with urllib.request.urlopen(url) as file:
+        return file.read()
+
+
+def _interpolated_kmap(orbital, E_kin, k_grid, kmap_args):
+    # Returns the kmap of an orbital on the k_grid with NaNs set to zero
+    dk, *args, s_share = kmap_args
+    kmap = orbital.get_kmap(E_kin, dk, *args, s_share=s_share)
+    kmap.interpolate(k_grid, k_grid, update=True)
+
+    return np.nan_to_num(kmap.data)
+
+
+def _orbital_kmap(source, E_kin, k_grid, kmap_args, fft_workers):
+    # Computes the kmap of an orbital from the content of a cube file (in
+    # a separate process)
+    orbital = Orbital(source, fft_workers=fft_workers)
+
+    return _interpolated_kmap(orbital, E_kin, k_grid, kmap_args)
@@ -0,0 +1,178 @@
+"""Provides the symmetrization engine for kmaps.
+
+This file defines the Symmetrizer class designed to symmetrize kmaps by
+n-fold rotations and mirror operations. The rotations are the same as
+'scipy.ndimage.rotate(..., reshape=False)' with cubic splines, but their
+sampling positions and weights only depend on the shape of the kmap and
+are computed once. Rotations mapping grid points onto grid points (e.g.
+by 180 degree) are exact index remappings, all others are applied to
+the spline coefficients of the kmap as one sparse matrix product.
+"""
+
+# Third Party Imports
+import numpy as np
+from scipy import sparse, special
+from scipy.ndimage import spline_filter
+
+# Own Imports
+from kmap.library.cache import LRUCache
+
+# Angles (in degree) of the rotations of each symmetrization
+ROTATIONS = {'no': (), '2-fold': (180,), '3-fold': (120, 240),
+             '4-fold': (90, 180, 270)}
+
+# Process-wide cache of symmetrizers shared by all orbitals
+symmetrizer_cache = LRUCache(max_size=None, max_entries=32)
+
+
+class Symmetrizer():
+    """Symmetrizes kmaps of one shape.
+
+    Args:
+        shape (tuple): Shape (ny, nx) of the kmaps.
+        symmetrization (str): either 'no', '2-fold', '2-fold+mirror',
+            '3-fold', '3-fold+mirror','4-fold', '4-fold+mirror'
+    """
+
+    def __init__(self, shape, symmetrization):
+
+        fold, _, mirror = symmetrization.partition('+')
+        if fold not in ROTATIONS or mirror not in ('', 'mirror'):
+            raise ValueError('Unknown symmetrization %s' % symmetrization)
+
+        self.shape = tuple(shape)
+        self.symmetrization = symmetrization
+        self.mirror = mirror == 'mirror'
+        self.count = len(ROTATIONS[fold]) + 1
+
+        exact, spline = [], []
+        for angle in ROTATIONS[fold]:
+            y, x = self._source_positions(angle)
+            inside = (y >= 0) & (y <= shape[0] - 1) & \
+                (x >= 0) & (x <= shape[1] - 1)
+            if (np.all(y[inside] == np.round(y[inside])) and
+                    np.all(x[inside] == np.round(x[inside]))):
+                exact.append(self._index_matrix(y, x, inside))
+
+            else:
+                spline.append(self._spline_matrix(y, x, inside))
+
+        # All rotations of one kind are summed up in a single matrix
+        self.exact = sum(exact) if exact else None
+        self.spline = sum(spline) if spline else None
+
+    def __call__(self, data):
+        """Symmetrizes a kmap in place.
+
+        Args:
+            data (np.array): 2D array of the kmap. NaN values (outside
+                the photoemission horizon) are treated as zero for the
+                rotated copies.
+
+        Returns:
+            (np.array): The symmetrized kmap.
+        """
+
+        if self.count > 1:
+            values = np.nan_to_num(data).reshape(-1)
+            rotated = np.zeros(values.shape)
+            if self.exact is not None:
+                rotated += self.exact @ values
+
+            if self.spline is not None:
+                coefficients = spline_filter(values.reshape(self.shape), 3,
+                                             output=np.float64,
+                                             mode='constant')
+                coefficients = np.pad(coefficients, 2, mode='reflect')
+                rotated += self.spline @ coefficients.reshape(-1)
+
+            data += rotated.reshape(self.shape)
+
+        if self.mirror:
+            data += np.flip(data, 0)  # mirror map with respect to first axis
+            if self.count == 4:
+                data += np.flip(data, 1)  # mirror with respect to second axis
+
+        data /= self.count * (2 if self.mirror else 1)
+
+        return data
+
+    def _source_positions(self, angle):
+        # Positions in the kmap each pixel of the rotated kmap is
+        # sampled at (same as in 'scipy.ndimage.rotate')
+        c, s = special.cosdg(angle), special.sindg(angle)
+        matrix = np.array([[c, s], [-s, c]])
+        center = (np.array(self.shape) - 1) / 2
+        offset = center - matrix @ center
+
+        rows, columns = np.meshgrid(np.arange(self.shape[0]),
+                                    np.arange(self.shape[1]), indexing='ij')
+        y = matrix[0, 0] * rows + matrix[0, 1] * columns + offset[0]
+        x = matrix[1, 0] * rows + matrix[1, 1] * columns + offset[1]
+
+        return y.reshape(-1), x.reshape(-1)
+
+    def _index_matrix(self, y, x, inside):
+        # Matrix copying pixel (y, x) for all pixels inside the kmap
+        rows = np.flatnonzero(inside)
+        columns = (np.round(y[inside]).astype(np.intp) * self.shape[1] +
+                   np.round(x[inside]).astype(np.intp))
+        size = self.shape[0] * self.shape[1]
+
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                                 shape=(size, size))
+
+    def _spline_matrix(self, y, x, inside):
+        # Matrix evaluating the cubic spline at (y, x) from the spline
+        # coefficients padded by two (mirrored) values on each side
+        rows = np.flatnonzero(inside)
+        y, x = y[inside], x[inside]
+        floor_y, floor_x = np.floor(y), np.floor(x)
+        weights_y = _cubic_weights(y - floor_y)
+        weights_x = _cubic_weights(x - floor_x)
+        # Index of the first of the four coefficients in the padded array
+        start_y = floor_y.astype(np.intp) + 1
+        start_x = floor_x.astype(np.intp) + 1
+        ny, nx = self.shape[0] + 4, self.shape[1] + 4
+
+        weights, columns = [], []
+        for i in range(4):
+            for j in range(4):
+                weights.append(weights_y[i] * weights_x[j])
+                columns.append((start_y + i) * nx + start_x + j)
+
+        size = self.shape[0] * self.shape[1]
+
+        return sparse.csr_matrix(
+            (np.concatenate(weights),
+             (np.tile(rows, 16), np.concatenate(columns))),
+            shape=(size, ny * nx))
+
+
+def _cubic_weights(t):
+    # Weights of the four cubic B-splines around a point at fractional
+    # position t between the second and third of them
+
+    return ((1 - t)**3 / 6, (3 * t**3 - 6 * t**2 + 4) / 6,
+            (-3 * t**3 + 3 * t**2 + 3 * t + 1) / 6, t**3 / 6)
+
+
+def get_symmetrizer(shape, symmetrization):
+    """Returns the (shared) Symmetrizer for kmaps of a given shape.
+
+    Args:
+        shape (tuple): Shape (ny, nx) of the kmaps.
+        symmetrization (str): either 'no', '2-fold', '2-fold+mirror',
+            '3-fold', '3-fold+mirror','4-fold', '4-fold+mirror'
+
+    Returns:
+        (Symmetrizer): Symmetrizer for the shape and symmetrization.
+    """
+
+    key = (tuple(shape), symmetrization)
+    symmetrizer = symmetrizer_cache.get(key)
+    if symmetrizer is None:
+        symmetrizer = Symmetrizer(shape, symmetrization)
+        symmetrizer_cache.put(key, symmetrizer)
+
+    return symmetrizer
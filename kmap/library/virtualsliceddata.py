@@ -0,0 +1,43 @@
+"""Defines the VirtualSlicedData class.
+
+This file defines a class named VirtualSlicedData designed to hold the
+data[BE,kx,ky] of several orbitals broadened in energy without ever
+computing the full 3D array. Only the kmaps of the orbitals are stored,
+every slice (along any axis) is computed when it is requested. Thus fine
+energy grids cost almost no memory and the energy broadening can be
+changed without computing the kmaps again. The full array is only
+computed slice by slice on export.
+"""
+
+# Own Imports
+from kmap.library.sliceddata import SlicedData
+
+
+class VirtualSlicedData(SlicedData):
+    """SlicedData whose data is a BroadenedCube computed on demand.
+
+    Use 'init_from_orbitals' (same arguments as for SlicedData) to
+    create one.
+    """
+
+    @classmethod
+    def _init_from_broadened_cube(cls, name, axis_1, axis_2, axis_3, cube,
+                                  meta_data):
+        # Slices are read from the cube like from lazy data
+        return cls(name, axis_1, axis_2, axis_3, cube, meta_data, lazy=True)
+
+    def set_energy_broadening(self, energy_broadening):
+        """Changes the width of the Gaussian energy broadening. The
+        energy axis stays the same.
+
+        Args:
+            energy_broadening (float): Width of the Gaussian in eV.
+        """
+
+        self._base.set_broadening(energy_broadening)
+        self.meta_data['Energy broadening (eV)'] = energy_broadening
+
+    def _needs_copy(self, data_axis):
+        # Slices along every axis are computed directly from the
+        # (contiguous) kmaps, a copy would be the full array
+        return False
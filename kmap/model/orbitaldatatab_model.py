@@ -1,3 +1,5 @@
+from concurrent.futures import wait
+
 import numpy as np
 
 from kmap.library.id import ID
@@ -12,10 +14,13 @@ class OrbitalDataTabModel():
 
         self.displayed_plot_data = None
         self.orbitals = []
+        # Futures of the 3D-FTs computed in the background by ID
+        self.prefetches = {}
 
     def load_data_from_path(self, path):
         id_ = ID.new_ID()
         new_orbital = OrbitalData.init_from_file(path, ID=id_)
+        self._prefetch(new_orbital)
         self.orbitals.append([new_orbital, 'path', path, None, id_])
 
         return new_orbital
@@ -24,6 +29,7 @@ class OrbitalDataTabModel():
         id_ = ID.new_ID()
         new_orbital = OrbitalData.init_from_online(
             url, ID=id_, meta_data=meta_data)
+        self._prefetch(new_orbital)
 
         self.orbitals.append([new_orbital, 'url', url, meta_data, id_])
 
@@ -35,6 +41,10 @@ class OrbitalDataTabModel():
         self.remove_data_by_index(index)
 
     def remove_data_by_index(self, index):
+        future = self.prefetches.pop(self.orbitals[index][0].ID, None)
+        if future is not None:
+            future.cancel()
+
         del self.orbitals[index]
 
     def get_orbital_kmap_by_ID(self, ID):
@@ -57,7 +67,9 @@ class OrbitalDataTabModel():
         for orbital in self.orbitals:
             ID = orbital[0].ID
 
-            if self.controller.get_use(ID):
+            # Orbitals whose 3D-FT is still computed in the background
+            # are added once it is finished instead of waiting for it
+            if self.controller.get_use(ID) and self.is_ready(ID):
                 # Get all parameters for this orbital
                 kmap = self.get_orbital_kmap_by_ID(ID)
                 kmaps.append(kmap)
@@ -77,9 +89,48 @@ class OrbitalDataTabModel():
         if orbital is not None:
             self.remove_data_by_object(orbital)
 
+    def is_ready(self, ID):
+        future = self.prefetches.get(ID)
+
+        return future is None or future.done()
+
+    def get_prefetch(self, ID):
+        # Future of the 3D-FT computed in the background or None if it
+        # is finished (or was never started)
+        future = self.prefetches.get(ID)
+        if future is not None and future.done():
+            del self.prefetches[ID]
+            return None
+
+        return future
+
+    def wait_for_prefetches(self):
+        # Waits for all 3D-FTs computed in the background. Returns True
+        # if any of them was not finished yet
+        pending = [future for future in self.prefetches.values()
+                   if not future.done()]
+        wait(pending)
+        self.prefetches = {}
+
+        return bool(pending)
+
+    def cancel_prefetches(self):
+        # Not yet started 3D-FTs are not needed anymore
+        for future in self.prefetches.values():
+            future.cancel()
+
+        self.prefetches = {}
+
     def ID_to_orbital(self, ID):
         for orbital in self.orbitals:
             if orbital[0].ID == ID:
                 return orbital[0]
 
         return None
+
+    def _prefetch(self, orbital):
+        # Start computing the 3D-FT while other orbitals are loaded
+        # (not needed for kmaps evaluated directly)
+        if (config.get_key('orbital', 'background_fft') == 'True' and
+                orbital.engine == 'fft'):
+            self.prefetches[orbital.ID] = orbital.prefetch(background=True)
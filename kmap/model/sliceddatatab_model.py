@@ -1,5 +1,6 @@
 from kmap.library.id import ID
 from kmap.library.sliceddata import SlicedData
+from kmap.library.virtualsliceddata import VirtualSlicedData
 from kmap.library.misc import transpose_axis_order
 from kmap.config.config import config
 
@@ -19,9 +20,15 @@ class SlicedDataTabModel():
         *orbitals, options = URLs
         name, *parameters = options
         s_share = float(config.get_key('orbital', 's_share'))
-
-        self.data = SlicedData.init_from_orbitals(name, orbitals,
-                                                  parameters, s_share=s_share)
+        processes = config.get_key('sliced_data', 'processes')
+        processes = None if processes == 'None' else int(processes)
+        virtual = config.get_key('sliced_data', 'virtual') == 'True'
+        data_class = VirtualSlicedData if virtual else SlicedData
+
+        self.data = data_class.init_from_orbitals(name, orbitals,
+                                                  parameters, s_share=s_share,
+                                                  processes=processes)
+        self._set_axis_cache_size()
         self.load_data = ['load_from_URLs', URLs]
 
         self.change_slice(0, 0)
@@ -38,6 +45,7 @@ class SlicedDataTabModel():
 
         self.data = SlicedData.init_from_orbital_photonenergy(
             name, orbital, parameters, s_share=s_share)
+        self._set_axis_cache_size()
         self.load_data = ['load_from_URL', URL]
 
         self.change_slice(0, 0)
@@ -53,12 +61,16 @@ class SlicedDataTabModel():
         name, *parameters = options
         self.data = SlicedData.init_from_orbital_cube(
             name, orbital, parameters)
+        self._set_axis_cache_size()
         self.load_data = ['load_from_cube', URL]
 
         self.change_slice(0, 0)
 
     def load_data_from_path(self, path):
-        self.data = SlicedData.init_from_hdf5(path)
+        lazy = config.get_key('sliced_data', 'lazy') == 'True'
+        dtype = config.get_key('sliced_data', 'dtype')
+        self.data = SlicedData.init_from_hdf5(path, lazy=lazy, dtype=dtype)
+        self._set_axis_cache_size()
         self.load_data = ['load_from_path', path]
 
         self.change_slice(0, 0)
@@ -80,6 +92,15 @@ class SlicedDataTabModel():
 
         return self.displayed_plot_data
 
+    def _set_axis_cache_size(self):
+        size = config.get_key('sliced_data', 'axis_cache_size')
+        self.data.axis_cache_size = None if size == 'None' else float(size)
+
+    def close(self):
+        # Releases the hdf5 file of lazily loaded data
+        if self.data is not None:
+            self.data.close()
+
     def to_string(self):
         rep = '%s' % str(self.data)
 
@@ -0,0 +1,136 @@
+import io
+import os
+import time
+import pickle
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+from kmap.library.cache import (DiskCache, LRUCache, HashingReader, hash_bytes,
+                                share_array, memmap_reference,
+                                open_memmap_reference)
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.directory.name, max_size=None)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_store_load(self):
+        data = np.arange(24, dtype=np.float64).reshape(2, 3, 4)
+        self.cache.store('entry', {'data': data}, {'name': 'test'})
+
+        arrays, meta = self.cache.load('entry')
+
+        npt.assert_equal(arrays['data'], data)
+        self.assertFalse(arrays['data'].flags.writeable)
+        self.assertEqual(meta, {'name': 'test'})
+        self.assertIsNone(self.cache.load('missing'))
+
+    def test_lru_eviction(self):
+        data = np.zeros(2**16)  # 0.5 MB
+        self.cache.max_size = 1.2
+
+        for key in ['a', 'b']:
+            self.cache.store(key, {'data': data})
+            time.sleep(0.01)
+
+        # Use 'a' so 'b' becomes the least recently used entry
+        stamp = time.time() + 10
+        os.utime(os.path.join(self.directory.name, 'a', 'meta.json'),
+                 (stamp, stamp))
+        self.cache.store('c', {'data': data})
+
+        self.assertIsNotNone(self.cache.load('a'))
+        self.assertIsNone(self.cache.load('b'))
+        self.assertIsNotNone(self.cache.load('c'))
+
+    def test_memmap_reference(self):
+        data = np.arange(24, dtype=np.float64).reshape(2, 3, 4)
+        self.cache.store('entry', {'data': data})
+        arrays, _ = self.cache.load('entry')
+
+        reference = memmap_reference(arrays['data'])
+        npt.assert_equal(open_memmap_reference(reference), data)
+        self.assertIsNone(memmap_reference(arrays['data'][1:]))
+        self.assertIsNone(memmap_reference(data))
+
+        shared = share_array(data, self.directory.name)
+        npt.assert_equal(shared, data)
+        reference = memmap_reference(shared)
+        del shared
+        os.remove(reference['filename'])
+        self.assertIsNone(open_memmap_reference(reference))
+
+    def test_hash_bytes(self):
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(b'kMap')
+
+        self.assertEqual(hash_bytes(file.name), hash_bytes(b'kMap'))
+        self.assertNotEqual(hash_bytes(b'kMap'), hash_bytes(b'kmap'))
+        os.remove(file.name)
+
+        reader = HashingReader(io.StringIO('kMap\nkMap'))
+        self.assertEqual(reader.readline(), 'kMap\n')
+        self.assertEqual(reader.hexdigest(), hash_bytes(b'kMap\nkMap'))
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = LRUCache(max_size=None)
+        data = np.arange(10.)
+        cache.put(('a', 1.0), (data, 'range'))
+
+        value, range_ = cache.get(('a', 1.0))
+
+        npt.assert_equal(value, data)
+        self.assertEqual(range_, 'range')
+        self.assertFalse(value.flags.writeable)
+        self.assertIsNone(cache.get(('a', 2.0)))
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 1,
+                                        'entries': 1, 'size': 80})
+
+    def test_lru_eviction(self):
+        cache = LRUCache(max_size=1.2)
+        for key in ['a', 'b']:
+            cache.put(key, np.zeros(2**16))  # 0.5 MB
+
+        cache.get('a')
+        cache.put('c', np.zeros(2**16))
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+        # Too large entries and a disabled cache store nothing
+        cache.put('d', np.zeros(2**18))
+        self.assertNotIn('d', cache)
+        cache = LRUCache(max_size=0)
+        cache.put('a', np.zeros(1))
+        self.assertEqual(len(cache), 0)
+
+        cache = LRUCache(max_size=None, max_entries=2)
+        for key in ['a', 'b', 'c']:
+            cache.put(key, np.zeros(1))
+
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('a', cache)
+
+    def test_pickle(self):
+        cache = LRUCache(max_size=2, max_entries=3)
+        cache.put('a', np.zeros(1))
+
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(len(copy), 0)
+        self.assertEqual((copy.max_size, copy.max_entries), (2, 3))
+        copy.put('a', np.zeros(1))
+        self.assertIn('a', copy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+from kmap import __directory__
+from kmap.library.cubefile import read_cube, load_cube
+from kmap.library.cache import DiskCache
+
+
+class TestCubeFile(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = __directory__ / 'tests/input/pentacene_HOMO.cube'
+        with open(cls.path) as file:
+            cls.cubefile = file.read()
+
+    def test_read_cube_from_path(self):
+        cube = read_cube(self.path)
+
+        self.assertEqual(cube['comments'], ('Cube file generated by NWChem',
+                                            'pentacene_MO_73'))
+        self.assertEqual(cube['psi']['data'].shape, (65, 111, 41))
+        self.assertEqual(cube['molecule']['num_atom'], 36)
+        self.assertEqual(cube['molecule']['atomic_coordinates'].shape,
+                         (36, 3))
+        npt.assert_almost_equal(cube['psi']['dx'], 0.2030606016, decimal=9)
+
+    def test_read_cube_sources(self):
+        expected = read_cube(self.path)['psi']['data']
+        sources = [self.cubefile, self.cubefile.encode(),
+                   io.StringIO(self.cubefile),
+                   io.BytesIO(self.cubefile.encode())]
+
+        for source in sources:
+            # Small chunks to test numbers split between chunks
+            data = read_cube(source, chunk_size=1001)['psi']['data']
+            npt.assert_equal(data, expected)
+
+    def test_read_cube_utf8(self):
+        lines = self.cubefile.split('\n')
+        lines[1] = 'pentacene – HOMO (Å)'
+        content = '\n'.join(lines)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'utf8.cube')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(content)
+
+            for source in [path, content.encode(),
+                           io.BytesIO(content.encode())]:
+                cube = read_cube(source)
+                self.assertEqual(cube['comments'][1], 'pentacene – HOMO (Å)')
+
+    def test_load_cube_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory)
+            first = load_cube(self.path, cache)
+            second = load_cube(self.cubefile, cache)
+
+            self.assertEqual(first['hash'], second['hash'])
+            self.assertEqual(second['comments'], first['comments'])
+            self.assertEqual(second['molecule']['chemical_numbers'],
+                             first['molecule']['chemical_numbers'])
+            npt.assert_equal(second['psi']['data'], first['psi']['data'])
+            npt.assert_equal(second['psi']['x'], first['psi']['x'])
+            del first, second
+
+    def test_load_cube_shared(self):
+        first = load_cube(self.path)
+        second = load_cube(self.cubefile)
+
+        self.assertEqual(first['hash'], second['hash'])
+        self.assertEqual(first['source'], self.path)
+        self.assertIsNone(second['source'])
+        self.assertIs(second['psi']['data'], first['psi']['data'])
+        self.assertFalse(first['psi']['data'].flags.writeable)
+
+        # Parsed again once no longer in use
+        data = np.array(first['psi']['data'])
+        del first, second
+        third = load_cube(self.path)
+        npt.assert_equal(third['psi']['data'], data)
+
+    def test_load_cube_stream(self):
+        class Stream(io.BytesIO):
+            # Only read in chunks, as a download is
+            def read(self, size=-1):
+                if size is None or size < 0:
+                    raise AssertionError('stream read at once')
+
+                return io.BytesIO.read(self, size)
+
+        expected = load_cube(self.path)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory)
+            for stream in [Stream(self.cubefile.encode()),
+                           io.StringIO(self.cubefile)]:
+                cube = load_cube(stream, cache)
+
+                self.assertEqual(cube['hash'], expected['hash'])
+                self.assertIsNone(cube['source'])
+                self.assertIs(cube['psi']['data'], expected['psi']['data'])
+
+            # Parsed from the stream once no longer in use
+            data = np.array(expected['psi']['data'])
+            del expected, cube
+            cube = load_cube(Stream(self.cubefile.encode()), cache)
+            npt.assert_equal(cube['psi']['data'], data)
+            self.assertIsNotNone(cache.load('cube-' + cube['hash']))
+            del cube
+
+    def test_read_cube_truncated(self):
+        with self.assertRaises(ValueError):
+            read_cube(self.cubefile[:-1000])
+
+
+if __name__ == '__main__':
+    unittest.main()
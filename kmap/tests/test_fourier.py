@@ -0,0 +1,121 @@
+import unittest
+import numpy as np
+import numpy.testing as npt
+from kmap.library.fourier import (fft_size, get_workers, windowed_fft,
+                                  direct_transform, direct_transform_grid)
+
+
+class TestFourier(unittest.TestCase):
+
+    def _reference(self, data, shape):
+        pad = [(nk - n) // 2 for n, nk in zip(data.shape, shape)]
+        padded = np.pad(data, [(p, nk - n - p) for p, n, nk in
+                               zip(pad, data.shape, shape)])
+
+        return np.fft.fftshift(np.fft.fftn(np.fft.ifftshift(padded)))
+
+    def test_windowed_fft(self):
+        rng = np.random.default_rng(0)
+        # Even, odd and mixed sizes
+        for size, shape in [((8, 10, 6), (16, 20, 12)),
+                            ((7, 9, 5), (15, 19, 13)),
+                            ((8, 9, 5), (18, 19, 17))]:
+            data = rng.normal(size=size)
+            windows = [np.arange(nk // 4, nk - nk // 4) for nk in shape]
+
+            window, peak_memory = windowed_fft(data, shape, windows,
+                                               workers=2)
+            expected = self._reference(data, shape)[np.ix_(*windows)]
+
+            npt.assert_allclose(window, expected, atol=1e-12)
+            self.assertGreater(peak_memory, 0)
+
+    def test_windowed_fft_complex(self):
+        rng = np.random.default_rng(1)
+        data = rng.normal(size=(6, 7, 8)) + 1j * rng.normal(size=(6, 7, 8))
+        shape = (12, 13, 16)
+        windows = [np.arange(nk) for nk in shape]
+
+        window, _ = windowed_fft(data, shape, windows)
+
+        npt.assert_allclose(window, self._reference(data, shape),
+                            atol=1e-12)
+
+    def test_windowed_fft_batch(self):
+        rng = np.random.default_rng(5)
+        data = rng.normal(size=(3, 7, 8, 5))
+        shape = (15, 16, 13)
+        windows = [np.arange(nk // 4, nk - nk // 4) for nk in shape]
+
+        window, _ = windowed_fft(data, shape, windows)
+
+        for i in range(len(data)):
+            npt.assert_allclose(window[i],
+                                windowed_fft(data[i], shape, windows)[0],
+                                atol=1e-12)
+
+    def test_direct_transform(self):
+        rng = np.random.default_rng(2)
+        data = rng.normal(size=(6, 7, 5))
+        spacing = (0.3, 0.2, 0.25)
+        points = rng.normal(size=(50, 3))
+
+        r = [(np.arange(n) - n // 2) * d for n, d in zip(data.shape, spacing)]
+        X, Y, Z = np.meshgrid(*r, indexing='ij')
+        expected = [np.sum(data * np.exp(-1j * (k[0] * X + k[1] * Y +
+                                                k[2] * Z)))
+                    for k in points]
+
+        # Tiny memory budget to test the chunking
+        for memory in (1e-4, 256):
+            result = direct_transform(data, spacing, points, memory)
+            npt.assert_allclose(result, expected, atol=1e-12)
+
+            result = direct_transform(data + 1j * data, spacing, points,
+                                      memory)
+            npt.assert_allclose(result, (1 + 1j) * np.array(expected),
+                                atol=1e-12)
+
+    def test_direct_transform_fft(self):
+        # Equal to the FFT at its grid frequencies
+        rng = np.random.default_rng(3)
+        data = rng.normal(size=(7, 8, 5))
+        spacing = (0.3, 0.2, 0.25)
+        shape = (15, 16, 13)
+        fft = self._reference(data, shape)
+
+        k = [2 * np.pi * (np.arange(nk) - nk // 2) / (nk * d)
+             for nk, d in zip(shape, spacing)]
+        index = rng.integers(0, shape, size=(20, 3))
+        points = np.stack([k[i][index[:, i]] for i in range(3)], axis=1)
+
+        npt.assert_allclose(direct_transform(data, spacing, points),
+                            fft[tuple(index.T)], atol=1e-12)
+
+    def test_direct_transform_grid(self):
+        rng = np.random.default_rng(4)
+        data = rng.normal(size=(6, 7, 5))
+        spacing = (0.3, 0.2, 0.25)
+        kx, ky = np.linspace(-2, 2, 9), np.linspace(-1, 1, 8)
+        KX, KY = np.meshgrid(kx, ky)
+        KZ = rng.normal(size=KX.shape)
+        mask = rng.random(KX.shape) > 0.3
+
+        points = np.stack([KX[mask], KY[mask], KZ[mask]], axis=1)
+        expected = np.zeros(KX.shape, dtype=complex)
+        expected[mask] = direct_transform(data, spacing, points)
+
+        for memory in (1e-4, 256):
+            result = direct_transform_grid(data, spacing, kx, ky, KZ, mask,
+                                           memory)
+            npt.assert_allclose(result, expected, atol=1e-12)
+
+    def test_fft_size(self):
+        self.assertEqual(fft_size(97), 97)
+        self.assertEqual(fft_size(97, fast=True), 100)
+        self.assertEqual(get_workers(3), 3)
+        self.assertGreaterEqual(get_workers(-1), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import tempfile
+import h5py
+import numpy as np
+import numpy.testing as npt
+from kmap.library.sliceddata import SlicedData
+from kmap.library.hdf5writer import (HDF5Writer, compression_options,
+                                     write_hdf5)
+
+
+class TestHDF5Writer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'data.hdf5')
+        self.data = np.random.rand(4, 5, 6)
+        self.axes = [['E_kin', 'eV', [20, 30]], ['kx', '1/Å', [-2, 2]],
+                     ['ky', '1/Å', [-3, 3]]]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_slices(self):
+        with HDF5Writer(self.path, 4, 'test', self.axes, {'alias': 'a'},
+                        compression='shuffle+gzip-1') as writer:
+            for index in [3, 0, 2, 1]:
+                writer.write_slice(index, self.data[index])
+
+        with h5py.File(self.path, 'r') as file:
+            self.assertEqual(file['data'].chunks, (1, 5, 6))
+            self.assertEqual(file['data'].compression, 'gzip')
+            self.assertTrue(file['data'].shuffle)
+
+        sliced_data = SlicedData.init_from_hdf5(self.path, meta_data={})
+        npt.assert_equal(sliced_data.data, self.data)
+        self.assertEqual(sliced_data.name, 'test')
+        self.assertEqual(sliced_data.meta_data, {'alias': 'a'})
+        npt.assert_equal(sliced_data.axes[1].range, [-2, 2])
+
+    def test_write_incomplete(self):
+        # The data exists right away if the shape of the slices is known
+        with HDF5Writer(self.path, 4, 'test', self.axes, slice_shape=(5, 6)):
+            pass
+
+        sliced_data = SlicedData.init_from_hdf5(self.path, meta_data={})
+        self.assertEqual(sliced_data.data.shape, (4, 5, 6))
+
+        # Otherwise a file without any slice written is not readable
+        with self.assertRaises(ValueError):
+            with HDF5Writer(self.path, 4, 'test', self.axes):
+                pass
+
+        self.assertRaises(ValueError, HDF5Writer, self.path, 0, 'test',
+                          self.axes, slice_shape=(5, 6))
+
+    def test_write_sliced_data(self):
+        sliced_data = SlicedData('test', *self.axes, self.data,
+                                 meta_data={'Symmetrization': 'no'})
+        sliced_data.transpose([1, 0, 2])
+        write_hdf5(self.path, sliced_data, compression='lzf')
+
+        result = SlicedData.init_from_hdf5(self.path, meta_data={})
+        npt.assert_equal(result.data, self.data.transpose(1, 0, 2))
+        self.assertEqual(result.axes[0].label, 'kx')
+        self.assertEqual(result.meta_data, {'Symmetrization': 'no'})
+
+    def test_write_dtype(self):
+        data = (self.data * 1000).astype(np.uint16)
+        sliced_data = SlicedData('test', *self.axes, data, dtype='native')
+        write_hdf5(self.path, sliced_data)
+
+        result = SlicedData.init_from_hdf5(self.path, meta_data={},
+                                           dtype='native')
+        self.assertEqual(result.data.dtype, np.uint16)
+        npt.assert_equal(result.data, data)
+
+    def test_compression_options(self):
+        self.assertEqual(compression_options('None'), {})
+        self.assertEqual(compression_options('lzf'), {'compression': 'lzf'})
+        self.assertEqual(compression_options('shuffle+gzip-4'),
+                         {'shuffle': True, 'compression': 'gzip',
+                          'compression_opts': 4})
+        self.assertRaises(ValueError, compression_options, 'gzip-10')
+        self.assertRaises(ValueError, compression_options, 'shuffle+None')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import numpy as np
+import numpy.testing as npt
+from scipy.interpolate import RegularGridInterpolator
+from kmap.library.hemisphere import (
+    UniformGridInterpolator, ShellGridInterpolator, hemisphere_grid, sample_hemisphere,
+    polarization_factor, cached_hemisphere_grid, cached_polarization_factor)
+
+
+class TestHemisphere(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.axes = (np.linspace(-2, 2, 11), np.linspace(-1.5, 1.5, 9),
+                    np.linspace(-2, 2.2, 13))
+        cls.data = rng.random((11, 9, 13))
+
+    def test_uniform_grid_interpolator(self):
+        rng = np.random.default_rng(1)
+        # Points partly outside the grid, on its border and NaN
+        points = rng.uniform(-2.5, 2.5, size=(500, 3))
+        points[0] = [-2, -1.5, 2.2]
+        points[1] = [np.nan, 0, 0]
+
+        interpolator = UniformGridInterpolator(self.axes, self.data)
+        reference = RegularGridInterpolator(self.axes, self.data,
+                                            bounds_error=False,
+                                            fill_value=np.nan)
+
+        npt.assert_allclose(interpolator(points), reference(points),
+                            rtol=1e-12)
+
+    def test_uniform_grid_interpolator_float32(self):
+        interpolator = UniformGridInterpolator(
+            self.axes, self.data.astype(np.float32))
+        reference = UniformGridInterpolator(self.axes, self.data)
+        x, y, z = np.meshgrid(*[axis[:-1] + 0.03 for axis in self.axes])
+
+        result = interpolator.sample(x, y, z)
+
+        self.assertEqual(result.dtype, np.float32)
+        npt.assert_allclose(result, reference.sample(x, y, z), rtol=1e-5)
+
+    def test_shell_grid_interpolator(self):
+        rng = np.random.default_rng(2)
+        interpolator = ShellGridInterpolator(self.axes, self.data, 1.6, 1.9,
+                                             block_size=2)
+        reference = UniformGridInterpolator(self.axes, self.data)
+        points = rng.uniform(-2.5, 2.5, (2000, 3))
+        radius = np.linalg.norm(points, axis=1)
+        in_shell = (radius >= 1.6) & (radius <= 1.9)
+
+        result = interpolator(points)
+
+        npt.assert_equal(result[in_shell], reference(points)[in_shell])
+        self.assertTrue(np.isnan(interpolator([0.1, 0, -0.1])))
+        self.assertLess(len(interpolator.blocks), interpolator.lookup.size)
+
+    def test_sample_hemisphere(self):
+        interpolator = UniformGridInterpolator(self.axes, self.data)
+        grid = hemisphere_grid(5, 0.1)
+        kmax = grid['krange'][0][1]
+
+        data = sample_hemisphere(interpolator, grid)
+        rotated = sample_hemisphere(interpolator, grid, np.eye(3))
+
+        outside = grid['KX']**2 + grid['KY']**2 > kmax**2
+        self.assertTrue(np.isnan(data[outside]).all())
+        self.assertFalse(np.isnan(data[~outside]).any())
+        npt.assert_equal(rotated, data)
+
+
+    def test_shared_caches(self):
+        kx = np.linspace(-2, 2, 41)
+        grid = cached_hemisphere_grid(20, (kx, kx))
+        parameters = ('NanoESCA', 'p', 40, 90, 'auto', 0.694)
+        Ak = cached_polarization_factor(grid, 20, (kx, kx), *parameters)
+
+        # Same grid and factor for the same (but not identical) axes
+        self.assertIs(cached_hemisphere_grid(20.0, (kx.copy(), kx)), grid)
+        self.assertIs(cached_polarization_factor(grid, 20, (kx, kx.copy()),
+                                                 *parameters), Ak)
+        self.assertIsNot(cached_hemisphere_grid(21, (kx, kx)), grid)
+
+        self.assertFalse(grid['KZ'].flags.writeable)
+        self.assertFalse(Ak.flags.writeable)
+        expected = hemisphere_grid(20, (kx, kx))
+        npt.assert_equal(grid['KZ'], expected['KZ'])
+        npt.assert_equal(Ak, polarization_factor(
+            expected['KX'], expected['KY'], expected['KZ'], 20,
+            *parameters))
+
+if __name__ == '__main__':
+    unittest.main()
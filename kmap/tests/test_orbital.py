@@ -1,8 +1,12 @@
 import os
+import pickle
 import unittest
 import numpy.testing as npt
+import matplotlib.figure
 import numpy as np
 from kmap.library.orbital import Orbital
+from kmap.library.misc import compute_Euler_matrix
+from kmap.library.fourier import direct_transform
 
 
 
@@ -54,8 +58,8 @@ class TestOrbital(unittest.TestCase):
         arbitrary_element_expected = 4.352036114737106e-05  # data[11, 34, 27]
 
         self.assertEqual(data.shape, shape_expected)
-        npt.assert_almost_equal(np.sum(data), sum_expected, decimal=13)
-        npt.assert_almost_equal(data[11,34,27], arbitrary_element_expected, decimal=13)
+        npt.assert_allclose(np.sum(data), sum_expected, rtol=1e-12)
+        npt.assert_allclose(data[11,34,27], arbitrary_element_expected, rtol=1e-12)
 
     def test_get_kmap_basic(self):
     
@@ -76,7 +80,7 @@ class TestOrbital(unittest.TestCase):
         npt.assert_almost_equal(kmap.x_axis[-1], endpoints_expected[-1],decimal=13)    
         npt.assert_almost_equal(kmap.y_axis[0],  endpoints_expected[0], decimal=13)   
         npt.assert_almost_equal(kmap.y_axis[-1], endpoints_expected[-1],decimal=13)    
-        npt.assert_almost_equal(np.nansum(kmap.data), sum_expected, decimal=13)
+        npt.assert_allclose(np.nansum(kmap.data), sum_expected, rtol=1e-12)
 
     def test_get_kmap_orientation(self):
     
@@ -97,7 +101,7 @@ class TestOrbital(unittest.TestCase):
         npt.assert_almost_equal(kmap.x_axis[-1], endpoints_expected[-1],decimal=13)    
         npt.assert_almost_equal(kmap.y_axis[0],  endpoints_expected[0], decimal=13)   
         npt.assert_almost_equal(kmap.y_axis[-1], endpoints_expected[-1],decimal=13)    
-        npt.assert_almost_equal(np.nansum(kmap.data), sum_expected, decimal=13)
+        npt.assert_allclose(np.nansum(kmap.data), sum_expected, rtol=1e-12)
 
 
     def test_get_kmap_toroid(self):
@@ -119,7 +123,7 @@ class TestOrbital(unittest.TestCase):
         npt.assert_almost_equal(kmap.x_axis[-1], endpoints_expected[-1],decimal=13)    
         npt.assert_almost_equal(kmap.y_axis[0],  endpoints_expected[0], decimal=13)   
         npt.assert_almost_equal(kmap.y_axis[-1], endpoints_expected[-1],decimal=13)    
-        npt.assert_almost_equal(np.nansum(kmap.data), sum_expected, decimal=13)
+        npt.assert_allclose(np.nansum(kmap.data), sum_expected, rtol=1e-12)
 
     def test_get_kmap_NanoESCA(self):
     
@@ -140,7 +144,7 @@ class TestOrbital(unittest.TestCase):
         npt.assert_almost_equal(kmap.x_axis[-1], endpoints_expected[-1],decimal=13)    
         npt.assert_almost_equal(kmap.y_axis[0],  endpoints_expected[0], decimal=13)   
         npt.assert_almost_equal(kmap.y_axis[-1], endpoints_expected[-1],decimal=13)    
-        npt.assert_almost_equal(np.nansum(kmap.data), sum_expected, decimal=13)
+        npt.assert_allclose(np.nansum(kmap.data), sum_expected, rtol=1e-12)
 
     def test_get_kmap_symmetry(self):
     
@@ -161,7 +165,7 @@ class TestOrbital(unittest.TestCase):
         npt.assert_almost_equal(kmap.x_axis[-1], endpoints_expected[-1],decimal=13)    
         npt.assert_almost_equal(kmap.y_axis[0],  endpoints_expected[0], decimal=13)   
         npt.assert_almost_equal(kmap.y_axis[-1], endpoints_expected[-1],decimal=13)    
-        npt.assert_almost_equal(np.nansum(kmap.data), sum_expected, decimal=13)
+        npt.assert_allclose(np.nansum(kmap.data), sum_expected, rtol=1e-12)
 
 
     def test_get_kmap_kgrid(self):
@@ -186,9 +190,221 @@ class TestOrbital(unittest.TestCase):
         npt.assert_almost_equal(kmap.x_axis[-1], endpoints_expected[-1],decimal=13)    
         npt.assert_almost_equal(kmap.y_axis[0],  endpoints_expected[0], decimal=13)   
         npt.assert_almost_equal(kmap.y_axis[-1], endpoints_expected[-1],decimal=13)    
-        npt.assert_almost_equal(np.nansum(kmap.data), sum_expected, decimal=13)
+        npt.assert_allclose(np.nansum(kmap.data), sum_expected, rtol=1e-12)
 
 
+    def test_single_precision(self):
+
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50,
+                          precision='float32')
+
+        self.assertEqual(orbital.psik['data'].dtype, np.float32)
+        self.assertEqual(orbital.psik['data'].shape, (49, 49, 47))
+
+        for kwargs in [{'E_kin': 30, 'dk': 0.1},
+                       {'E_kin': 25, 'dk': 0.2, 'phi': 12, 'theta': -21,
+                        'Ak_type': 'NanoESCA', 'alpha': 47, 'beta': 123}]:
+            expected = self.orbital.get_kmap(**kwargs).data
+            kmap = orbital.get_kmap(**kwargs).data
+            deviation = np.nanmax(np.abs(kmap - expected))
+            self.assertLess(deviation / np.nanmax(expected), 1e-6)
+
+    def test_get_kmaps(self):
+
+        kx = np.linspace(-3, 3, 61)
+        ky = np.linspace(-2.5, 2.5, 51)
+        E_kin = np.array([20, 25, 30])
+        theta = np.array([0, 15, 40])
+
+        for kwargs in [{'Ak_type': 'toroid', 'symmetrization': '2-fold'},
+                       {'Ak_type': 'NanoESCA', 'polarization': 's',
+                        'gamma': 'auto', 'symmetrization': '3-fold'},
+                       {'Ak_type': 'only-NanoESCA', 'polarization': 'C+',
+                        'gamma': 0.2}]:
+            kmaps, krange = self.orbital.get_kmaps(
+                E_kin, (kx, ky), phi=90, theta=theta, psi=90, alpha=40,
+                **kwargs)
+
+            self.assertEqual(kmaps.shape, (3, 51, 61))
+            for kmap, E, t in zip(kmaps, E_kin, theta):
+                expected = self.orbital.get_kmap(
+                    E, (kx, ky), phi=90, theta=t, psi=90, alpha=40,
+                    **kwargs)
+                npt.assert_allclose(kmap, expected.data, rtol=1e-12)
+                npt.assert_allclose(krange, expected.range)
+
+    def test_kmap_cache(self):
+
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+        kx = np.linspace(-2, 2, 50)
+
+        first = orbital.get_kmap(E_kin=25, dk=(kx, kx), theta=10)
+        orbital.get_kmap(E_kin=30, dk=0.1, Ak_type='toroid')
+        second = orbital.get_kmap(E_kin=25, dk=(kx.copy(), kx), theta=10)
+
+        npt.assert_equal(second.data, first.data)
+        npt.assert_equal(second.range, first.range)
+        info = orbital.kmap_cache.info()
+        self.assertEqual((info['hits'], info['misses']), (1, 2))
+
+        orbital.get_kmap(E_kin=25, dk=(kx + 0.01, kx), theta=10)
+        self.assertEqual(orbital.kmap_cache.info()['misses'], 3)
+
+    def test_kmap_cache_state(self):
+
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+        expected = orbital.get_kmap(E_kin=30, dk=0.1, Ak_type='toroid')
+        orbital.get_kmap(E_kin=40, dk=0.1, theta=20)
+
+        # Cache hit restores the state of the first kmap
+        result = orbital.get_kmap(E_kin=30, dk=0.1, Ak_type='toroid')
+        self.assertEqual(orbital.kmap_cache.info()['hits'], 1)
+        self.assertEqual(orbital.kmap['E_kin'], 30)
+        self.assertEqual(orbital.kmap['theta'], 0)
+
+        changed = orbital.change_polarization('toroid', 'p', 60, 90, 0,
+                                              0.694)
+        npt.assert_equal(changed.data, result.data)
+        npt.assert_equal(changed.data, expected.data)
+        npt.assert_equal(changed.range, expected.range)
+
+        axes = matplotlib.figure.Figure().add_subplot()
+        orbital.plot(axes)
+        npt.assert_equal(np.ma.getdata(axes.images[0].get_array()),
+                         expected.data)
+
+    def test_lazy_3DFT(self):
+
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+        self.assertIsNone(orbital._psik)
+
+        self.assertFalse(orbital.psik_ready())
+        orbital.prefetch(background=True).result()
+        self.assertTrue(orbital.psik_ready())
+        self.assertIsNotNone(orbital._psik)
+        npt.assert_equal(orbital.psik['data'], self.orbital.psik['data'])
+
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+        npt.assert_equal(orbital.get_kmap(E_kin=30, dk=0.1).data,
+                         self.orbital.get_kmap(E_kin=30, dk=0.1).data)
+
+    def test_shell_storage(self):
+
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50,
+                          E_kin_min=35)
+
+        self.assertIsNone(orbital.psik['data'])
+        self.assertLess(orbital.psik['data_interp'].nbytes,
+                        0.75 * self.orbital.psik['data'].nbytes)
+
+        for kwargs in [{'E_kin': 35, 'dk': 0.1},
+                       {'E_kin': 50, 'dk': 0.15, 'phi': 12, 'theta': -21,
+                        'psi': 40, 'Ak_type': 'toroid'}]:
+            npt.assert_equal(orbital.get_kmap(**kwargs).data,
+                             self.orbital.get_kmap(**kwargs).data)
+
+        data = orbital.get_psik_data()
+        inside = data != 0
+        npt.assert_equal(data[inside], self.orbital.psik['data'][inside])
+
+    def test_compute_3DFTs(self):
+
+        orbitals = [Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+                    for i in range(3)]
+        orbitals[1].psi['data'] = np.flip(orbitals[1].psi['data'], 0)
+        # Orbital on a different grid is transformed separately
+        orbitals[2].psi['data'] = orbitals[2].psi['data'][:-1]
+        orbitals[2].psi['nx'] -= 1
+
+        Orbital.compute_3DFTs(orbitals + orbitals[:1], memory=0)
+
+        for orbital in orbitals:
+            expected = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+            expected.psi = orbital.psi
+            npt.assert_allclose(orbital.psik['data'],
+                                expected.psik['data'], rtol=1e-12)
+
+        self.assertIs(orbitals[0].psik['kx'], orbitals[1].psik['kx'])
+        npt.assert_equal(orbitals[0].psik['data'],
+                         self.orbital.psik['data'])
+
+    def test_direct_engine(self):
+
+        orbital = Orbital(self.cubefile, engine='direct', kmap_cache_size=0)
+        data = orbital.psi['data']
+        spacing = np.array([orbital.psi['dx'], orbital.psi['dy'],
+                            orbital.psi['dz']])
+        norm = (2 * np.pi)**3 / np.prod(spacing) * np.vdot(data, data).real
+
+        # Evaluated exactly (compared to the transform at arbitrary
+        # points), for axis permutations as well as other orientations
+        for angles in [(0, 0, 0), (90, 0, 90), (180, 90, -90),
+                       (10, 30, -20)]:
+            result = orbital.get_kmap(30, 0.3, *angles).data
+            mask = orbital.kmap['mask']
+            points = np.stack([orbital.kmap['KX'][mask],
+                               orbital.kmap['KY'][mask],
+                               orbital.kmap['KZ'][mask]], axis=1)
+            r = compute_Euler_matrix(*angles)
+            expected = np.full(mask.shape, np.nan)
+            expected[mask] = np.abs(direct_transform(
+                data, spacing, points @ r))**2 / norm
+
+            npt.assert_allclose(result, expected, rtol=1e-10,
+                                atol=1e-12 * np.nanmax(expected))
+
+        self.assertIsNone(orbital._psik)
+
+        # Continuous at axis permutations
+        npt.assert_allclose(orbital.get_kmap(30, 0.3, 90, 0, 90).data,
+                            orbital.get_kmap(30, 0.3, 90, 1e-6, 90).data,
+                            rtol=1e-6, atol=1e-12)
+
+    def test_get_bonds(self):
+
+        bonds = self.orbital.get_bonds()
+        # Pentacene has 26 C-C and 14 C-H bonds
+        self.assertEqual(bonds.shape, (40, 2, 3))
+        self.assertIs(self.orbital.get_bonds(), bonds)
+
+        spacing = [self.orbital.psi['dx'], self.orbital.psi['dy'],
+                   self.orbital.psi['dz']]
+        lengths = np.linalg.norm((bonds[:, 0] - bonds[:, 1]) * spacing,
+                                 axis=1)
+        self.assertTrue(np.all((lengths > 1.0) & (lengths < 1.5)))
+
+        self.assertEqual(len(self.orbital.get_bonds(upper_factor=0.5)), 0)
+
+    def test_pickle(self):
+
+        kwargs = {'E_kin': 30, 'dk': 0.1, 'phi': 10, 'theta': 20, 'psi': 30}
+        expected = self.orbital.get_kmap(**kwargs).data
+
+        for E_kin_min in (None, 20):
+            orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50,
+                              E_kin_min=E_kin_min)
+            orbital.get_kmap(**kwargs)
+            size = len(pickle.dumps(orbital))
+
+            orbital.share_psik()
+            shared = pickle.dumps(orbital)
+            self.assertLess(len(shared), size)
+            self.assertLess(len(shared),
+                            1.2 * orbital.psi['data'].nbytes)
+
+            # Also an unpickled orbital pickled again before its 3D-FT
+            # is restored (still only referencing it)
+            self.assertLess(len(pickle.dumps(pickle.loads(shared))),
+                            1.2 * orbital.psi['data'].nbytes)
+            for copy in (pickle.loads(shared),
+                         pickle.loads(pickle.dumps(pickle.loads(shared)))):
+                self.assertIsNone(copy._psik)
+                npt.assert_equal(copy.get_kmap(**kwargs).data,
+                                 orbital.get_kmap(**kwargs).data)
+
+            if E_kin_min is None:
+                npt.assert_equal(copy.get_kmap(**kwargs).data, expected)
+
     def test_check_new_cut(self):
 
         sums_expected = [202.12975607342722, 17.171157851335725,
@@ -208,7 +424,7 @@ class TestOrbital(unittest.TestCase):
         kmaps.append(self.orbital.get_kmap(E_kin=20,dk=(kx,ky)))
 
         for kmap, sum_expected in zip(kmaps, sums_expected):
-            npt.assert_almost_equal(np.nansum(kmap.data), sum_expected, decimal=13)
+            npt.assert_allclose(np.nansum(kmap.data), sum_expected, rtol=1e-12)
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,26 @@
+import os
 import unittest
+import tempfile
+import numpy.testing as npt
 from kmap.library.orbitaldata import OrbitalData
+from kmap.library.cubefile import load_cube
+from kmap.library.orbitalregistry import _total
+from kmap.config.config import config
 from kmap import __directory__
 
 
 class TestOrbitalData(unittest.TestCase):
 
+    def setUp(self):
+        # Keep the disk cache of the tests out of the user's cache
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_directory = config.get_key('cache', 'directory')
+        config.set_key('cache', 'directory', self.directory.name)
+
+    def tearDown(self):
+        config.set_key('cache', 'directory', self.cache_directory)
+        self.directory.cleanup()
+
     def test_default_initialization(self):
         name = 'Test'
         ID = 1
@@ -30,6 +46,42 @@ class TestOrbitalData(unittest.TestCase):
             'origin': 'Cube file generated by NWChem',
             'alias': 'pentacene_MO_73'})
 
+    def test_cached_initialization(self):
+        path = __directory__ / '../example/data/' / '5A_MO_73.cube'
+        first = OrbitalData.init_from_file(path, 1)
+        second = OrbitalData.init_from_file(path, 2)
+
+        self.assertEqual(first.hash, second.hash)
+        self.assertTrue(os.listdir(self.directory.name))
+        npt.assert_equal(second.psik['data'], first.psik['data'])
+        npt.assert_equal(second.psik['kx'], first.psik['kx'])
+        npt.assert_equal(second.get_kmap(E_kin=30, dk=0.1).data,
+                         first.get_kmap(E_kin=30, dk=0.1).data)
+
+    def test_shared_initialization(self):
+        path = __directory__ / '../example/data/' / '5A_MO_73.cube'
+        first = OrbitalData.init_from_file(path, 1)
+        with open(path) as file:
+            second = OrbitalData(load_cube(file), 2)
+
+        # One read-only real space and k-space volume for both
+        self.assertIs(second.psi['data'], first.psi['data'])
+        self.assertIs(second.psik['data_interp'],
+                      first.psik['data_interp'])
+        self.assertFalse(first.psik['data'].flags.writeable)
+        self.assertFalse(first.psi['data'].flags.writeable)
+        # ... counted once by the registry
+        self.assertEqual(_total([first, second]),
+                         first.memory_usage()['total'] +
+                         second.memory_usage()['kmaps'])
+
+        # Per orbital parameters stay separate
+        kmap = first.get_kmap(E_kin=30, dk=0.1, phi=90).data
+        npt.assert_equal(second.get_kmap(E_kin=30, dk=0.1).data,
+                         first.get_kmap(E_kin=30, dk=0.1).data)
+        npt.assert_equal(first.get_kmap(E_kin=30, dk=0.1, phi=90).data,
+                         kmap)
+
     def test_online_initialization(self):
         ID = 1
         data = OrbitalData.init_from_online('http://143.50.77.12/' +
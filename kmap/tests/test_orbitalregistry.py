@@ -0,0 +1,99 @@
+import os
+import unittest
+import numpy as np
+import numpy.testing as npt
+from kmap import __directory__
+from kmap.library.orbital import Orbital
+from kmap.library.orbitalregistry import orbital_registry
+
+
+class TestOrbitalRegistry(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = __directory__ / 'tests/input/pentacene_HOMO.cube'
+        with open(cls.path) as file:
+            cls.cubefile = file.read()
+
+    def tearDown(self):
+        orbital_registry.max_size = None
+        orbital_registry.drop_psi = False
+
+    def test_status(self):
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+        usage = orbital.memory_usage()
+        self.assertEqual(usage['psik'], 0)
+        self.assertEqual(usage['psi'], orbital.psi['data'].nbytes)
+
+        orbital.get_kmap(E_kin=30, dk=0.1)
+        usage = orbital.memory_usage()
+        self.assertEqual(usage['psik'], orbital.psik['data'].nbytes)
+        self.assertEqual(usage['total'], usage['psi'] + usage['psik'] +
+                         usage['kmaps'])
+
+        status = orbital_registry.status()
+        self.assertIs(status[-1]['orbital'], orbital)
+        self.assertEqual(status[-1]['total'], usage['total'])
+        self.assertGreaterEqual(orbital_registry.info()['total'],
+                                usage['total'])
+
+    @unittest.skipUnless(os.path.isdir('/dev/shm'), 'no shared memory')
+    def test_shared_memory(self):
+        orbital = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+        orbital.share_psik()
+        filename = orbital.psik['data'].filename
+
+        # Memory mapped from shared memory, still in RAM
+        self.assertTrue(filename.startswith('/dev/shm'))
+        self.assertEqual(orbital.memory_usage()['psik'],
+                         orbital.psik['data'].nbytes)
+        self.assertGreaterEqual(orbital_registry.info()['total'],
+                                orbital.psik['data'].nbytes)
+
+        self.assertTrue(orbital.release())
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(orbital.memory_usage()['psik'], 0)
+
+    def test_budget(self):
+        # Free 3D-FTs of orbitals from other tests
+        for orbital in orbital_registry.orbitals():
+            orbital.release()
+
+        orbitals = [Orbital(self.cubefile, dk3D=0.15, E_kin_max=50,
+                            kmap_cache_size=0) for i in range(3)]
+        expected = orbitals[0].get_kmap(E_kin=30, dk=0.1).data
+        psik = orbitals[0].memory_usage()['psik']
+
+        # Room for only two 3D-FTs
+        orbital_registry.max_size = (orbital_registry.info()['total'] +
+                                     1.5 * psik) / 1024**2
+        for orbital in orbitals[1:]:
+            orbital.get_kmap(E_kin=30, dk=0.1)
+
+        self.assertEqual(orbitals[0].memory_usage()['psik'], 0)
+        self.assertGreater(orbitals[2].memory_usage()['psik'], 0)
+        self.assertLessEqual(orbital_registry.info()['total'],
+                             orbital_registry.max_size * 1024**2)
+
+        # Computed again transparently
+        npt.assert_equal(orbitals[0].get_kmap(E_kin=30, dk=0.1,
+                                              phi=10).data,
+                         orbitals[2].get_kmap(E_kin=30, dk=0.1,
+                                              phi=10).data)
+        npt.assert_equal(orbitals[0].get_kmap(E_kin=30, dk=0.1).data,
+                         expected)
+
+    def test_drop_psi(self):
+        from_file = Orbital(self.path, dk3D=0.15, E_kin_max=50)
+        from_string = Orbital(self.cubefile, dk3D=0.15, E_kin_max=50)
+        data = np.array(from_file.psi['data'])
+
+        self.assertTrue(from_file.release(psi=True))
+        self.assertFalse(from_string.release(psi=True))
+        self.assertEqual(from_file.memory_usage()['total'], 0)
+
+        npt.assert_equal(from_file.psi['data'], data)
+
+
+if __name__ == '__main__':
+    unittest.main()
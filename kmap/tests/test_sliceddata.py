@@ -1,8 +1,12 @@
 import unittest
 import os
+import gc
+import tempfile
+import h5py
 import numpy as np
 import numpy.testing as npt
 from kmap import __directory__
+from kmap.library.orbital import Orbital
 from kmap.library.sliceddata import SlicedData
 
 
@@ -29,6 +33,181 @@ class TestSlicedData(unittest.TestCase):
                                                  'sym_anglemin': '0.0',
                                                  'symmode': '2-fold'})
 
+    def test_lazy_hdf5(self):
+        data = np.random.rand(4, 5, 6)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.hdf5')
+            with h5py.File(path, 'w') as file:
+                file.create_dataset('name', data='lazy')
+                for i, n in enumerate(data.shape, 1):
+                    file.create_dataset('axis_%i_label' % i, data='x%i' % i)
+                    file.create_dataset('axis_%i_units' % i, data='a')
+                    file.create_dataset('axis_%i_range' % i, data=[0, n])
+
+                file.create_dataset('data', data=data)
+
+            eager = SlicedData.init_from_hdf5(path)
+            lazy = SlicedData.init_from_hdf5(path, lazy=True)
+            self.assertIsInstance(lazy.data, h5py.Dataset)
+
+            for axes_order in [[0, 1, 2], [1, 0, 2], [2, 0, 1]]:
+                eager.transpose(axes_order)
+                lazy.transpose(axes_order)
+                for axis in range(3):
+                    expected = eager.slice_from_index(3, axis)
+                    result = lazy.slice_from_index(3, axis)
+                    npt.assert_equal(result.data, expected.data)
+                    npt.assert_equal(result.range, expected.range)
+
+            file = lazy._file
+            lazy.close()
+            self.assertFalse(file)
+
+            # Also closed if the SlicedData is discarded
+            lazy = SlicedData.init_from_hdf5(path, lazy=True)
+            file = lazy._file
+            del lazy
+            gc.collect()
+            self.assertFalse(file)
+
+    def test_lazy_memmap(self):
+        data = np.random.rand(4, 5, 6)
+        axes = [['x', 'a', [0, 1]], ['y', 'a', [0, 1]], ['z', 'a', [0, 1]]]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.npy')
+            np.save(path, data)
+            mapped = np.load(path, mmap_mode='r')
+            sliced_data = SlicedData('memmap', *axes, mapped, lazy=True)
+            self.assertIs(sliced_data.data, mapped)
+
+            sliced_data.transpose([2, 1, 0])
+            npt.assert_equal(sliced_data.slice_from_index(1, 0).data,
+                             data[:, :, 1].T)
+            npt.assert_equal(sliced_data.slice_from_index(2, 2).data,
+                             data[2, :, :].T)
+            del sliced_data, mapped
+
+    def test_dtype(self):
+        data = np.arange(120, dtype=np.uint16).reshape(4, 5, 6)
+        axes = [['x', 'a', [0, 1]], ['y', 'a', [0, 1]], ['z', 'a', [0, 1]]]
+
+        for dtype, expected in [('float64', np.float64),
+                                ('float32', np.float32),
+                                ('native', np.uint16)]:
+            sliced_data = SlicedData('dtype', *axes, data, dtype=dtype)
+            self.assertEqual(sliced_data.data.dtype, expected)
+
+            plot_data = sliced_data.slice_from_index(1, axis=2)
+            self.assertEqual(plot_data.data.dtype, np.float64)
+            npt.assert_equal(plot_data.data, data[:, :, 1])
+
+        self.assertRaises(ValueError, SlicedData, 'dtype', *axes, data,
+                          dtype='int8')
+
+    def test_axis_copy(self):
+        data = np.random.rand(4, 5, 6)
+        axes = [['x', 'a', [0, 1]], ['y', 'a', [0, 1]], ['z', 'a', [0, 1]]]
+        sliced_data = SlicedData('copy', *axes, data)
+        expected = SlicedData('copy', *axes, data)
+
+        # No copies by default
+        self.assertFalse(sliced_data.build_axis_copy(2))
+        # Slices along the first axis are contiguous already
+        sliced_data.axis_cache_size = 1
+        self.assertFalse(sliced_data.build_axis_copy(0))
+
+        for axes_order in [[0, 1, 2], [2, 0, 1], [1, 2, 0]]:
+            sliced_data.transpose(axes_order)
+            expected.transpose(axes_order)
+            for axis in range(3):
+                sliced_data.build_axis_copy(axis, block=True)
+                npt.assert_equal(sliced_data.get_slice(2, axis),
+                                 expected.get_slice(2, axis))
+
+        self.assertEqual(len(sliced_data._axis_cache), 2)
+        self.assertTrue(sliced_data.get_slice(2, 2).flags.c_contiguous)
+
+        # Copies not fitting into the memory are never built
+        sliced_data = SlicedData('copy', *axes, data)
+        sliced_data.axis_cache_size = data.nbytes / 1024**2 * 1.5
+        self.assertTrue(sliced_data.build_axis_copy(1, block=True))
+        self.assertTrue(sliced_data.build_axis_copy(2, block=True))
+        self.assertEqual(list(sliced_data._axis_cache), [2])
+        sliced_data.axis_cache_size = data.nbytes / 1024**2 / 2
+        sliced_data._axis_cache.clear()
+        self.assertFalse(sliced_data.build_axis_copy(1))
+
+        # A copy finished after closing is discarded
+        sliced_data = SlicedData('copy', *axes, data)
+        sliced_data.close()
+        with self.assertNoLogs('kmap'):
+            sliced_data._build_axis_copy(1)
+        self.assertEqual(sliced_data._axis_cache, {})
+
+    def test_initialization_from_orbitals(self):
+        path = __directory__ / 'tests/input/pentacene_HOMO.cube'
+        url = path.as_uri()
+        orbitals = [[url, {'name': 'HOMO', 'energy': -5.0}],
+                    [url, {'name': 'HOMO 2', 'energy': -6.0}]]
+        parameters = [35.0, -4.0, 0.5, 0.1, 0, 0, 0, 'toroid', 'p', 40, 0,
+                      'auto', 'no']
+
+        serial = SlicedData.init_from_orbitals('orbitals', orbitals,
+                                               parameters)
+        parallel = SlicedData.init_from_orbitals('orbitals', orbitals,
+                                                 parameters, processes=2)
+        npt.assert_allclose(parallel.data, serial.data, rtol=1e-12)
+
+        # Compare with the kmaps of the orbitals weighted by hand
+        BE = serial.axes[0].axis
+        k_grid = serial.axes[1].axis
+        index = np.argmin(abs(BE + 1.3))
+        orbital = Orbital(str(path))
+        expected = 0
+        for BE0 in [-1, -2]:
+            kmap = orbital.get_kmap(35 - 4 + BE0, 0.1, 0, 0, 0, 'toroid', 'p',
+                                    40, 0, 'auto', 'no')
+            kmap.interpolate(k_grid, k_grid, update=True)
+            weight = np.exp(-(BE[index] - BE0)**2 / 0.5) / \
+                np.sqrt(2 * np.pi * 0.25)
+            expected = expected + weight * np.nan_to_num(kmap.data)
+
+        inside = np.isfinite(serial.data[index])
+        self.assertTrue(np.isnan(serial.data[index]).any())
+        npt.assert_allclose(serial.data[index][inside], expected[inside],
+                            rtol=1e-10, atol=1e-12 * expected.max())
+
+    def test_initialization_from_orbital_photonenergy(self):
+        path = __directory__ / 'tests/input/pentacene_HOMO.cube'
+        orbital = [[path.as_uri(), {'name': 'HOMO', 'energy': -5.0}]]
+        parameters = [20, 30, 2, -4.0, 0.2, 0, 0, 0, 'toroid', 'p', 40, 0,
+                      'auto', 'no']
+
+        progress = []
+        sliced_data = SlicedData.init_from_orbital_photonenergy(
+            'series', orbital, parameters, batch_size=2,
+            progress=lambda *args: progress.append(args))
+        self.assertEqual(progress, [(2, 5), (4, 5), (5, 5)])
+
+        # Compare with all kmaps computed at once
+        k_grid = sliced_data.axes[1].axis
+        expected, _ = Orbital(str(path)).get_kmaps(
+            np.arange(20, 30, 2) - 5, (k_grid, k_grid), Ak_type='toroid',
+            alpha=40, beta=0, gamma='auto')
+        npt.assert_equal(sliced_data.data, expected)
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'series.hdf5')
+            lazy = SlicedData.init_from_orbital_photonenergy(
+                'series', orbital, parameters, file_path=file_path,
+                batch_size=3)
+            self.assertTrue(lazy.lazy)
+            npt.assert_equal(lazy.data[()], expected)
+            self.assertEqual(lazy.meta_data['Symmetrization'], 'no')
+            lazy.close()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+import numpy.testing as npt
+from scipy.ndimage import rotate
+from kmap.library.symmetrization import Symmetrizer, get_symmetrizer
+
+
+class TestSymmetrization(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.data = rng.random((25, 31))
+        cls.data[0, :3] = np.nan
+
+    def test_rotations(self):
+        # Same as the sum of rotated copies by scipy.ndimage.rotate
+        for symmetrization, angles in [('2-fold', [180]),
+                                       ('3-fold', [120, 240]),
+                                       ('4-fold', [90, 180, 270])]:
+            expected = self.data.copy()
+            expected += sum(rotate(np.nan_to_num(self.data), angle,
+                                   reshape=False) for angle in angles)
+            expected /= len(angles) + 1
+
+            result = Symmetrizer(self.data.shape, symmetrization)(
+                self.data.copy())
+
+            npt.assert_allclose(result, expected, rtol=1e-12, atol=1e-14)
+
+    def test_exact_remapping(self):
+        data = np.nan_to_num(self.data[:, :25])
+        symmetrizer = Symmetrizer(data.shape, '4-fold+mirror')
+
+        self.assertIsNone(symmetrizer.spline)
+
+        result = symmetrizer(data.copy())
+        npt.assert_allclose(result, np.rot90(result), rtol=1e-14)
+        npt.assert_allclose(result, np.flip(result, 0), rtol=1e-14)
+
+    def test_get_symmetrizer(self):
+        symmetrizer = get_symmetrizer((10, 12), '3-fold+mirror')
+
+        self.assertIs(get_symmetrizer((10, 12), '3-fold+mirror'),
+                      symmetrizer)
+        self.assertIsNot(get_symmetrizer((12, 10), '3-fold+mirror'),
+                         symmetrizer)
+        with self.assertRaises(ValueError):
+            Symmetrizer((10, 12), '5-fold')
+
+
+if __name__ == '__main__':
+    unittest.main()
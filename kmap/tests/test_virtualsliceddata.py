@@ -0,0 +1,74 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import numpy.testing as npt
+from kmap import __directory__
+from kmap.library.sliceddata import SlicedData
+from kmap.library.virtualsliceddata import VirtualSlicedData
+from kmap.library.hdf5writer import write_hdf5
+
+
+class TestVirtualSlicedData(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        url = (__directory__ / 'tests/input/pentacene_HOMO.cube').as_uri()
+        cls.orbitals = [[url, {'name': 'HOMO', 'energy': -5.0}],
+                        [url, {'name': 'HOMO 2', 'energy': -5.5}]]
+        cls.parameters = [35.0, -4.0, 0.3, 0.1, 0, 0, 0, 'toroid', 'p', 40,
+                          0, 'auto', 'no']
+
+        cls.dense = SlicedData.init_from_orbitals('orbitals', cls.orbitals,
+                                                  cls.parameters)
+
+    def setUp(self):
+        self.virtual = VirtualSlicedData.init_from_orbitals(
+            'orbitals', self.orbitals, self.parameters)
+
+    def test_slices(self):
+        self.assertLess(self.virtual.data.kmaps.nbytes,
+                        self.dense.data.nbytes)
+
+        for axes_order in [[0, 1, 2], [1, 2, 0], [0, 2, 1]]:
+            self.virtual.transpose(axes_order)
+            self.dense.transpose(axes_order)
+            for axis in range(3):
+                for index in [0, 7, 20]:
+                    npt.assert_allclose(
+                        self.virtual.slice_from_index(index, axis).data,
+                        self.dense.slice_from_index(index, axis).data,
+                        rtol=1e-12, atol=1e-20)
+
+        # The data of virtual SlicedData itself is never transposed
+        self.dense.transpose([1, 0, 2])
+        npt.assert_allclose(np.asarray(self.virtual.data),
+                            self.dense.data, rtol=1e-12, atol=1e-20)
+
+    def test_energy_broadening(self):
+        self.virtual.set_energy_broadening(0.1)
+        self.assertEqual(self.virtual.meta_data['Energy broadening (eV)'],
+                         0.1)
+
+        BE = self.virtual.axes[0].axis
+        kmaps = self.virtual.data.kmaps
+        weights = np.exp(-(BE[5] - np.array([-1, -1.5]))**2 / 0.02) / \
+            np.sqrt(2 * np.pi * 0.01)
+        expected = np.tensordot(weights, kmaps, axes=1)
+        result = self.virtual.slice_from_index(5).data
+        inside = np.isfinite(result)
+        npt.assert_allclose(result[inside], expected[inside], rtol=1e-12)
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'virtual.hdf5')
+            write_hdf5(path, self.virtual)
+            result = SlicedData.init_from_hdf5(path, meta_data={})
+
+        npt.assert_allclose(result.data, self.dense.data, rtol=1e-12,
+                            atol=1e-20)
+        npt.assert_equal(result.axes[0].range, self.dense.axes[0].range)
+
+
+if __name__ == '__main__':
+    unittest.main()